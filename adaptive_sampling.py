@@ -0,0 +1,247 @@
+import os
+import time
+import threading
+from statistics import NormalDist
+import cv2
+import numpy as np
+from frame_features import pixel_size
+from logs import get_logger
+
+# 'sequential' averages every sampled frame in the shared decode; 'adaptive'
+# draws frames in stratified random order and stops once the score is precise enough
+DEFAULT_SAMPLING = os.environ.get('FRAME_SAMPLING', 'sequential')
+SAMPLING_MODES = ('sequential', 'adaptive')
+
+ADAPTIVE_TOLERANCE = float(os.environ.get('ADAPTIVE_TOLERANCE', 0.5))  # Width of the score interval, in points
+ADAPTIVE_CONFIDENCE = float(os.environ.get('ADAPTIVE_CONFIDENCE', 0.95))
+ADAPTIVE_MIN_SAMPLES = int(os.environ.get('ADAPTIVE_MIN_SAMPLES', 32))
+
+log = get_logger(__name__)
+
+
+class RunningStats:
+    """Welford's running mean and variance of a vector of statistics."""
+
+    def __init__(self, size):
+        self.n = 0
+        self.mean = np.zeros(size)
+        self.m2 = np.zeros(size)
+
+    def add(self, values):
+        self.n += 1
+        delta = values - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (values - self.mean)
+
+    def variance(self):
+        return self.m2 / (self.n - 1) if self.n > 1 else np.full_like(self.m2, np.inf)
+
+    def stderr(self, population=None):
+        """Standard error of the mean, finite-population corrected when sampling population values without replacement."""
+        correction = max(0.0, 1 - self.n / population) if population else 1.0
+        return np.sqrt(self.variance() / self.n * correction)
+
+
+def stratified_order(size, rng):
+    """
+    Visit order of range(size) in which every prefix is spread evenly over
+    the range: it is cut into a power of two of strata, visited in
+    bit-reversed order (halves, then quarters, ...), taking a random
+    unvisited element of each stratum per pass.
+    """
+    if size == 0:
+        return []
+    bits = size.bit_length() - 1
+    strata = 1 << bits
+    bounds = [size * s // strata for s in range(strata + 1)]
+    members = [rng.permutation(np.arange(bounds[s], bounds[s + 1])) for s in range(strata)]
+    visit = [int(format(s, f'0{bits}b')[::-1], 2) if bits else 0 for s in range(strata)]
+
+    order = []
+    for position in range(max(len(m) for m in members)):
+        order.extend(int(members[s][position]) for s in visit if position < len(members[s]))
+    return order
+
+
+class SeekingReader:
+    """
+    cv2.VideoCapture that reads frames by index. A seek decodes from the
+    previous keyframe, so gaps are grabbed through instead whenever that is
+    expected to be cheaper, judged by the average cost of the seeks and
+    grabs so far.
+    """
+
+    def __init__(self, video_path):
+        self.cap = cv2.VideoCapture(video_path)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.position = 0
+        self.decode_time = 0.0
+        self.frames_read = 0
+        self.seeks = [0, 0.0]  # Count, seconds
+        self.grabs = [0, 0.0]
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def _should_seek(self, gap):
+        if gap < 0:
+            return True
+        if gap == 0:
+            return False
+        if self.seeks[0] == 0 or self.grabs[0] == 0:
+            return gap > self.fps  # Until both have been timed, grab through up to a second
+        return gap * self.grabs[1] / self.grabs[0] > self.seeks[1] / self.seeks[0]
+
+    def read(self, index):
+        """BGR frame at index, or None past the end."""
+        t0 = time.time()
+        try:
+            if self._should_seek(index - self.position):
+                self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+                self.position = index
+                self.seeks[0] += 1
+                self.seeks[1] += time.time() - t0
+            elif self.position < index:
+                t1 = time.time()
+                while self.position < index:
+                    self.cap.grab()
+                    self.position += 1
+                    self.grabs[0] += 1
+                self.grabs[1] += time.time() - t1
+            ret, frame = self.cap.read()
+            self.position += 1
+            if ret:
+                self.frames_read += 1
+            return frame if ret else None
+        finally:
+            self.decode_time += time.time() - t0
+
+    def release(self):
+        self.cap.release()
+
+
+def resized(frame, size):
+    """frame at a size request, the same dimensions FeatureGraph would give it."""
+    dims = pixel_size((frame.shape[1], frame.shape[0]), size)
+    return frame if dims == (frame.shape[1], frame.shape[0]) else cv2.resize(frame, dims)
+
+
+class FrameSampler:
+    """
+    Base class for analyzers that average a per-frame statistic and can stop
+    early. Frames are drawn on the same grid a sequential consumer would see
+    (every stride-th frame from offset), in stratified random order, in
+    rounds that add half the draws so far (min_samples to begin with). Each
+    round is read in timeline order. After every round the running means
+    give a confidence interval on the score; sampling stops once it is
+    narrower than tolerance, or when the grid is exhausted, in which case
+    the score equals a sequential pass over the same grid.
+
+    measure() returns the statistics for the grid frame at an index (or None
+    to skip it) and score() turns their means into the 1-10 score. score()
+    must be non-decreasing in every statistic, so the interval's ends are
+    the scores at the ends of the means' intervals.
+    """
+    sample_fps = None
+    stride = 1
+    offset = 0
+    statistics = 1          # Number of values measure() returns
+    fallback_score = 0
+    seed = 0                # Fixed so repeated runs (and cached results) agree
+    elapsed = 0.0
+    frames_processed = 0
+    decode_time = 0.0
+    samples = 0
+    interval = None
+
+    def __init__(self, tolerance=None, confidence=None, min_samples=None):
+        self.tolerance = tolerance if tolerance is not None else ADAPTIVE_TOLERANCE
+        self.confidence = confidence if confidence is not None else ADAPTIVE_CONFIDENCE
+        self.min_samples = min_samples if min_samples is not None else ADAPTIVE_MIN_SAMPLES
+
+    def start(self, fps, frame_count):
+        self.fps = fps
+        self.frame_count = frame_count
+        if self.sample_fps:
+            self.stride = max(1, int(fps / self.sample_fps + 0.5))
+
+    def grid(self):
+        """Frame indices the sampler may draw from."""
+        return range(self.offset, self.frame_count, self.stride)
+
+    def measure(self, reader, index):
+        raise NotImplementedError
+
+    def score(self, means):
+        raise NotImplementedError
+
+
+def run_sampler(video_path, sampler):
+    """
+    Score video_path with a FrameSampler. Stores the number of draws in
+    sampler.samples, the frames it decoded for them in
+    sampler.frames_processed, the final score interval in sampler.interval
+    and, like run_consumers, its busy and decoding time in elapsed and
+    decode_time.
+    """
+    reader = SeekingReader(video_path)
+    if not reader.isOpened():
+        log.error("Error opening video file", video=video_path)
+        return sampler.fallback_score
+
+    t0 = time.time()
+    try:
+        sampler.start(reader.fps, reader.frame_count)
+        grid = sampler.grid()
+        order = stratified_order(len(grid), np.random.default_rng(sampler.seed))
+        stats = RunningStats(sampler.statistics)
+        z = NormalDist().inv_cdf((1 + sampler.confidence) / 2)
+        interval = None
+
+        drawn = 0
+        while drawn < len(order):
+            size = max(sampler.min_samples, drawn // 2)
+            for position in sorted(order[drawn:drawn + size]):
+                values = sampler.measure(reader, grid[position])
+                if values is not None:
+                    stats.add(np.asarray(values, dtype=np.float64))
+            drawn += size
+            if stats.n < 2:
+                continue
+            margin = z * stats.stderr(len(grid))
+            interval = (float(sampler.score(stats.mean - margin)), float(sampler.score(stats.mean + margin)))
+            if interval[1] - interval[0] <= sampler.tolerance:
+                break
+    finally:
+        reader.release()
+
+    sampler.samples = stats.n
+    sampler.frames_processed = reader.frames_read
+    sampler.interval = interval
+    sampler.decode_time = reader.decode_time
+    sampler.elapsed = time.time() - t0 - reader.decode_time
+    if stats.n == 0:
+        return sampler.fallback_score
+    return sampler.score(stats.mean)
+
+
+def run_samplers(video_path, samplers):
+    """Run several FrameSamplers side by side, each with its own reader; returns name -> score."""
+    results = {}
+    errors = []
+
+    def run(name, sampler):
+        try:
+            results[name] = run_sampler(video_path, sampler)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=item, daemon=True) for item in samplers.items()]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
@@ -0,0 +1,151 @@
+import os
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from frame_source import plan_segments
+from logs import get_logger
+
+# 'thread' runs every analyzer inside the web process (the original behaviour),
+# 'process' sends them to a persistent pool of warm worker processes. Either
+# way one pool of ANALYSIS_WORKERS runs the analyzers of every video in
+# flight, so concurrent requests and batches share the cores.
+ANALYSIS_EXECUTOR = os.environ.get('ANALYSIS_EXECUTOR', 'thread')
+ANALYSIS_WORKERS = int(os.environ.get('ANALYSIS_WORKERS', os.cpu_count() or 1))
+
+# 'analyzer' splits a video's work by analyzer (see VIDEO_GROUPS); 'segment'
+# splits its timeline, so one long video can use every worker. Segments are
+# at least SEGMENT_MIN_SECONDS long, shorter videos are analyzed in one piece.
+ANALYSIS_SPLIT = os.environ.get('ANALYSIS_SPLIT', 'analyzer')
+SEGMENT_MIN_SECONDS = float(os.environ.get('SEGMENT_MIN_SECONDS', 60))
+
+# In process mode the video analyzers are split into decode groups so the
+# heavy ones get a core each; every group decodes the video once.
+# Analyzers sharing the optical flow service must stay in the same group.
+VIDEO_GROUPS = [
+    ['scene', 'flash', 'color', 'animation', 'narrative'],
+    ['density'],
+    ['expression'],
+    ['camera', 'fancy'],
+]
+
+log = get_logger(__name__)
+
+_pool = None
+_thread_pool = None
+_manager = None
+_pool_lock = threading.Lock()
+
+
+def _init_worker(cv_threads):
+    """Runs once in every worker process before it accepts jobs."""
+    import cv2
+    cv2.setNumThreads(cv_threads)
+
+    # Importing the analyzers loads the ffmpeg bindings and loudness meter
+    # code, and the Haar cascades are loaded into the worker's pool, once per
+    # worker instead of once per job
+    import analyzers  # noqa: F401
+    from expression_analysis import preload_cascades
+    preload_cascades()
+
+
+def _ping():
+    return os.getpid()
+
+
+def get_process_pool():
+    """Return the shared worker pool, starting and warming it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Split the cores between the workers so OpenCV's own thread pools
+            # don't oversubscribe the machine
+            cv_threads = max(1, (os.cpu_count() or 1) // ANALYSIS_WORKERS)
+            _pool = ProcessPoolExecutor(
+                max_workers=ANALYSIS_WORKERS,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(cv_threads,)
+            )
+            warm = [_pool.submit(_ping) for _ in range(ANALYSIS_WORKERS)]
+            pids = {f.result() for f in warm}
+            log.info("🔥 Started warm analysis workers", workers=len(pids), opencv_threads=cv_threads)
+        return _pool
+
+
+def get_thread_pool():
+    """Return the shared pool of ANALYSIS_WORKERS threads the analyzers run on in thread mode."""
+    global _thread_pool
+    with _pool_lock:
+        if _thread_pool is None:
+            _thread_pool = ThreadPoolExecutor(max_workers=ANALYSIS_WORKERS, thread_name_prefix='analysis')
+        return _thread_pool
+
+
+def new_progress():
+    """
+    A dict the analyzers can report progress into from wherever they run:
+    a plain dict in thread mode, a manager-backed proxy in process mode.
+    """
+    global _manager
+    if ANALYSIS_EXECUTOR != 'process':
+        return {}
+    with _pool_lock:
+        if _manager is None:
+            _manager = multiprocessing.get_context('spawn').Manager()
+    return _manager.dict()
+
+
+def run_all_analyzers(video_path, keys=None, progress=None, source=None, profile=None):
+    """
+    Run every analyzer (or only those in keys) on video_path with the
+    configured executor. Returns (scores, timings, signals), see
+    analyzers.run_video_analyzers.
+    progress, if given, should come from new_progress(). source overrides
+    the frame source of the video analyzers, profile picks the speed/accuracy
+    settings (see profiles.PROFILES).
+    """
+    from analyzers import (run_video_analyzers, run_video_segments, stream_audio_analyzers,
+                           finish_remote_audio, VIDEO_ANALYZERS, AUDIO_ANALYZERS)
+    from async_io import submit
+
+    keys = keys or list(VIDEO_ANALYZERS) + list(AUDIO_ANALYZERS)
+    workers = ANALYSIS_WORKERS
+    if ANALYSIS_EXECUTOR == 'process':
+        executor = get_process_pool()
+        video_groups = [[k for k in group if k in keys] for group in VIDEO_GROUPS]
+    else:
+        executor = get_thread_pool()
+        video_groups = [[k for k in VIDEO_ANALYZERS if k in keys]]  # One decode for all video analyzers
+    video_keys = [k for k in VIDEO_ANALYZERS if k in keys]
+    plan = None
+    if ANALYSIS_SPLIT == 'segment' and video_keys and source != 'growing':  # Downloads are read front to back
+        plan = plan_segments(video_path, workers, SEGMENT_MIN_SECONDS)
+
+    futures = []
+    audio_keys = [k for k in AUDIO_ANALYZERS if k in keys]
+    if audio_keys:
+        # One task per request, so the soundtrack is only decoded once. Remote
+        # ASR is awaited on this process's event loop, not in a pool slot
+        streamed = executor.submit(stream_audio_analyzers, video_path, audio_keys, progress, profile)
+        futures.append(submit(finish_remote_audio(streamed, profile, progress)))
+
+    scores = {}
+    timings = {}
+    signals = {}
+    if plan is not None and len(plan[2]) > 1:
+        group_scores, group_timings, group_signals = run_video_segments(video_path, video_keys, plan,
+                                                                        executor.submit, progress, profile)
+        scores.update(group_scores)
+        timings.update(group_timings)
+        signals.update(group_signals)
+    else:
+        futures.extend(executor.submit(run_video_analyzers, video_path, group, progress, source, profile)
+                       for group in video_groups if group)
+
+    for future in futures:
+        group_scores, group_timings, group_signals = future.result()
+        scores.update(group_scores)
+        timings.update(group_timings)
+        signals.update(group_signals)
+    return scores, timings, signals
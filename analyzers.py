@@ -0,0 +1,416 @@
+import time
+import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import frame_source
+from frame_source import run_consumers
+from adaptive_sampling import FrameSampler, run_samplers, DEFAULT_SAMPLING, SAMPLING_MODES
+from optical_flow import FlowService
+from scene_change_analysis import SceneChangeConsumer
+from flash_score_analysis import FlashConsumer
+from camera_movement_analysis import CameraMovementConsumer, CameraMovementSampler
+from color_score_analysis import ColorConsumer, ColorSampler
+from density_score_analysis import DensityConsumer
+from animation_analysis import AnimationTransitionConsumer
+from expression_analysis import FacialExpressionConsumer
+from fantastical_content_analysis import FantasticalContentConsumer
+from narrative_coherence_analysis import NarrativeCoherenceConsumer
+from audio_source import run_audio_consumers
+from audio_overwhelm_analysis import AudioOverwhelmConsumer
+from speech_rate_analysis import SpeechRateConsumer
+from profiles import profile_settings
+from logs import get_logger
+from metrics import observe_analyzer, ANALYSIS_FAILURES
+
+log = get_logger(__name__)
+
+# Result key -> display name, in the order they are reported
+VIDEO_ANALYZERS = {
+    'scene': 'Scene Change',
+    'camera': 'Camera Movement',
+    'flash': 'Flashing Effects',
+    'color': 'Color Score',
+    'density': 'Object Density',
+    'animation': 'Animation',
+    'expression': 'Facial Expression Intensity',
+    'fancy': 'Fantastical Content',
+    'narrative': 'Narrative Coherence',
+}
+
+AUDIO_ANALYZERS = {
+    'audio': 'Audio Overwhelm',
+    'speech_rate': 'Speech Rate',
+}
+
+# Bump an analyzer's version whenever its scoring logic changes in a way its
+# parameters don't capture, so cached results for it are recomputed
+ANALYZER_VERSIONS = {
+    'scene': 1,
+    'camera': 1,
+    'flash': 1,
+    'color': 1,
+    'density': 1,
+    'animation': 1,
+    'expression': 1,
+    'fancy': 2,
+    'narrative': 2,
+    'audio': 3,
+    'speech_rate': 1,
+}
+
+
+def video_consumers(keys=None, profile=None, sampling=None):
+    """
+    Build fresh frame consumers for the given video analyzer keys, configured by a profile.
+    In 'adaptive' sampling, camera and color, which average a statistic of
+    independent frames, get a FrameSampler instead (see adaptive_sampling).
+    Density stays sequential: its background model depends on every frame
+    before the one it scores.
+    """
+    keys = keys or list(VIDEO_ANALYZERS)
+    settings = profile_settings(profile)
+    sampling = sampling or DEFAULT_SAMPLING
+    if sampling not in SAMPLING_MODES:
+        raise ValueError(f"Unknown frame sampling: {sampling}")
+    flow = FlowService(**settings.get('flow', {}))
+    factories = {
+        'scene': lambda **kw: SceneChangeConsumer(**kw),
+        'camera': lambda **kw: CameraMovementConsumer(flow, **kw),
+        'flash': lambda **kw: FlashConsumer(**kw),
+        'color': lambda **kw: ColorConsumer(**kw),
+        'density': lambda **kw: DensityConsumer(**kw),
+        'animation': lambda **kw: AnimationTransitionConsumer(**kw),
+        'expression': lambda **kw: FacialExpressionConsumer(**kw),
+        'fancy': lambda **kw: FantasticalContentConsumer(**kw),
+        'narrative': lambda **kw: NarrativeCoherenceConsumer(**kw),
+    }
+    if sampling == 'adaptive':
+        factories.update({
+            'camera': lambda **kw: CameraMovementSampler(**settings.get('flow', {}), **kw),
+            'color': lambda **kw: ColorSampler(**kw),
+        })
+    return {key: factories[key](**settings.get(key, {})) for key in keys}
+
+
+def audio_consumers(keys=None, profile=None):
+    """Build fresh audio consumers for the given audio analyzer keys, configured by a profile."""
+    keys = keys or list(AUDIO_ANALYZERS)
+    settings = profile_settings(profile)
+    factories = {
+        'audio': lambda **kw: AudioOverwhelmConsumer(**kw),
+        'speech_rate': lambda **kw: SpeechRateConsumer(**kw),
+    }
+    return {key: factories[key](**settings.get(key, {})) for key in keys}
+
+
+# Attributes a run fills in or that only steer segmented runs, which say
+# nothing about how a consumer scores
+RUN_STATE = ('depends_on', 'elapsed', 'frames_processed', 'decode_time', 'samples', 'interval',
+             'warmup', 'merged', 'segment', 'window')
+
+
+def _simple_params(obj, exclude=()):
+    """Public, JSON-able settings of a consumer (thresholds, sizes, sample rates)."""
+    params = {}
+    for name in dir(obj):
+        value = getattr(obj, name)
+        if name.startswith('_') or name in RUN_STATE or name in exclude or callable(value):
+            continue
+        try:
+            json.dumps(value)
+        except TypeError:
+            continue
+        params[name] = value
+    return params
+
+
+def analyzer_fingerprints(keys=None, profile=None, sampling=None, scoring=True):
+    """
+    Describe every analyzer's version and parameters as a stable string.
+    Two runs with equal fingerprints produce the same score for the same file.
+    Without scoring, the consumers' `scoring` attributes are left out: the
+    fingerprint then describes the signals they extract (see feature_store),
+    which stay valid when only those attributes change.
+    """
+    keys = keys or list(VIDEO_ANALYZERS) + list(AUDIO_ANALYZERS)
+    consumers = video_consumers([k for k in keys if k in VIDEO_ANALYZERS], profile, sampling)
+    consumers.update(audio_consumers([k for k in keys if k in AUDIO_ANALYZERS], profile))
+
+    fingerprints = {}
+    for key in keys:
+        params = {'version': ANALYZER_VERSIONS[key]}
+        params['consumer'] = _simple_params(consumers[key], () if scoring else getattr(consumers[key], 'scoring', ()))
+        if key in VIDEO_ANALYZERS:
+            if not isinstance(consumers[key], FrameSampler):
+                params['frame_source'] = frame_source.FRAME_SOURCE
+            if hasattr(consumers[key], 'flow'):
+                params['flow'] = _simple_params(consumers[key].flow)
+        fingerprints[key] = json.dumps(params, sort_keys=True, default=str)
+    return fingerprints
+
+
+def scorer(key, profile=None, params=None):
+    """
+    The consumer class that scores an analyzer's stored signals, and its
+    scoring attributes under a profile with params overriding any of them.
+    Raises ValueError for anything else in params.
+    """
+    if key in VIDEO_ANALYZERS:
+        consumer = video_consumers([key], profile, 'sequential')[key]
+    elif key in AUDIO_ANALYZERS:
+        consumer = audio_consumers([key], profile)[key]
+    else:
+        raise ValueError(f"Unknown analyzer: {key}")
+    scoring = consumer.scoring_params()
+    for name, value in (params or {}).items():
+        if name not in scoring:
+            raise ValueError(f"{key} has no scoring parameter {name!r}, expected one of: {', '.join(scoring)}")
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise ValueError(f"{key}.{name} must be a number")
+        scoring[name] = value
+    return type(consumer), scoring
+
+
+def rescore_signals(key, runs, profile=None, params=None):
+    """Scores of many videos' stored signals for one analyzer, as an array; see scorer() for params."""
+    cls, scoring = scorer(key, profile, params)
+    return cls.rescore(runs, **scoring)
+
+
+def _video_signals(consumers):
+    """signals() of the frame consumers, unless the video could not be opened (nor they started)."""
+    return {key: c.signals() for key, c in consumers.items()
+            if not isinstance(c, FrameSampler) and hasattr(c, 'frame_count')}
+
+
+def run_video_analyzers(video_path, keys=None, progress=None, source=None, profile=None):
+    """
+    Run the given video analyzers off one shared decode.
+    Returns (scores, timings, signals) with timings keyed by display name and
+    signals holding each consumer's signals(); adaptive samplers keep none.
+    progress, if given, is a dict (or a multiprocessing proxy of one) that
+    gets {'frames': done, 'total': frame count, 'done': bool} per key.
+    source overrides the frame source, see frame_source.FRAME_SOURCES.
+    profile names the settings to analyze with, see profiles.PROFILES.
+    Adaptive samplers seek around the file on their own readers alongside
+    the shared decode, or after it for a download still in progress.
+    """
+    consumers = video_consumers(keys, profile)
+    samplers = {key: c for key, c in consumers.items() if isinstance(c, FrameSampler)}
+    decoded = {key: c for key, c in consumers.items() if key not in samplers}
+    timings = {}
+
+    def report(positions, frame_count):
+        for key, frames in positions.items():
+            progress[key] = {'frames': frames, 'total': frame_count, 'done': False}
+
+    log.info("⏳ Video decode started", analyzers=list(consumers), video=video_path, profile=profile)
+    t0 = time.time()
+    try:
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            sampled = executor.submit(run_samplers, video_path, samplers) if samplers and source != 'growing' else None
+            results = {}
+            if decoded:
+                results = run_consumers(video_path, decoded, source=source,
+                                        progress=report if progress is not None else None)
+            results.update(sampled.result() if sampled is not None else run_samplers(video_path, samplers))
+    except Exception:
+        ANALYSIS_FAILURES.labels('video').inc()
+        raise
+    wall = time.time() - t0
+    timings[f"Video Decode ({', '.join(consumers)})"] = round(wall, 2)
+    scores = _collect_video_results(consumers, results, wall, timings, progress, samplers)
+    return scores, timings, _video_signals(consumers)
+
+
+def _collect_video_results(consumers, results, wall, timings, progress=None, samplers=()):
+    """Scores of finished video consumers; records their timings, metrics, logs and final progress."""
+    flows = {id(c.flow): c.flow for c in consumers.values() if hasattr(c, 'flow')}
+    if flows:
+        timings['Optical Flow'] = round(sum(f.elapsed for f in flows.values()), 2)
+        for flow in flows.values():
+            observe_analyzer('flow', flow.decode_time, flow.elapsed, wall, flow.frames_processed)
+
+    scores = {}
+    for key, consumer in consumers.items():
+        name = VIDEO_ANALYZERS[key]
+        timings[name] = round(consumer.elapsed, 2)
+        scores[key] = float(results[key])
+        frames = consumer.frames_processed if getattr(consumer, 'takes_frames', True) else None
+        observe_analyzer(key, consumer.decode_time, consumer.elapsed, wall, frames)
+        total = getattr(consumer, 'frame_count', 0)
+        if key in samplers:
+            log.info("✅ Analyzer completed", analyzer=key, seconds=timings[name], frames=frames, score=scores[key],
+                     samples=consumer.samples, interval=consumer.interval)
+            if progress is not None:
+                progress[key] = {'frames': frames, 'total': total, 'samples': consumer.samples, 'done': True}
+            continue
+        log.info("✅ Analyzer completed", analyzer=key, seconds=timings[name], frames=frames, score=scores[key])
+        if progress is not None:
+            progress[key] = {'frames': total, 'total': total, 'done': True}
+    return scores
+
+
+def _with_dependencies(consumers):
+    """
+    consumers plus the services they depend on, named after the first key
+    using them, so every process building the same keys names them alike.
+    """
+    named = dict(consumers)
+    for key, consumer in consumers.items():
+        for dependency in consumer.depends_on:
+            if all(dependency is not c for c in named.values()):
+                named[f'{key}.{type(dependency).__name__}'] = dependency
+    return named
+
+
+def analyze_video_segment(video_path, keys, segment, profile=None):
+    """
+    Run the given video analyzers over one (start, end) frame range. Returns,
+    for them and the services they depend on, their segment state and run
+    statistics, to be merged by run_video_segments.
+    """
+    consumers = _with_dependencies(video_consumers(keys, profile))
+    states = run_consumers(video_path, consumers, segment=segment)
+    return {name: {'state': states[name], 'elapsed': c.elapsed, 'frames': c.frames_processed,
+                   'decode_time': c.decode_time}
+            for name, c in consumers.items()}
+
+
+def run_video_segments(video_path, keys, plan, submit, progress=None, profile=None):
+    """
+    Run the given video analyzers on the segments of a plan from
+    frame_source.plan_segments in parallel, and merge them into the scores
+    a single decode would give. submit(fn, *args) schedules a call on the
+    analysis executor and returns its future. Adaptive samplers run as one
+    more task. Returns (scores, timings, signals) like run_video_analyzers.
+    """
+    keys = keys or list(VIDEO_ANALYZERS)
+    fps, frame_count, segments = plan
+    built = video_consumers(keys, profile)
+    sampled_keys = [k for k in keys if isinstance(built[k], FrameSampler)]
+    segment_keys = [k for k in keys if k not in sampled_keys]
+    consumers = _with_dependencies({k: built[k] for k in segment_keys})
+    timings = {}
+
+    log.info("⏳ Video decode started", analyzers=segment_keys, video=video_path, profile=profile,
+             segments=len(segments))
+    t0 = time.time()
+    try:
+        sampled = submit(run_video_analyzers, video_path, sampled_keys, progress, None, profile) if sampled_keys else None
+        futures = {submit(analyze_video_segment, video_path, segment_keys, segment, profile): segment
+                   for segment in segments}
+        runs = {}
+        for future in as_completed(futures):
+            runs[futures[future]] = future.result()
+            if progress is not None:
+                frames = sum(end - start for start, end in runs)
+                for key in segment_keys:
+                    progress[key] = {'frames': frames, 'total': frame_count, 'done': False}
+
+        runs = [runs[segment] for segment in segments]
+        for name, consumer in consumers.items():
+            consumer.start(fps, frame_count)
+            consumer.merge_segments([run[name]['state'] for run in runs])
+            consumer.elapsed = sum(run[name]['elapsed'] for run in runs)
+            consumer.frames_processed = sum(run[name]['frames'] for run in runs)
+            consumer.decode_time = sum(run[name]['decode_time'] for run in runs)
+        results = {key: consumers[key].finish() for key in segment_keys}
+    except Exception:
+        ANALYSIS_FAILURES.labels('video').inc()
+        raise
+    wall = time.time() - t0
+    timings[f"Video Decode ({', '.join(segment_keys)}) in {len(segments)} segments"] = round(wall, 2)
+    scores = _collect_video_results({k: consumers[k] for k in segment_keys}, results, wall, timings, progress)
+    signals = _video_signals({k: consumers[k] for k in segment_keys})
+
+    if sampled is not None:
+        sampled_scores, sampled_timings, sampled_signals = sampled.result()
+        scores.update(sampled_scores)
+        timings.update(sampled_timings)
+        signals.update(sampled_signals)
+    return scores, timings, signals
+
+
+def run_audio_analyzers(video_path, keys=None, progress=None, profile=None):
+    """
+    Stream the soundtrack once through the given audio analyzers.
+    Returns (scores, timings, signals) like run_video_analyzers.
+    """
+    scores, timings, signals, _ = _run_audio_analyzers(video_path, keys, progress, profile)
+    return scores, timings, signals
+
+
+def stream_audio_analyzers(video_path, keys=None, progress=None, profile=None):
+    """
+    run_audio_analyzers for a pool worker: analyzers that would wait on a
+    remote service (hosted ASR) are not finished, so the worker is free for
+    the round trip. Returns (scores, timings, signals, requests), with their
+    remote_request() and decode seconds in requests by key, for
+    finish_remote_audio().
+    """
+    return _run_audio_analyzers(video_path, keys, progress, profile, defer_remote=True)
+
+
+def _run_audio_analyzers(video_path, keys=None, progress=None, profile=None, defer_remote=False):
+    consumers = audio_consumers(keys, profile)
+    timings = {}
+
+    log.info("⏳ Audio decode started", analyzers=list(consumers), video=video_path, profile=profile)
+    t0 = time.time()
+    try:
+        results = run_audio_consumers(video_path, consumers, defer_remote=defer_remote)
+    except Exception:
+        ANALYSIS_FAILURES.labels('audio').inc()
+        raise
+    wall = time.time() - t0
+    timings[f"Audio Decode ({', '.join(consumers)})"] = round(wall, 2)
+
+    requests = {key: (results.pop(key), consumer.decode_time) for key, consumer in consumers.items()
+                if consumer.deferred}
+    scores = {}
+    for key, consumer in consumers.items():
+        name = AUDIO_ANALYZERS[key]
+        timings[name] = round(consumer.elapsed, 2)
+        if key in requests:
+            continue  # Observed once finish_remote_audio() has its score
+        scores[key] = float(results[key])
+        observe_analyzer(key, consumer.decode_time, consumer.elapsed, wall)
+        log.info("✅ Analyzer completed", analyzer=key, seconds=timings[name], score=scores[key])
+        if progress is not None:
+            progress[key] = {'done': True}
+    signals = {key: consumer.signals() for key, consumer in consumers.items() if key not in requests}
+    return scores, timings, signals, requests
+
+
+async def finish_remote_audio(streamed, profile=None, progress=None):
+    """
+    Await a stream_audio_analyzers() future, then the remote requests it left,
+    on this process's event loop (see async_io), without holding the pool
+    worker that streamed the audio. Returns (scores, timings, signals) like
+    run_audio_analyzers.
+    """
+    scores, timings, signals, requests = await asyncio.wrap_future(streamed)
+    if not requests:
+        return scores, timings, signals
+
+    consumers = audio_consumers(list(requests), profile)
+    t0 = time.time()
+    try:
+        results = await asyncio.gather(*(consumers[key].finish_remote(request)
+                                         for key, (request, _) in requests.items()))
+    except Exception:
+        ANALYSIS_FAILURES.labels('audio').inc()
+        raise
+    remote_seconds = time.time() - t0
+
+    for key, score in zip(requests, results):
+        name = AUDIO_ANALYZERS[key]
+        timings[name] = round(timings[name] + remote_seconds, 2)
+        scores[key] = float(score)
+        signals[key] = consumers[key].signals()
+        observe_analyzer(key, requests[key][1], timings[name], timings[name])
+        log.info("✅ Analyzer completed", analyzer=key, seconds=timings[name], score=scores[key], remote=True)
+        if progress is not None:
+            progress[key] = {'done': True}
+    return scores, timings, signals
@@ -1,56 +1,71 @@
-import cv2
 import numpy as np
+from frame_source import FrameConsumer, run_consumer, debounced_counts
+from feature_store import stacked, scalars, run_sums
+from logs import get_logger
+
+log = get_logger(__name__)
 
-def animation_transition_score(video_path):
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print(f"Error opening video file: {video_path}")
-        return 0
 
-    abrupt_change_count = 0
+class AnimationTransitionConsumer(FrameConsumer):
     diff_threshold = 45  # Pixel intensity difference threshold
     min_interval = 1.0  # Minimum seconds between abrupt transitions
+    lower_bound = 2  # Transitions per minute scoring 1...
+    upper_bound = 20  # ...and 10
+    merged = ('indices', 'mean_diffs', 'frames_seen')
+    scoring = ('diff_threshold', 'min_interval', 'lower_bound', 'upper_bound')
+
+    def __init__(self, resize_factor=None):
+        self.resize_factor = resize_factor
+        self.features = [('diff', resize_factor)]
+
+    def start(self, fps, frame_count):
+        super().start(fps, frame_count)
+        self.indices = []  # Every frame's mean diff, thresholded and debounced when scoring
+        self.mean_diffs = []
+        self.frames_seen = 0
+
+    def process(self, index, frame):
+        diff = frame.diff(self.resize_factor)
+        self.frames_seen += 1
+
+        if diff is not None:
+            self.indices.append(index)
+            self.mean_diffs.append(np.mean(diff))
+
+    def signals(self):
+        return {
+            'indices': np.array(self.indices, dtype=np.int32),
+            'mean_diffs': np.array(self.mean_diffs, dtype=np.float32),
+            'frames_seen': self.frames_seen,
+            'fps': self.fps,
+            'frame_count': self.frame_count,
+        }
 
-    ret, prev_frame = cap.read()
-    if not ret:
-        print("Error reading the first frame.")
-        return 0
-
-    prev_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
-    fps = cap.get(cv2.CAP_PROP_FPS) or 30
-    last_change_time = 0
-    frame_index = 1
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        diff = cv2.absdiff(prev_gray, gray)
-        mean_diff = np.mean(diff)
-
-        current_time = frame_index / fps
-        if mean_diff > diff_threshold and (current_time - last_change_time >= min_interval or last_change_time == 0):
-            abrupt_change_count += 1
-            last_change_time = current_time
-
-        prev_gray = gray
-        frame_index += 1
-
-    cap.release()
-
-    duration_sec = total_frames / fps
-    if duration_sec <= 0:
-        print("Zero duration video or live stream.")
-        return 1
-
-    changes_per_min = abrupt_change_count / (duration_sec / 60)
-
-    # Scoring: 2 = 1, 20 = 10
-    lower_bound = 2
-    upper_bound = 20
-    score = 1 + (changes_per_min - lower_bound) * (9 / (upper_bound - lower_bound))
-    score = max(1, min(score, 10))
-    return score
+    @classmethod
+    def rescore(cls, runs, diff_threshold, min_interval, lower_bound, upper_bound):
+        indices, lengths = stacked(runs, 'indices', np.int64)
+        mean_diffs, _ = stacked(runs, 'mean_diffs')
+        fps = scalars(runs, 'fps')
+        duration_sec = scalars(runs, 'frame_count') / fps
+
+        changes = mean_diffs > diff_threshold
+        times = (indices / np.repeat(fps, lengths))[changes]
+        abrupt_change_count = debounced_counts(times, run_sums(changes, lengths).astype(np.int64), min_interval)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            changes_per_min = abrupt_change_count / (duration_sec / 60)
+
+        score = 1 + (changes_per_min - lower_bound) * (9 / (upper_bound - lower_bound))
+        score = np.clip(score, 1, 10)
+        score = np.where(duration_sec > 0, score, 1)
+        return np.where(scalars(runs, 'frames_seen') > 0, score, 0)
+
+    def finish(self):
+        if self.frames_seen == 0:
+            log.warning("Error reading the first frame")
+        elif self.frame_count / self.fps <= 0:
+            log.warning("Zero duration video or live stream")
+        return self.score_signals()
+
+
+def animation_transition_score(video_path):
+    return run_consumer(video_path, AnimationTransitionConsumer())
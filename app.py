@@ -1,28 +1,30 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, request, jsonify, render_template, g, Response, send_from_directory
 from flask_cors import CORS
 import os
 import uuid
-import traceback
 import time
-from concurrent.futures import ThreadPoolExecutor
-import requests
-import yt_dlp
 import csv
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
 
 # --- Analysis Modules ---
-from scene_change_analysis import scene_change_score
-from flash_score_analysis import flash_score
-from camera_movement_analysis import camera_movement_score
-from color_score_analysis import color_score
-from density_score_analysis import density_score
-from animation_analysis import animation_transition_score
-from expression_analysis import facial_expression_intensity_score
-from fantastical_content_analysis import fantastical_content_score
-from narrative_coherence_analysis import narrative_coherence_score
-from audio_overwhelm_analysis import audio_overwhelm_score
-from speech_rate_analysis import speech_rate_score
-
-UPLOAD_FOLDER = 'uploads'
+from analysis_pool import get_process_pool, ANALYSIS_EXECUTOR
+from video_analysis import analyze_video, run_analysis_job, result_cache, feature_store
+from rescoring import rescore_catalog
+from jobs import JobQueue, QueueFull
+from broker import get_broker
+from batch import batch_entries, batch_output, run_batch_job, BATCH_DIR, BATCH_SOURCE_ROOT
+from upload_store import receive_upload, UPLOAD_FOLDER
+from downloads import Download, DownloadError
+from profiles import PROFILES, DEFAULT_PROFILE
+from logs import get_logger
+from metrics import render_metrics, REQUEST_INGEST_SECONDS, REQUEST_SECONDS
+
+# 'local' analyzes videos inside the web process; 'broker' queues them for
+# worker processes (python worker.py), which can run on other machines
+JOB_BACKEND = os.environ.get('JOB_BACKEND', 'local')
+ANALYZE_WAIT_SECONDS = float(os.environ.get('ANALYZE_WAIT_SECONDS', 900))  # How long /analyze waits on a worker
+
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 app = Flask(__name__, template_folder='templates')
@@ -30,132 +32,277 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # Max 100MB file
 CORS(app)
 
+jobs = broker = None
+if JOB_BACKEND == 'broker':
+    broker = get_broker()
+else:
+    jobs = JobQueue()
+log = get_logger('app')
+
+@app.before_request
+def start_timer():
+    g.started_at = time.time()
+
+@app.after_request
+def observe_request(response):
+    if request.endpoint and request.endpoint != 'metrics' and 'started_at' in g:
+        REQUEST_SECONDS.labels(request.endpoint, str(response.status_code)).observe(time.time() - g.started_at)
+    return response
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
+def receive_video():
+    """
+    Stream the posted form into the upload folder without buffering the video.
+    Returns (fields, upload); upload is None when no file was sent.
+    """
+    t0 = time.time()
+    fields, upload = receive_upload(request, app.config['UPLOAD_FOLDER'])
+    if upload is not None:
+        REQUEST_INGEST_SECONDS.labels('upload').observe(time.time() - t0)
+        log.info("✅ Video uploaded", name=upload.original_name, path=upload.filepath, bytes=upload.size,
+                 seconds=round(time.time() - t0, 2), video=upload.metadata, probed_at_bytes=upload.probed_at)
+    return fields, upload
+
+def requested_profile(fields, upload=None):
+    """
+    The analysis profile named in the form (the default if none), or None
+    after discarding the upload if the name is unknown.
+    """
+    profile = fields.get('profile', '').strip() or DEFAULT_PROFILE
+    if profile not in PROFILES:
+        if upload is not None:
+            upload.discard()
+        return None
+    return profile
+
+def invalid_profile_response():
+    return jsonify({'error': f"Unknown profile, expected one of: {', '.join(PROFILES)}"}), 400
+
+def new_download_path():
+    filename = str(uuid.uuid4()) + '.mp4'
+    return filename, os.path.join(app.config['UPLOAD_FOLDER'], filename)
+
+def video_inputs(fields, upload):
+    """
+    (filename, filepath, video_url, details) of the video a form posted;
+    video_url is None for uploads. Raises ValueError if there is no valid one.
+    """
+    if upload is not None:
+        return upload.filename, upload.filepath, None, {'video': upload.metadata, 'size': upload.size}
+    if 'video_url' in fields:
+        video_url = fields['video_url'].strip()
+        if not video_url.lower().startswith('http'):
+            raise ValueError('Invalid URL')
+        filename, filepath = new_download_path()
+        return filename, filepath, video_url, {'video_url': video_url}
+    log.warning("❌ No video input found")
+    raise ValueError('No video or video_url provided')
+
+def queue_full():
+    return broker.full() if broker is not None else jobs.full()
+
+def queue_analysis(filename, filepath, video_url, content_hash, profile, details):
+    """
+    Queue a video's analysis on the job backend; returns the job id. Raises
+    QueueFull, after removing the video, when too many jobs are waiting.
+    """
+    details = dict(details, profile=profile)
+    try:
+        if broker is not None:
+            # Workers find the video in their own mount of the upload folder
+            job_id = broker.submit('analyze', [filename, video_url, content_hash, profile], details)
+        else:
+            job = jobs.submit(run_analysis_job, filename, filepath, video_url, content_hash, profile)
+            job.details = details
+            job_id = job.id
+    except QueueFull:
+        if os.path.exists(filepath):
+            os.remove(filepath)
+        raise
+    log.info("🗂️ Queued job", job=job_id, filename=filename, profile=profile, backend=JOB_BACKEND)
+    return job_id
+
+def analyze_on_worker(filename, filepath, video_url, content_hash, profile, details):
+    """/analyze with the broker backend: queue the video and wait for a worker to score it."""
+    try:
+        job_id = queue_analysis(filename, filepath, video_url, content_hash, profile, details)
+    except QueueFull:
+        return queue_full_response()
+
+    job = broker.wait(job_id, ANALYZE_WAIT_SECONDS)
+    if job['status'] == 'done':
+        return jsonify(job['result'])
+    if job['status'] == 'failed':
+        return jsonify({'error': job['error']}), 500
+    return jsonify({'id': job_id, 'status': job['status'], 'url': f'/jobs/{job_id}'}), 202
+
 @app.route('/analyze', methods=['POST'])
 def analyze():
     try:
-        print("\n🔔 Received POST /analyze")
-        start_total = time.time()
-
-        video = None
-        filepath = None
-        filename = None
-
-        if 'video' in request.files:
-            video = request.files['video']
-            print(f"📄 File name: {video.filename}")
-            video_bytes = video.read()
-            print(f"📦 File size: {round(len(video_bytes) / 1024 / 1024, 2)} MB")
-            video.seek(0)
-
-            filename = str(uuid.uuid4()) + os.path.splitext(video.filename)[1]
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            video.save(filepath)
-            print(f"✅ Video uploaded and saved to: {filepath}")
-
-        elif 'video_url' in request.form:
-            video_url = request.form['video_url'].strip()
-            if not video_url.lower().startswith('http'):
-                return jsonify({'error': 'Invalid URL'}), 400
-
-            print(f"🌐 Downloading from URL: {video_url}")
-            ext = '.mp4'
-            filename = str(uuid.uuid4()) + ext
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-
-            if 'youtube.com' in video_url or 'youtu.be' in video_url:
-                print("📽️ Using yt_dlp for YouTube download...")
-                try:
-                    ydl_opts = {
-                        'format': 'best[ext=mp4]',
-                        'outtmpl': filepath,
-                        'quiet': True,
-                        'noplaylist': True
-                    }
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        ydl.download([video_url])
-                    print(f"✅ YouTube video saved to: {filepath}")
-                except Exception as e:
-                    print("❌ yt_dlp error:", str(e))
-                    return jsonify({'error': 'Failed to download YouTube video'}), 500
+        log.info("🔔 Received POST /analyze")
+        fields, upload = receive_video()
+        profile = requested_profile(fields, upload)
+        if profile is None:
+            return invalid_profile_response()
+
+        try:
+            filename, filepath, video_url, details = video_inputs(fields, upload)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        content_hash = upload.content_hash if upload else None
+
+        if broker is not None:
+            return analyze_on_worker(filename, filepath, video_url, content_hash, profile, details)
+
+        download = Download(video_url, filepath).start() if video_url else None
+        try:
+            return jsonify(analyze_video(filepath, filename, content_hash=content_hash, download=download,
+                                         profile=profile))
+        except DownloadError as e:
+            return jsonify({'error': str(e)}), 500
+
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'Video is larger than the upload limit'}), 413
+    except Exception as e:
+        log.exception("❌ Error occurred during analysis")
+        return jsonify({'error': str(e)}), 500
+
+def queue_full_response():
+    response = jsonify({'error': 'Too many videos are waiting for analysis, try again shortly'})
+    response.headers['Retry-After'] = '30'
+    return response, 429
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    try:
+        log.info("🔔 Received POST /jobs")
+        if queue_full():
+            return queue_full_response()
+
+        fields, upload = receive_video()
+        profile = requested_profile(fields, upload)
+        if profile is None:
+            return invalid_profile_response()
+
+        try:
+            filename, filepath, video_url, details = video_inputs(fields, upload)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        try:
+            job_id = queue_analysis(filename, filepath, video_url, upload.content_hash if upload else None,
+                                    profile, details)
+        except QueueFull:
+            return queue_full_response()
+        return jsonify({'id': job_id, 'status': 'queued', 'url': f'/jobs/{job_id}'}), 202
+
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'Video is larger than the upload limit'}), 413
+    except Exception as e:
+        log.exception("❌ Error occurred while queueing analysis")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    if broker is not None:
+        job = broker.get(job_id)
+    else:
+        job = jobs.get(job_id)
+        job = job.to_dict() if job is not None else None
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job)
+
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """
+    Queue a catalog run. The JSON body lists 'videos' (URLs, or paths under
+    BATCH_SOURCE_ROOT) and/or a 'source' under it (a directory, glob or CSV
+    file), with an optional 'profile' and a 'name' for the results. Posting
+    the same name again resumes that run, skipping the videos it scored.
+    """
+    try:
+        log.info("🔔 Received POST /analyze/batch")
+        data = request.get_json(silent=True) or {}
+        profile = data.get('profile') or DEFAULT_PROFILE
+        if profile not in PROFILES:
+            return invalid_profile_response()
+
+        sources = list(data.get('videos') or [])
+        if data.get('source'):
+            sources.append(data['source'])
+        try:
+            entries = batch_entries(sources, BATCH_SOURCE_ROOT)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        if not entries:
+            return jsonify({'error': 'No videos found'}), 400
+
+        name = secure_filename(data.get('name') or '') or uuid.uuid4().hex
+        details = {'batch': name, 'videos': len(entries), 'profile': profile}
+        try:
+            if broker is not None:
+                job_id = broker.submit('batch', [entries, name, profile], details)
             else:
-                print("🔽 Downloading non-YouTube video with requests...")
-                try:
-                    r = requests.get(video_url, stream=True, timeout=30)
-                    r.raise_for_status()
-                    with open(filepath, 'wb') as f:
-                        for chunk in r.iter_content(chunk_size=8192):
-                            f.write(chunk)
-                    print(f"✅ Video downloaded and saved to: {filepath}")
-                except Exception as e:
-                    print("❌ Error downloading video:", str(e))
-                    return jsonify({'error': 'Failed to download video from URL'}), 500
-        else:
-            print("❌ No video input found")
-            return jsonify({'error': 'No video or video_url provided'}), 400
-
-        print("📋 Starting parallel analysis...\n")
-        timings = {}
-
-        def timed(name, func):
-            print(f"⏳ [{name}] started...")
-            t0 = time.time()
-            result = func(filepath)
-            duration = round(time.time() - t0, 2)
-            timings[name] = duration
-            print(f"✅ [{name}] completed in {duration}s → Score: {result}")
-            return float(result)
-
-        with ThreadPoolExecutor() as executor:
-            futures = {
-                'scene': executor.submit(timed, 'Scene Change', scene_change_score),
-                'camera': executor.submit(timed, 'Camera Movement', camera_movement_score),
-                'flash': executor.submit(timed, 'Flashing Effects', flash_score),
-                'color': executor.submit(timed, 'Color Score', color_score),
-                'density': executor.submit(timed, 'Object Density', density_score),
-                'animation': executor.submit(timed, 'Animation', animation_transition_score),
-                'expression': executor.submit(timed, 'Facial Expression Intensity', facial_expression_intensity_score),
-                'fancy': executor.submit(timed, 'Fantastical Content', fantastical_content_score),
-                'narrative': executor.submit(timed, 'Narrative Coherence', narrative_coherence_score),
-                'audio': executor.submit(timed, 'Audio Overwhelm', audio_overwhelm_score),
-                'speech_rate': executor.submit(timed, 'Speech Rate', speech_rate_score)
-            }
-
-            scores = {k: future.result() for k, future in futures.items()}
-
-        final_score = round(sum(scores.values()) / len(scores), 2)
-        total_time = round(time.time() - start_total, 2)
-
-        print("\n📊 Summary:")
-        for name, sec in timings.items():
-            print(f"• {name} took {sec} seconds")
-        print(f"🎯 Final Score: {final_score}")
-        print(f"🕒 Total Time: {total_time} seconds\n")
-
-        return jsonify({
-            'filename': filename,
-            'scene_change': scores['scene'],
-            'camera_movement': scores['camera'],
-            'flashing_effects': scores['flash'],
-            'color': scores['color'],
-            'object_density': scores['density'],
-            'animation': scores['animation'],
-            'facial_expression_intensity': scores['expression'],
-            'fantastical_content': scores['fancy'],
-            'narrative_coherence': scores['narrative'],
-            'audio_overwhelm': scores['audio'],
-            'speech_rate': scores['speech_rate'],
-            'final_score': final_score
-        })
+                job = jobs.submit(run_batch_job, entries, name, profile)
+                job.details = details
+                job_id = job.id
+        except QueueFull:
+            return queue_full_response()
+
+        log.info("🗂️ Queued batch", job=job_id, batch=name, videos=len(entries), profile=profile)
+        return jsonify({'id': job_id, 'status': 'queued', 'url': f'/jobs/{job_id}',
+                        'results': f'/analyze/batch/{name}', 'videos': len(entries)}), 202
 
     except Exception as e:
-        print("❌ Error occurred during analysis:")
-        print(traceback.format_exc())
+        log.exception("❌ Error occurred while queueing batch")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/analyze/batch/<name>', methods=['GET'])
+def batch_results(name):
+    """The JSONL results of a catalog run so far, one line per scored video."""
+    name = secure_filename(name)
+    if not name or not os.path.exists(batch_output(name)):
+        return jsonify({'error': 'Unknown batch'}), 404
+    return send_from_directory(os.path.abspath(BATCH_DIR), name + '.jsonl', mimetype='application/x-ndjson')
+
+@app.route('/rescore', methods=['POST'])
+def rescore():
+    """
+    Score stored signals with new scoring parameters, without decoding any
+    video. The JSON body holds 'params' ({analyzer: {parameter: value}}),
+    optionally the content hashes of the 'videos' to score (default: all
+    stored) and a 'profile'. Nothing is cached: the scores are what-ifs.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        profile = data.get('profile') or DEFAULT_PROFILE
+        if profile not in PROFILES:
+            return invalid_profile_response()
+        params = data.get('params') or {}
+        if not isinstance(params, dict) or not all(isinstance(p, dict) for p in params.values()):
+            return jsonify({'error': 'params must map analyzers to {parameter: value}'}), 400
+        try:
+            result = rescore_catalog(params, data.get('videos'), profile, feature_store)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(dict(result, profile=profile, videos=len(result['scores'])))
+
+    except Exception as e:
+        log.exception("❌ Error occurred while re-scoring")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/cache/stats', methods=['GET'])
+def cache_stats():
+    return jsonify(dict(result_cache.stats(), features=feature_store.stats()))
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
 @app.route('/feedback', methods=['POST'])
 def feedback():
     try:
@@ -168,13 +315,15 @@ def feedback():
             writer = csv.writer(file)
             writer.writerow([video_name, rating, comments])
 
-        print(f"✅ Feedback recorded for {video_name}")
+        log.info("✅ Feedback recorded", video_name=video_name)
         return jsonify({"status": "success"})
 
     except Exception as e:
-        print("❌ Error saving feedback:", str(e))
+        log.error("❌ Error saving feedback", error=str(e))
         return jsonify({"error": "Failed to save feedback"}), 500
 
 if __name__ == '__main__':
+    if ANALYSIS_EXECUTOR == 'process':
+        get_process_pool()  # Warm the workers before the first request
     port = int(os.environ.get("PORT", 5000))
     app.run(host='0.0.0.0', port=port)
@@ -0,0 +1,123 @@
+import os
+import atexit
+import random
+import asyncio
+import threading
+import aiohttp
+from logs import get_logger
+
+ASYNC_POOL_SIZE = int(os.environ.get('ASYNC_POOL_SIZE', 32))
+
+log = get_logger(__name__)
+
+_loop = None
+_session = None
+_limits = {}
+_loop_lock = threading.Lock()
+
+
+class RemoteCallError(Exception):
+    """A remote call that failed for good, after any retries."""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+def event_loop():
+    """
+    The process-wide asyncio loop, running on its own daemon thread. It is
+    started on first use, so every worker process gets its own.
+    """
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='async-io', daemon=True).start()
+            atexit.register(_shutdown)
+        return _loop
+
+
+def submit(coro):
+    """Schedule a coroutine on the shared loop from any thread; returns a concurrent.futures.Future."""
+    return asyncio.run_coroutine_threadsafe(coro, event_loop())
+
+
+def run_async(coro, timeout=None):
+    """Run a coroutine on the shared loop and wait for its result on the calling thread."""
+    return submit(coro).result(timeout)
+
+
+def client_session():
+    """Shared aiohttp session, so calls reuse pooled keep-alive connections. Loop thread only."""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=ASYNC_POOL_SIZE))
+    return _session
+
+
+def limiter(name, max_in_flight):
+    """Semaphore shared by every call made under name, capping how many are in flight. Loop thread only."""
+    if name not in _limits:
+        _limits[name] = asyncio.Semaphore(max_in_flight)
+    return _limits[name]
+
+
+def _retry_delay(attempt, backoff, retry_after=None):
+    if retry_after is not None and retry_after.isdigit():
+        return float(retry_after)
+    return backoff * 2 ** attempt * random.uniform(0.5, 1.5)
+
+
+async def post_json(url, data=None, headers=None, params=None, timeout=60.0, retries=0, backoff=1.0,
+                    limit=None):
+    """
+    POST data to url over the shared session and return the decoded JSON
+    response. Each attempt is bounded by timeout seconds. Connection errors,
+    timeouts, 429 and 5xx responses are retried up to retries times with
+    jittered exponential backoff (or the server's Retry-After); other errors
+    raise RemoteCallError straight away. limit is an optional semaphore
+    held for each attempt, not while backing off.
+    """
+    attempt = 0
+    while True:
+        retry_after = None
+        try:
+            if limit is not None:
+                await limit.acquire()
+            try:
+                async with client_session().post(url, data=data, headers=headers, params=params,
+                                                 timeout=aiohttp.ClientTimeout(total=timeout)) as r:
+                    if r.status < 400:
+                        return await r.json(content_type=None)
+                    body = await r.text()
+                    error = RemoteCallError(f"{url} returned {r.status}: {body[:200]}", r.status)
+                    retry_after = r.headers.get('Retry-After')
+            finally:
+                if limit is not None:
+                    limit.release()
+            if r.status != 429 and r.status < 500:
+                raise error
+        except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+            error = RemoteCallError(f"{url} failed: {type(e).__name__} {e}")
+
+        if attempt >= retries:
+            raise error
+        delay = _retry_delay(attempt, backoff, retry_after)
+        attempt += 1
+        log.warning("🔁 Retrying remote call", error=str(error), attempt=attempt, retries=retries,
+                    delay=round(delay, 1))
+        await asyncio.sleep(delay)
+
+
+async def _close_session():
+    if _session is not None and not _session.closed:
+        await _session.close()
+
+
+def _shutdown():
+    try:
+        run_async(_close_session(), timeout=5)
+    except Exception:
+        pass
+    _loop.call_soon_threadsafe(_loop.stop)
@@ -1,89 +1,204 @@
-import os
 import numpy as np
-import tempfile
-import ffmpeg
-import soundfile as sf
-import pyloudnorm as pyln
-from ffmpeg._run import Error as FFmpegError  # Correct import
-
-def extract_audio_ffmpeg(input_path, output_path):
-    try:
-        (
-            ffmpeg
-            .input(input_path)
-            .output(output_path, ac=1, ar=16000, format='wav')
-            .overwrite_output()
-            .run(quiet=True)
-        )
-    except FFmpegError as e:
-        print("❌ FFmpeg error:", e.stderr.decode() if e.stderr else "No stderr.")
-        raise
-
-def compute_chunk_loudness(audio_data, sample_rate, chunk_size):
+import scipy.signal
+from numpy.lib.stride_tricks import sliding_window_view
+from audio_source import AudioConsumer, run_audio_consumer
+from feature_store import stacked, scalars, run_sums, run_means
+from logs import get_logger
+
+log = get_logger(__name__)
+
+def k_weighting_sos(sample_rate):
+    """
+    ITU-R BS.1770 K-weighting at sample_rate as second-order sections: the
+    +4 dB high shelf at 1500 Hz, then the 38 Hz high pass, designed with the
+    RBJ cookbook formulas exactly as pyloudnorm's Meter does.
+    """
+    sections = []
+    for gain_db, q, fc, kind in ((4.0, 1 / np.sqrt(2), 1500.0, 'high_shelf'), (0.0, 0.5, 38.0, 'high_pass')):
+        A = 10 ** (gain_db / 40.0)
+        w0 = 2.0 * np.pi * (fc / sample_rate)
+        alpha = np.sin(w0) / (2.0 * q)
+        cos_w0 = np.cos(w0)
+        if kind == 'high_shelf':
+            b = [A * ((A + 1) + (A - 1) * cos_w0 + 2 * np.sqrt(A) * alpha),
+                 -2 * A * ((A - 1) + (A + 1) * cos_w0),
+                 A * ((A + 1) + (A - 1) * cos_w0 - 2 * np.sqrt(A) * alpha)]
+            a = [(A + 1) - (A - 1) * cos_w0 + 2 * np.sqrt(A) * alpha,
+                 2 * ((A - 1) - (A + 1) * cos_w0),
+                 (A + 1) - (A - 1) * cos_w0 - 2 * np.sqrt(A) * alpha]
+        else:
+            b = [(1 + cos_w0) / 2, -(1 + cos_w0), (1 + cos_w0) / 2]
+            a = [1 + alpha, -2 * cos_w0, 1 - alpha]
+        sections.append(np.concatenate([b, a]) / a[0])
+    return np.array(sections)
+
+
+def gated_loudness(z):
     """
-    Analyze audio in chunks of chunk_size seconds and compute loudness values
+    ITU-R BS.1770 gated loudness of every row of z, a (windows x blocks)
+    matrix of 400 ms block mean squares, gated as pyloudnorm's
+    integrated_loudness does.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        block_loudness = -0.691 + 10.0 * np.log10(z)
+        above_absolute = block_loudness >= -70.0
+        relative = -0.691 + 10.0 * np.log10(
+            np.sum(z * above_absolute, axis=1) / np.sum(above_absolute, axis=1)) - 10.0
+        gated = (block_loudness > relative[:, None]) & (block_loudness > -70.0)
+        z_gated = np.nan_to_num(np.sum(z * gated, axis=1) / np.sum(gated, axis=1))
+        return -0.691 + 10.0 * np.log10(z_gated)
+
+class AudioOverwhelmConsumer(AudioConsumer):
     """
-    meter = pyln.Meter(sample_rate)
-    chunk_samples = int(chunk_size * sample_rate)
-    loudness_values = []
-
-    for i in range(0, len(audio_data), chunk_samples):
-        chunk = audio_data[i:i + chunk_samples]
-        if len(chunk) < chunk_samples:
-            continue
-        try:
-            loudness = meter.integrated_loudness(chunk)
-            if np.isfinite(loudness):
-                loudness_values.append(loudness)
-        except Exception as e:
-            print(f"⚠️ Skipping chunk {i // chunk_samples}: {e}")
-            continue
-
-    return np.array(loudness_values)
-
-def audio_overwhelm_score(video_path, chunk_duration=1.0):
-    with tempfile.TemporaryDirectory() as tmpdir:
-        audio_path = os.path.join(tmpdir, "audio.wav")
-
-        # Extract audio using ffmpeg-python
-        extract_audio_ffmpeg(video_path, audio_path)
-
-        # Load audio
-        data, rate = sf.read(audio_path)
-        if data.ndim > 1:
-            data = np.mean(data, axis=1)
-
-        if len(data) == 0 or np.all(data == 0):
-            print("⚠️ Audio data is empty or silent.")
-            return 1.0
-
-        # Compute overall LUFS
-        meter = pyln.Meter(rate)
-        try:
-            lufs = meter.integrated_loudness(data)
-        except Exception as e:
-            print("⚠️ Could not compute LUFS:", e)
-            return 1.0
-
-        # Analyze loudness over chunks
-        loudness_chunks = compute_chunk_loudness(data, rate, chunk_duration)
-        loudness_chunks = loudness_chunks[np.isfinite(loudness_chunks)]  # Remove NaN, inf
-
-        if len(loudness_chunks) < 2:
-            print("⚠️ Not enough valid audio chunks for analysis.")
-            return 1.0
-
-        std_loudness = np.std(loudness_chunks)
-        peaks = np.sum(np.abs(np.diff(loudness_chunks)) > 5)
-        high_volume_bursts = np.sum(loudness_chunks > -15)
+    Streaming loudness analysis with constant memory.
+
+    Each block is K-weighted with the filter state carried over from the
+    previous one and reduced to 100 ms segment energies. Every four segments
+    form a 400 ms gating block, and chunks of chunk_duration seconds
+    (overlapping by chunk_overlap, e.g. 3 s with 2/3 overlap for EBU
+    short-term loudness) are gated from them as they complete. Only these
+    are kept:
+    - a loudness histogram of the gating blocks (0.01 dB bins, as in
+      libebur128) for the integrated LUFS
+    - the loudness of every chunk, a float per hop, whose spread, jumps of
+      more than peak_change and bursts above burst_loudness are scored
+    """
+    segment_duration = 0.1
+    segments_per_block = 4
+    histogram_floor = -70.0
+    histogram_step = 0.01
+    histogram_bins = 10000
+    peak_change = 5  # dB between consecutive chunks that counts as a peak
+    burst_loudness = -15  # LUFS above which a chunk is a burst
+    scoring = ('peak_change', 'burst_loudness')
+
+    def __init__(self, chunk_duration=1.0, chunk_overlap=0.0):
+        self.chunk_duration = chunk_duration
+        self.chunk_overlap = chunk_overlap
+
+    def start(self, sample_rate):
+        super().start(sample_rate)
+        self.sos = k_weighting_sos(sample_rate)
+        self.zi = np.zeros((len(self.sos), 2))
+
+        self.segment_samples = int(round(self.segment_duration * sample_rate))
+        self.chunk_segments = int(round(self.chunk_duration / self.segment_duration))
+        self.hop_segments = max(1, int(round(self.chunk_segments * (1 - self.chunk_overlap))))
+
+        self.samples = 0
+        self.silent = True
+        self.pending = np.empty(0)      # Squared samples not yet filling a segment
+        self.history = np.empty(0)      # Segment energies still needed by upcoming blocks and chunks
+        self.history_start = 0          # Segment index of history[0]
+        self.next_chunk = 0             # Segment index the next chunk starts at
+
+        self.histogram_counts = np.zeros(self.histogram_bins, dtype=np.int64)
+        self.histogram_energy = np.zeros(self.histogram_bins)
+
+        self.chunks = []
+
+    def process(self, block):
+        self.samples += len(block)
+        self.silent = self.silent and not np.any(block)
+
+        filtered, self.zi = scipy.signal.sosfilt(self.sos, block.astype(np.float64), zi=self.zi)
+        squared = np.concatenate([self.pending, np.square(filtered)])
+        full = len(squared) // self.segment_samples * self.segment_samples
+        segments = squared[:full].reshape(-1, self.segment_samples).sum(axis=1)
+        self.pending = squared[full:]
+        if len(segments) == 0:
+            return
+
+        seen = self.history_start + len(self.history)
+        self.history = np.concatenate([self.history, segments])
+        block_size = self.segments_per_block * self.segment_samples
+        if len(self.history) < self.segments_per_block:
+            return
+
+        # Mean square of every 400 ms block in history, by starting segment
+        blocks = sliding_window_view(self.history, self.segments_per_block).sum(axis=1) / block_size
+        first_new = max(0, seen - self.segments_per_block + 1 - self.history_start)
+        self._count_blocks(blocks[first_new:])
+
+        blocks_per_chunk = self.chunk_segments - self.segments_per_block + 1
+        starts = []
+        while self.next_chunk + self.chunk_segments <= self.history_start + len(self.history):
+            starts.append(self.next_chunk - self.history_start)
+            self.next_chunk += self.hop_segments
+        if starts and blocks_per_chunk > 0:
+            z = blocks[np.array(starts)[:, None] + np.arange(blocks_per_chunk)]
+            loudness = gated_loudness(z)
+            self.chunks.extend(loudness[np.isfinite(loudness)].tolist())
+
+        # Keep the segments the next blocks and chunks still overlap
+        keep_from = min(self.next_chunk, self.history_start + len(self.history) - self.segments_per_block + 1)
+        drop = max(0, keep_from - self.history_start)
+        self.history = self.history[drop:]
+        self.history_start += drop
+
+    def _count_blocks(self, z):
+        with np.errstate(divide='ignore'):
+            loudness = -0.691 + 10.0 * np.log10(z)
+        gated = loudness >= self.histogram_floor
+        bins = ((loudness[gated] - self.histogram_floor) / self.histogram_step).astype(int)
+        bins = np.minimum(bins, self.histogram_bins - 1)
+        np.add.at(self.histogram_counts, bins, 1)
+        np.add.at(self.histogram_energy, bins, z[gated])
+
+    def integrated_loudness(self):
+        """Gated integrated LUFS of everything processed so far, from the histogram."""
+        counts = self.histogram_counts
+        energy = self.histogram_energy
+        with np.errstate(divide='ignore', invalid='ignore'):
+            relative = -0.691 + 10.0 * np.log10(energy.sum() / counts.sum()) - 10.0
+            centers = self.histogram_floor + (np.arange(self.histogram_bins) + 0.5) * self.histogram_step
+            gated = centers > relative
+            return -0.691 + 10.0 * np.log10(np.nan_to_num(energy[gated].sum() / counts[gated].sum()))
+
+    def too_short(self):
+        return self.samples < self.segments_per_block * self.segment_samples
+
+    def signals(self):
+        return {
+            'chunks': np.array(self.chunks, dtype=np.float32),
+            'lufs': self.integrated_loudness() if not self.too_short() else np.nan,
+            'silent': self.samples == 0 or self.silent,
+        }
+
+    @classmethod
+    def rescore(cls, runs, peak_change, burst_loudness):
+        loudness, chunks = stacked(runs, 'chunks')
+        lufs = scalars(runs, 'lufs')
+        silent = scalars(runs, 'silent', bool)
+
+        # Chunk-to-chunk jumps, skipping the first chunk of every run
+        first = np.zeros(len(loudness), dtype=bool)
+        first[(np.cumsum(chunks) - chunks)[chunks > 0]] = True
+        jumps = np.abs(np.diff(loudness, prepend=0)) > peak_change
+        peaks = run_sums(jumps & ~first, chunks)
+        bursts = run_sums(loudness > burst_loudness, chunks)
+        mean_loudness = run_means(loudness, chunks)
+        std_loudness = np.sqrt(run_means((loudness - np.repeat(mean_loudness, chunks)) ** 2, chunks))
 
         # Scoring (normalize to 0–1)
-        base_penalty = min(1.0, (-lufs - 10) / 20)  # -30 to -10 LUFS
-        variation_penalty = min(1.0, std_loudness / 6)
-        peak_penalty = min(1.0, peaks / 10)
-        burst_penalty = min(1.0, high_volume_bursts / len(loudness_chunks))
+        base_penalty = np.minimum(1.0, (-lufs - 10) / 20)  # -30 to -10 LUFS
+        variation_penalty = np.minimum(1.0, std_loudness / 6)
+        peak_penalty = np.minimum(1.0, peaks / 10)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            burst_penalty = np.minimum(1.0, bursts / chunks)
 
         final_penalty = (base_penalty + variation_penalty + peak_penalty + burst_penalty) / 4
         final_score = 1 + 9 * final_penalty
+        return np.where(~silent & ~np.isnan(lufs) & (chunks >= 2), final_score, 1.0)
+
+    def finish(self):
+        if self.samples == 0 or self.silent:
+            log.warning("⚠️ Audio data is empty or silent")
+        elif self.too_short():
+            log.warning("⚠️ Could not compute LUFS: audio is shorter than one gating block")
+        elif len(self.chunks) < 2:
+            log.warning("⚠️ Not enough valid audio chunks for analysis", chunks=len(self.chunks))
+        return self.score_signals()
 
-        return final_score
+def audio_overwhelm_score(video_path, chunk_duration=1.0, chunk_overlap=0.0):
+    return run_audio_consumer(video_path, AudioOverwhelmConsumer(chunk_duration, chunk_overlap))
@@ -0,0 +1,130 @@
+import time
+import numpy as np
+import ffmpeg
+from concurrent.futures import ThreadPoolExecutor
+from logs import get_logger
+
+AUDIO_SAMPLE_RATE = 16000
+
+log = get_logger(__name__)
+
+
+class AudioConsumer:
+    """
+    Base class for analyzers that are fed a video's soundtrack block by block.
+
+    process() receives consecutive float32 mono blocks. A block's buffer is
+    reused for the next one, so consumers must copy anything they keep.
+    Running state lives on the consumer and is turned into a score in
+    finish(), so memory does not grow with the length of the video. As for
+    frame_source.FrameConsumer, signals() and rescore() let a score be
+    recomputed from stored signals with new `scoring` attributes.
+    """
+    elapsed = 0.0  # Busy seconds, filled in by run_audio_consumers
+    decode_time = 0.0  # Seconds spent waiting on the ffmpeg pipe, filled in by run_audio_consumers
+    deferred = False  # Left unfinished for its remote_request(), filled in by run_audio_consumers
+    scoring = ()  # Attributes rescore() takes, which only turn signals into a score
+
+    def start(self, sample_rate):
+        self.sample_rate = sample_rate
+
+    def process(self, block):
+        raise NotImplementedError
+
+    def finish(self):
+        raise NotImplementedError
+
+    def remote_request(self):
+        """What finish() would send to a remote service, if it does; see run_audio_consumers' defer_remote."""
+        return None
+
+    def signals(self):
+        return None
+
+    @classmethod
+    def rescore(cls, runs, **params):
+        raise NotImplementedError
+
+    def scoring_params(self):
+        return {name: getattr(self, name) for name in self.scoring}
+
+    def score_signals(self):
+        return float(self.rescore([self.signals()], **self.scoring_params())[0])
+
+
+def run_audio_consumers(video_path, consumers, sample_rate=AUDIO_SAMPLE_RATE, block_seconds=4.0,
+                        defer_remote=False):
+    """
+    Decode video_path's soundtrack once through an ffmpeg pipe and stream it
+    to every consumer in fixed-size blocks, without temp files.
+
+    consumers is a dict of name -> AudioConsumer. Blocks are processed on the
+    calling thread; finish() runs concurrently for all consumers, since some
+    of them wait on the network. Returns a dict of name -> score.
+    With defer_remote, consumers with a remote_request() are not finished
+    and their result is that request instead, to be awaited elsewhere.
+    """
+    proc = (
+        ffmpeg
+        .input(video_path)
+        .output('pipe:', format='f32le', acodec='pcm_f32le', ac=1, ar=sample_rate)
+        .global_args('-loglevel', 'error', '-nostdin')
+        .run_async(pipe_stdout=True, pipe_stderr=True)
+    )
+
+    for consumer in consumers.values():
+        consumer.elapsed = 0.0
+        consumer.start(sample_rate)
+
+    buffer = bytearray(int(sample_rate * block_seconds) * 4)
+    view = memoryview(buffer)
+    decode_time = 0.0
+    try:
+        while True:
+            got = 0
+            t0 = time.time()
+            while got < len(buffer):
+                n = proc.stdout.readinto(view[got:])
+                if not n:
+                    break
+                got += n
+            decode_time += time.time() - t0
+            if got < 4:
+                break
+
+            block = np.frombuffer(buffer, dtype=np.float32, count=got // 4)
+            for consumer in consumers.values():
+                t0 = time.time()
+                consumer.process(block)
+                consumer.elapsed += time.time() - t0
+            if got < len(buffer):
+                break
+    finally:
+        proc.stdout.close()
+        stderr = proc.stderr.read()
+        proc.stderr.close()
+        proc.wait()
+
+    for consumer in consumers.values():
+        consumer.decode_time = decode_time
+
+    if proc.returncode != 0:
+        log.error("❌ FFmpeg error", video=video_path, stderr=stderr.decode() if stderr else None)
+        raise ffmpeg.Error('ffmpeg', None, stderr)
+
+    def finish(consumer):
+        t0 = time.time()
+        request = consumer.remote_request() if defer_remote else None
+        consumer.deferred = request is not None
+        result = consumer.finish() if request is None else request
+        consumer.elapsed += time.time() - t0
+        return result
+
+    with ThreadPoolExecutor(max_workers=max(1, len(consumers))) as executor:
+        results = dict(zip(consumers, executor.map(finish, consumers.values())))
+    return results
+
+
+def run_audio_consumer(video_path, consumer):
+    """Run a single consumer over its own decode of video_path's soundtrack."""
+    return run_audio_consumers(video_path, {'score': consumer})['score']
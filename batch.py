@@ -0,0 +1,239 @@
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import uuid
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from upload_store import UPLOAD_FOLDER
+from profiles import PROFILES
+from logs import get_logger
+
+# Cores a catalog run may keep busy. The command line runs the analyzers
+# in a pool of this many processes, which every video in flight shares;
+# /analyze/batch shares the web tier's analysis pool (ANALYSIS_WORKERS).
+BATCH_CPUS = int(os.environ.get('BATCH_CPUS', os.cpu_count() or 1))
+# Where /analyze/batch writes its results, and the only folder it may read
+# videos and CSV files from; both must be shared storage for workers on other machines
+BATCH_DIR = os.environ.get('BATCH_DIR', 'batches')
+BATCH_SOURCE_ROOT = os.environ.get('BATCH_SOURCE_ROOT', UPLOAD_FOLDER)
+
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.m4v', '.mkv', '.webm', '.avi')
+CSV_COLUMNS = ('video', 'path', 'url', 'video_url', 'file')  # Header names of the column listing videos
+
+log = get_logger('batch')
+
+
+def is_url(entry):
+    return entry.lower().startswith(('http://', 'https://'))
+
+
+def read_csv_entries(path):
+    """
+    Videos a CSV file lists: those in its video/path/url column if it has a
+    header naming one, else in its first column. Relative paths are taken
+    relative to the CSV file.
+    """
+    with open(path, newline='', encoding='utf-8') as f:
+        rows = [row for row in csv.reader(f) if row and row[0].strip()]
+    if not rows:
+        return []
+    header = [cell.strip().lower() for cell in rows[0]]
+    column = next((header.index(name) for name in CSV_COLUMNS if name in header), None)
+    if column is None:
+        column = 0
+    else:
+        rows = rows[1:]
+
+    entries = []
+    for row in rows:
+        entry = row[column].strip() if column < len(row) else ''
+        if entry:
+            entries.append(entry if is_url(entry) or os.path.isabs(entry)
+                           else os.path.join(os.path.dirname(path), entry))
+    return entries
+
+
+def expand_source(source):
+    """The videos a source names: a URL, a video file, a CSV file, a directory (searched recursively) or a glob."""
+    if is_url(source):
+        return [source]
+    if os.path.isdir(source):
+        return sorted(os.path.join(folder, name) for folder, _, names in os.walk(source)
+                      for name in names if name.lower().endswith(VIDEO_EXTENSIONS))
+    if os.path.isfile(source):
+        return read_csv_entries(source) if source.lower().endswith('.csv') else [source]
+    return sorted(path for path in glob.glob(source, recursive=True) if os.path.isfile(path))
+
+
+def batch_entries(sources, root=None):
+    """
+    Every video the sources name, in order and without duplicates. With a
+    root, sources are relative to it, entries are returned relative to it
+    and ValueError is raised for any path outside it.
+    """
+    if root is not None:
+        root = os.path.realpath(root)
+
+    def inside(path):
+        path = os.path.realpath(path)
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError("Videos must be inside the batch source folder")
+        return path
+
+    entries = {}  # Ordered set
+    for source in sources:
+        if root is not None and not is_url(source):
+            source = inside(os.path.join(root, source))
+        for entry in expand_source(source):
+            if root is not None and not is_url(entry):
+                entry = os.path.relpath(inside(entry), root)
+            entries[entry] = None
+    return list(entries)
+
+
+def completed_entries(output):
+    """Entries output already holds a result for. Failed entries don't count, so they are tried again."""
+    completed = set()
+    if not os.path.exists(output):
+        return completed
+    with open(output, encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue  # Cut short when the last run was interrupted
+            if record.get('status') == 'done':
+                completed.add(record['video'])
+    return completed
+
+
+def score_entry(entry, profile=None, root=None):
+    """
+    Score one video path (relative to root, if given) or URL. Returns its
+    result line: the entry, status, result or error, total seconds and the
+    seconds each stage took.
+    """
+    from video_analysis import analyze_video
+    from downloads import Download
+
+    t0 = time.time()
+    timings = {}
+    record = {'video': entry}
+    downloaded = None
+    try:
+        if is_url(entry):
+            os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+            filename = str(uuid.uuid4()) + '.mp4'
+            downloaded = os.path.join(UPLOAD_FOLDER, filename)
+            result = analyze_video(downloaded, filename, download=Download(entry, downloaded).start(),
+                                   profile=profile, timings=timings)
+        else:
+            path = os.path.join(root, entry) if root else entry
+            if not os.path.isfile(path):
+                raise FileNotFoundError(f"No such video: {entry}")
+            result = analyze_video(path, os.path.basename(path), profile=profile, timings=timings)
+        record.update(status='done', result=result)
+    except Exception as e:
+        log.exception("❌ Error scoring batch video", video=entry)
+        record.update(status='failed', error=str(e) or type(e).__name__)
+    finally:
+        if downloaded is not None and os.path.exists(downloaded):
+            os.remove(downloaded)
+    record.update(seconds=round(time.time() - t0, 2), timings=timings)
+    return record
+
+
+def run_batch(entries, output, profile=None, in_flight=None, progress=None, root=None):
+    """
+    Score entries (video paths, relative to root if given, or URLs) with
+    in_flight videos at a time, appending each one's result line to the
+    JSONL file output as soon as it is scored. Entries output already has a
+    result for are skipped, so rerunning an interrupted batch resumes it.
+    progress, if given, gets the running counts under 'batch'. Returns the counts.
+    """
+    in_flight = in_flight or BATCH_CPUS
+    completed = completed_entries(output)
+    todo = iter([entry for entry in entries if entry not in completed])
+    counts = {'total': len(entries), 'skipped': sum(1 for e in entries if e in completed), 'done': 0, 'failed': 0}
+    t0 = time.time()
+    log.info("📦 Batch started", videos=len(entries), skipped=counts['skipped'], output=output,
+             profile=profile, in_flight=in_flight)
+
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'ab+') as f, ThreadPoolExecutor(max_workers=in_flight) as executor:
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')  # Close off a line an interruption cut short
+
+        # Videos are submitted as slots free up rather than all at once,
+        # so an interrupted batch has only the videos in flight to abandon
+        futures = set()
+        while True:
+            while len(futures) < in_flight:
+                entry = next(todo, None)
+                if entry is None:
+                    break
+                futures.add(executor.submit(score_entry, entry, profile, root))
+            if not futures:
+                break
+            finished, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in finished:
+                record = future.result()
+                f.write((json.dumps(record, ensure_ascii=False, default=str) + '\n').encode('utf-8'))
+                f.flush()
+                counts[record['status']] += 1
+                log.info("🎞️ Batch video scored", video=record['video'], status=record['status'],
+                         seconds=record['seconds'], scored=counts['done'] + counts['failed'] + counts['skipped'],
+                         total=counts['total'])
+                if progress is not None:
+                    progress['batch'] = dict(counts)
+
+    counts['seconds'] = round(time.time() - t0, 2)
+    log.info("🏁 Batch finished", output=output, **counts)
+    return counts
+
+
+def batch_output(name):
+    return os.path.join(BATCH_DIR, name + '.jsonl')
+
+
+def run_batch_job(job, entries, name, profile=None):
+    """The 'batch' job task: score entries relative to BATCH_SOURCE_ROOT into the results named name."""
+    job.progress = {'batch': {'total': len(entries), 'skipped': 0, 'done': 0, 'failed': 0}}
+    counts = run_batch(entries, batch_output(name), profile, progress=job.progress, root=BATCH_SOURCE_ROOT)
+    return dict(counts, name=name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score a catalog of videos into a JSONL file.")
+    parser.add_argument('sources', nargs='+',
+                        help="Video files, directories, globs, CSV files listing videos, or video URLs")
+    parser.add_argument('-o', '--output', required=True,
+                        help="JSONL file results are appended to; run again with the same file to resume")
+    parser.add_argument('--profile', choices=list(PROFILES), help="Analysis profile (default: ANALYSIS_PROFILE)")
+    parser.add_argument('--cpus', type=int, default=BATCH_CPUS, help="Cores to use in all")
+    parser.add_argument('--in-flight', type=int, help="Videos analyzed at a time (default: --cpus)")
+    args = parser.parse_args(argv)
+
+    # Read by analysis_pool on import: one pool of --cpus warm processes runs
+    # the analyzers of every video, so the videos in flight share the cores
+    os.environ.setdefault('ANALYSIS_EXECUTOR', 'process')
+    os.environ['ANALYSIS_WORKERS'] = str(args.cpus)
+
+    entries = batch_entries(args.sources)
+    if not entries:
+        print("No videos found.")
+        return 1
+    counts = run_batch(entries, args.output, args.profile, args.in_flight or args.cpus)
+    print(f"\n{'❌' if counts['failed'] else '✅'} {counts['done']} scored, {counts['failed']} failed, "
+          f"{counts['skipped']} already done in {counts['seconds']}s → {args.output}")
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,344 @@
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import numpy as np
+import soundfile as sf
+import ffmpeg
+
+BENCH_DIR = os.environ.get('BENCH_DIR', 'bench')
+BENCH_HISTORY = os.environ.get('BENCH_HISTORY', os.path.join(BENCH_DIR, 'history.json'))
+
+# Synthetic videos: size, fps and length, plus how many scene cuts and
+# flashes they contain and how fast their content moves (frame widths per
+# second). Videos marked quick make up the --quick subset.
+BENCH_CORPUS = {
+    'sd24_calm': {'size': (640, 360), 'fps': 24, 'seconds': 20, 'cuts': 2, 'flashes': 0, 'motion': 0.02, 'quick': True},
+    'hd30_busy': {'size': (1280, 720), 'fps': 30, 'seconds': 20, 'cuts': 12, 'flashes': 6, 'motion': 0.15, 'quick': True},
+    'fhd30': {'size': (1920, 1080), 'fps': 30, 'seconds': 10, 'cuts': 4, 'flashes': 2, 'motion': 0.05},
+    'hd60': {'size': (1280, 720), 'fps': 60, 'seconds': 10, 'cuts': 4, 'flashes': 2, 'motion': 0.08},
+    'sd25_long': {'size': (640, 360), 'fps': 25, 'seconds': 120, 'cuts': 30, 'flashes': 4, 'motion': 0.05},
+}
+
+# Relative increase of a metric that counts as a regression, and the
+# absolute increase below which differences are treated as noise
+REGRESSION_THRESHOLD = 0.10
+NOISE_FLOOR = {'wall_s': 0.05, 'cpu_s': 0.05, 'peak_rss_mb': 5.0}
+
+
+def make_video(path, size, fps, seconds, cuts=0, flashes=0, motion=0.05, seed=0, sample_rate=44100, **_):
+    """
+    Write a deterministic synthetic video with a tone-and-noise soundtrack.
+
+    Every scene is a smooth colour field with a low-frequency texture that
+    pans at `motion` frame widths per second, and a few shapes moving
+    across it. Scenes change at `cuts` evenly spread cuts, and `flashes`
+    two-frame white flashes are spread in between. No faces are drawn.
+    """
+    rng = np.random.default_rng(seed)
+    width, height = size
+    frame_count = int(round(fps * seconds))
+    cut_frames = set(np.linspace(0, frame_count, cuts + 2, dtype=int)[1:-1])
+    flash_frames = set(np.linspace(0, frame_count, flashes + 2, dtype=int)[1:-1] + fps // 3)
+
+    def new_scene():
+        colors = rng.integers(0, 256, (2, 3))
+        ramp = np.linspace(0, 1, width)[None, :, None]
+        field = (colors[0] * (1 - ramp) + colors[1] * ramp).astype(np.float32)
+        texture = cv2.resize(rng.normal(0, 30, (height // 16 + 1, width // 8 + 1)).astype(np.float32),
+                             (width * 2, height), interpolation=cv2.INTER_CUBIC)
+        shapes = [(rng.uniform(0, width), rng.uniform(0, height), rng.uniform(-1, 1) * motion * width,
+                   rng.uniform(-1, 1) * motion * height, int(rng.integers(height // 20, height // 6)),
+                   tuple(int(c) for c in rng.integers(0, 256, 3))) for _ in range(int(rng.integers(2, 6)))]
+        return field, texture, shapes
+
+    video_path = path + '.video.avi'
+    writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+    field, texture, shapes = new_scene()
+    scene_start = 0
+    flash_left = 0
+    for index in range(frame_count):
+        if index in cut_frames:
+            field, texture, shapes = new_scene()
+            scene_start = index
+        if index in flash_frames:
+            flash_left = 2
+        if flash_left:
+            writer.write(np.full((height, width, 3), 255, dtype=np.uint8))
+            flash_left -= 1
+            continue
+
+        t = (index - scene_start) / fps
+        offset = int(t * motion * width) % width
+        frame = field + texture[:, offset:offset + width, None]
+        frame = np.clip(frame, 0, 255).astype(np.uint8)
+        for (x, y, vx, vy, radius, color) in shapes:
+            center = (int(x + vx * t) % width, int(y + vy * t) % height)
+            cv2.circle(frame, center, radius, color, -1)
+        writer.write(frame)
+    writer.release()
+
+    # Tone with a slow tremolo, plus noise bursts on the scene cuts
+    samples = np.arange(int(seconds * sample_rate)) / sample_rate
+    audio = 0.2 * np.sin(2 * np.pi * 220 * samples) * (0.6 + 0.4 * np.sin(2 * np.pi * 0.5 * samples))
+    for cut in cut_frames:
+        start = int(cut / fps * sample_rate)
+        audio[start:start + sample_rate // 4] += rng.normal(0, 0.3, len(audio[start:start + sample_rate // 4]))
+    audio_path = path + '.audio.wav'
+    sf.write(audio_path, np.clip(audio, -1, 1).astype(np.float32), sample_rate)
+
+    try:
+        (
+            ffmpeg
+            .output(ffmpeg.input(video_path), ffmpeg.input(audio_path), path,
+                    vcodec='libx264', preset='veryfast', pix_fmt='yuv420p', acodec='aac', shortest=None)
+            .global_args('-loglevel', 'error')
+            .overwrite_output()
+            .run()
+        )
+    finally:
+        os.remove(video_path)
+        os.remove(audio_path)
+    return path
+
+
+def corpus(names=None, quick=False):
+    """Paths of the benchmark videos by name, generating the missing or outdated ones."""
+    folder = os.path.join(BENCH_DIR, 'corpus')
+    os.makedirs(folder, exist_ok=True)
+    names = names or [n for n, spec in BENCH_CORPUS.items() if spec.get('quick') or not quick]
+
+    paths = {}
+    for seed, name in enumerate(BENCH_CORPUS):
+        if name not in names:
+            continue
+        spec = BENCH_CORPUS[name]
+        path = os.path.join(folder, name + '.mp4')
+        spec_path = path + '.json'
+        spec_json = json.dumps(dict(spec, seed=seed), sort_keys=True)
+        if not os.path.exists(path) or not os.path.exists(spec_path) or open(spec_path).read() != spec_json:
+            print(f"🎨 Generating {name}...")
+            make_video(path, seed=seed, **spec)
+            with open(spec_path, 'w') as f:
+                f.write(spec_json)
+        paths[name] = path
+    return paths
+
+
+def _run_case(path, key, profile):
+    """
+    Runs in a fresh process: one analyzer in isolation (key), or the full
+    /analyze pipeline (key None) with an empty result cache and feature
+    store. A pipeline run that reuses cached scores or stored signals
+    anyway is reported as an error, since it didn't measure an analysis.
+    CPU time counts this process and the children it waited for (ffmpeg),
+    so use the thread executor for the pipeline to account for all of it.
+    """
+    if key is None:
+        cache_dir = tempfile.mkdtemp()
+        os.environ['RESULT_CACHE_PATH'] = os.path.join(cache_dir, 'results.sqlite3')
+        os.environ['FEATURE_STORE_PATH'] = os.path.join(cache_dir, 'features')
+        os.environ['JOB_BACKEND'] = 'local'  # Score in this process, where the CPU time is measured
+        import app as web
+        client = web.app.test_client()
+        stored_videos = web.feature_store.stats()['videos']
+    else:
+        from analyzers import run_video_analyzers, run_audio_analyzers, VIDEO_ANALYZERS
+
+    self_before = resource.getrusage(resource.RUSAGE_SELF)
+    children_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    t0 = time.perf_counter()
+    error = None
+    try:
+        if key is None:
+            with open(path, 'rb') as f:
+                response = client.post('/analyze', data={'video': (f, os.path.basename(path)), 'profile': profile or ''},
+                                       content_type='multipart/form-data')
+            if response.status_code != 200:
+                error = f"HTTP {response.status_code}: {response.get_json()}"
+            else:
+                os.remove(os.path.join(web.UPLOAD_FOLDER, response.get_json()['filename']))
+        elif key in VIDEO_ANALYZERS:
+            run_video_analyzers(path, [key], profile=profile)
+        else:
+            run_audio_analyzers(path, [key], profile=profile)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    wall = time.perf_counter() - t0
+    self_after = resource.getrusage(resource.RUSAGE_SELF)
+    children_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    if key is None and error is None:
+        cache_hits = web.result_cache.stats()['hits']
+        if cache_hits or stored_videos:
+            error = (f"Not a full analysis: {cache_hits} result cache hit(s), "
+                     f"{stored_videos} video(s) in the feature store beforehand")
+
+    cpu = sum(getattr(after, field) - getattr(before, field)
+              for before, after in ((self_before, self_after), (children_before, children_after))
+              for field in ('ru_utime', 'ru_stime'))
+    return {
+        'wall_s': round(wall, 3),
+        'cpu_s': round(cpu, 3),
+        'peak_rss_mb': round(max(self_after.ru_maxrss, children_after.ru_maxrss) / 1024, 1),
+        'error': error,
+    }
+
+
+def run_benchmarks(videos, keys=None, pipeline=True, repeat=1, profile=None):
+    """
+    Benchmark every analyzer in isolation and the full pipeline on every
+    video, each case in its own process. Wall and CPU time are the median
+    over repeat runs, peak RSS the maximum.
+    """
+    from analyzers import VIDEO_ANALYZERS, AUDIO_ANALYZERS
+
+    keys = keys or list(VIDEO_ANALYZERS) + list(AUDIO_ANALYZERS)
+    cases = [key for key in keys] + ([None] if pipeline else [])
+    context = multiprocessing.get_context('spawn')
+
+    results = {}
+    for name, path in videos.items():
+        spec = BENCH_CORPUS.get(name, {})
+        frames = int(round(spec['fps'] * spec['seconds'])) if spec else None
+        for key in cases:
+            case = f"{name}:{key or 'pipeline'}"
+            runs = []
+            for _ in range(repeat):
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                    runs.append(executor.submit(_run_case, path, key, profile).result())
+            errors = [r['error'] for r in runs if r['error']]
+            row = {
+                'wall_s': float(np.median([r['wall_s'] for r in runs])),
+                'cpu_s': float(np.median([r['cpu_s'] for r in runs])),
+                'peak_rss_mb': max(r['peak_rss_mb'] for r in runs),
+            }
+            row['fps'] = round(frames / row['wall_s'], 1) if frames and row['wall_s'] else None
+            if errors:
+                row['error'] = errors[0]
+            results[case] = row
+            status = f"❌ {row['error']}" if errors else f"{row['fps']} fps"
+            print(f"⏱️ {case}: {row['wall_s']}s wall, {row['cpu_s']}s CPU, {row['peak_rss_mb']} MB peak, {status}")
+    return results
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path=BENCH_HISTORY):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def record_run(results, label=None, profile=None, path=BENCH_HISTORY):
+    """Append a benchmark run to the JSON history file and return it."""
+    history = load_history(path)
+    run = {
+        'id': len(history),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': _git_commit(),
+        'label': label,
+        'profile': profile,
+        'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'cpus': os.cpu_count()},
+        'results': results,
+    }
+    history.append(run)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(history, f, indent=2)
+    return run
+
+
+def compare_runs(base, head, threshold=REGRESSION_THRESHOLD):
+    """
+    Compare two recorded runs case by case. Returns a list of
+    (case, metric, base value, head value, relative change, regressed).
+    """
+    rows = []
+    for case, new in head['results'].items():
+        old = base['results'].get(case)
+        if old is None or old.get('error') or new.get('error'):
+            continue
+        for metric, floor in NOISE_FLOOR.items():
+            change = (new[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+            regressed = change > threshold and new[metric] - old[metric] > floor
+            rows.append((case, metric, old[metric], new[metric], change, regressed))
+    return rows
+
+
+def _find_run(history, run_id):
+    for run in history:
+        if str(run['id']) == str(run_id) or run.get('label') == run_id:
+            return run
+    raise SystemExit(f"No benchmark run '{run_id}' in {BENCH_HISTORY}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the analyzers on a synthetic video corpus.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = commands.add_parser('run', help="Run the benchmarks and record them in the history file")
+    run_parser.add_argument('--quick', action='store_true', help="Only the quick subset of the corpus")
+    run_parser.add_argument('--videos', help="Comma-separated corpus names")
+    run_parser.add_argument('--keys', help="Comma-separated analyzer keys (default: all)")
+    run_parser.add_argument('--no-pipeline', action='store_true', help="Skip the full /analyze pipeline")
+    run_parser.add_argument('--repeat', type=int, default=1)
+    run_parser.add_argument('--profile', help="Analysis profile, see profiles.PROFILES")
+    run_parser.add_argument('--label')
+
+    compare_parser = commands.add_parser('compare', help="Flag regressions between two recorded runs")
+    compare_parser.add_argument('base', nargs='?', help="Run id or label (default: the second to last run)")
+    compare_parser.add_argument('head', nargs='?', help="Run id or label (default: the last run)")
+    compare_parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+
+    commands.add_parser('corpus', help="Only generate the corpus")
+    args = parser.parse_args(argv)
+
+    if args.command == 'corpus':
+        for name, path in corpus().items():
+            print(f"• {name}: {path}")
+        return 0
+
+    if args.command == 'run':
+        videos = corpus(args.videos.split(',') if args.videos else None, args.quick)
+        results = run_benchmarks(videos, args.keys.split(',') if args.keys else None,
+                                 not args.no_pipeline, args.repeat, args.profile)
+        run = record_run(results, args.label, args.profile)
+        print(f"\n💾 Recorded run {run['id']} in {BENCH_HISTORY}")
+        return 0
+
+    history = load_history()
+    if len(history) < 2 and not (args.base and args.head):
+        print("Need at least two recorded runs to compare.")
+        return 1
+    base = _find_run(history, args.base) if args.base else history[-2]
+    head = _find_run(history, args.head) if args.head else history[-1]
+
+    print(f"📊 Run {base['id']} ({base['commit']}) → run {head['id']} ({head['commit']}):")
+    regressions = 0
+    for case, metric, old, new, change, regressed in compare_runs(base, head, args.threshold):
+        if regressed:
+            regressions += 1
+        marker = '⚠️ ' if regressed else '  '
+        print(f"{marker}{case:<28} {metric:<12} {old:>9} → {new:<9} ({change:+.1%})")
+    print(f"\n{'❌' if regressions else '✅'} {regressions} regression(s) above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,225 @@
+import os
+import time
+import uuid
+import json
+import sqlite3
+from contextlib import contextmanager
+from jobs import QueueFull, JOB_QUEUE_SIZE, JOB_TTL
+
+# Where queued jobs live when analysis runs in separate worker processes
+# (see worker.py). sqlite:///path keeps them in an SQLite file, which every
+# web and worker process on the host (or on a shared volume) can open.
+JOB_BROKER_URL = os.environ.get('JOB_BROKER_URL', 'sqlite:///' + os.path.join('cache', 'jobs.sqlite3'))
+JOB_LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', 60))  # A worker silent for this long has crashed
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))  # Claims of a job before it is given up on
+
+
+class ClaimedJob:
+    """A job a worker holds the lease on. Has the attributes task functions use on jobs.Job."""
+
+    def __init__(self, id, task, args, attempts, created_at):
+        self.id = id
+        self.task = task
+        self.args = args
+        self.attempts = attempts
+        self.created_at = created_at
+        self.status = 'running'
+        self.progress = {}
+
+
+class Broker:
+    """
+    Queue between the web tier, which submits jobs, and any number of
+    worker processes, possibly on other machines, which run them.
+
+    A worker claims a job together with a lease of lease_seconds and keeps
+    renewing it with heartbeat() while the job runs. The job of a worker that
+    stops heartbeating is handed to the next claim() once its lease runs out,
+    up to max_attempts claims in all; after that it fails. A job whose task
+    raises is not retried. Jobs are plain data: a task name, JSON-able
+    arguments and details, so a broker can keep them anywhere every process
+    can reach; a Redis-backed broker would implement these same methods.
+    """
+
+    def __init__(self, lease_seconds=None, max_attempts=None, max_pending=None, ttl=None):
+        self.lease_seconds = lease_seconds if lease_seconds is not None else JOB_LEASE_SECONDS
+        self.max_attempts = max_attempts if max_attempts is not None else JOB_MAX_ATTEMPTS
+        self.max_pending = max_pending if max_pending is not None else JOB_QUEUE_SIZE
+        self.ttl = ttl if ttl is not None else JOB_TTL
+
+    def submit(self, task, args, details=None):
+        """Queue a job; returns its id. Raises jobs.QueueFull when max_pending jobs are waiting."""
+        raise NotImplementedError
+
+    def full(self):
+        raise NotImplementedError
+
+    def claim(self, worker_id):
+        """Lease the oldest runnable job to worker_id; returns a ClaimedJob, or None if there is none."""
+        raise NotImplementedError
+
+    def heartbeat(self, job, worker_id):
+        """Renew the lease on job and publish its progress; False once the lease has passed to another worker."""
+        raise NotImplementedError
+
+    def finish(self, job, worker_id, result=None, error=None):
+        """Record a job's result, or its error; False if the lease had passed to another worker."""
+        raise NotImplementedError
+
+    def get(self, job_id):
+        """The job as jobs.Job.to_dict() describes it, or None if unknown or expired."""
+        raise NotImplementedError
+
+    def wait(self, job_id, timeout=None, poll=0.5):
+        """Poll until the job is done or failed (or timeout seconds pass); returns get(job_id)."""
+        deadline = time.time() + timeout if timeout is not None else None
+        while True:
+            job = self.get(job_id)
+            if job is None or job['status'] in ('done', 'failed'):
+                return job
+            if deadline is not None and time.time() >= deadline:
+                return job
+            time.sleep(poll)
+
+
+class SQLiteBroker(Broker):
+    """Broker keeping its jobs in one SQLite table. Safe to share between threads and processes."""
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            db.execute('PRAGMA journal_mode=WAL')
+        finally:
+            db.close()
+        with self._transaction() as db:
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    task TEXT NOT NULL,
+                    args TEXT NOT NULL,
+                    details TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    progress TEXT NOT NULL DEFAULT '{}',
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    lease_expires REAL,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL
+                )
+            """)
+            db.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)')
+
+    @contextmanager
+    def _transaction(self, mode='IMMEDIATE'):
+        """Connection inside a transaction. IMMEDIATE takes the write lock up front, so claims can't interleave."""
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            db.execute(f'BEGIN {mode}')
+            try:
+                yield db
+                db.execute('COMMIT')
+            except BaseException:
+                db.execute('ROLLBACK')
+                raise
+        finally:
+            db.close()
+
+    def _pending(self, db):
+        return db.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+    def submit(self, task, args, details=None):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._transaction() as db:
+            if self._pending(db) >= self.max_pending:
+                raise QueueFull(f"{self.max_pending} jobs are already waiting")
+            db.execute('DELETE FROM jobs WHERE finished_at < ?', (now - self.ttl,))
+            db.execute(
+                "INSERT INTO jobs (id, task, args, details, status, created_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+                (job_id, task, json.dumps(list(args)), json.dumps(details or {}), now)
+            )
+        return job_id
+
+    def full(self):
+        with self._transaction('DEFERRED') as db:
+            return self._pending(db) >= self.max_pending
+
+    def claim(self, worker_id):
+        now = time.time()
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, worker = NULL "
+                "WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                (f"Lost its worker {self.max_attempts} times", now, now, self.max_attempts)
+            )
+            row = db.execute(
+                "SELECT id, task, args, attempts, created_at FROM jobs "
+                "WHERE status = 'queued' OR (status = 'running' AND lease_expires < ?) "
+                "ORDER BY created_at LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            job_id, task, args, attempts, created_at = row
+            db.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, lease_expires = ?, attempts = ?, "
+                "started_at = COALESCE(started_at, ?) WHERE id = ?",
+                (worker_id, now + self.lease_seconds, attempts + 1, now, job_id)
+            )
+        return ClaimedJob(job_id, task, json.loads(args), attempts + 1, created_at)
+
+    def heartbeat(self, job, worker_id):
+        progress = {key: dict(value) for key, value in dict(job.progress).items()}
+        with self._transaction() as db:
+            updated = db.execute(
+                "UPDATE jobs SET lease_expires = ?, progress = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + self.lease_seconds, json.dumps(progress), job.id, worker_id)
+            ).rowcount
+        return updated == 1
+
+    def finish(self, job, worker_id, result=None, error=None):
+        with self._transaction() as db:
+            updated = db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?, worker = NULL "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                ('failed' if error is not None else 'done', json.dumps(result), error, time.time(),
+                 job.id, worker_id)
+            ).rowcount
+        return updated == 1
+
+    def get(self, job_id):
+        with self._transaction('DEFERRED') as db:
+            row = db.execute(
+                'SELECT id, status, details, progress, result, error, attempts, created_at, started_at, finished_at '
+                'FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        job_id, status, details, progress, result, error, attempts, created_at, started_at, finished_at = row
+        now = time.time()
+        return {
+            'id': job_id,
+            'status': status,
+            'details': json.loads(details),
+            'progress': json.loads(progress),
+            'result': json.loads(result) if result is not None else None,
+            'error': error,
+            'attempts': attempts,
+            'queued_seconds': round((started_at or now) - created_at, 2),
+            'running_seconds': round((finished_at or now) - started_at, 2) if started_at else None,
+        }
+
+
+def get_broker(url=None):
+    """The broker a JOB_BROKER_URL-style url names."""
+    url = url or JOB_BROKER_URL
+    if url.startswith('sqlite:///'):
+        return SQLiteBroker(url[len('sqlite:///'):])
+    raise ValueError(f"Unsupported job broker {url!r}, expected sqlite:///path")
@@ -1,57 +1,91 @@
 import cv2
 import numpy as np
+from frame_source import FrameConsumer, run_consumer
+from optical_flow import FlowService, FLOW_BACKENDS, DEFAULT_FLOW_BACKEND
+from adaptive_sampling import FrameSampler, run_sampler, resized, DEFAULT_SAMPLING
+from feature_store import stacked, run_means
+from logs import get_logger
 
-def camera_movement_score(video_path, resize_factor=0.4, frame_skip=3):
-    cap = cv2.VideoCapture(video_path)
+log = get_logger(__name__)
 
-    if not cap.isOpened():
-        print(f"Error opening video file: {video_path}")
-        return 0
 
-    total_magnitude = 0
-    frame_count = 0
-    prev_gray = None
-    frame_idx = 0
+def camera_score_from(avg_motion, min_motion=0.5, max_motion=5.0):
+    # Non-linear scaling for score
+    normalized = np.maximum(0, (avg_motion - min_motion) / (max_motion - min_motion))
+    motion_score = 1 + 9 * (normalized ** 0.26)
+    return np.clip(motion_score, 1, 10)  # Clamp to 1–10
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
 
-        frame_idx += 1
-        if frame_idx % frame_skip != 0:
-            continue
+class CameraMovementConsumer(FrameConsumer):
+    """Scores the average optical-flow magnitude served by a shared FlowService."""
+    motion_interval = 3 / 30  # Thresholds were tuned on 3-frame gaps at 30 fps
+    min_motion = 0.5  # Average magnitude, per motion_interval, scoring 1...
+    max_motion = 5.0  # ...and 10
+    takes_frames = False  # All frame work happens in the flow service
+    scoring = ('min_motion', 'max_motion')
 
-        try:
-            frame_small = cv2.resize(frame, (0, 0), fx=resize_factor, fy=resize_factor)
-            gray = cv2.cvtColor(frame_small, cv2.COLOR_BGR2GRAY)
-        except Exception as e:
-            print(f"Skipping frame {frame_idx} due to error: {e}")
-            continue
+    def __init__(self, flow=None):
+        self.flow = flow or FlowService()
+        self.depends_on = [self.flow]
 
-        if prev_gray is not None:
-            # Use Farneback optical flow
-            flow = cv2.calcOpticalFlowFarneback(
-                prev_gray, gray,
-                None, 0.5, 3, 15, 3, 5, 1.2, 0
-            )
-            magnitude, _ = cv2.cartToPolar(flow[..., 0], flow[..., 1])
-            total_magnitude += np.mean(magnitude)
-            frame_count += 1
+    def process(self, index, frame):
+        pass
 
-        prev_gray = gray
+    def signals(self):
+        return {'magnitudes': self.flow.magnitudes(seconds=self.motion_interval).astype(np.float32)}
 
-    cap.release()
+    @classmethod
+    def rescore(cls, runs, min_motion, max_motion):
+        magnitudes, lengths = stacked(runs, 'magnitudes')
+        return np.where(lengths > 0, camera_score_from(run_means(magnitudes, lengths), min_motion, max_motion), 0)
 
-    if frame_count == 0:
-        print("Not enough frames to analyze.")
-        return 0
+    def finish(self):
+        if len(self.flow.mean_magnitudes) == 0:
+            log.warning("Not enough frames to analyze")
+        return self.score_signals()
 
-    avg_motion = total_magnitude / frame_count
 
-    # Non-linear scaling for score
-    min_motion = 0.5
-    max_motion = 5.0
-    normalized = max(0, (avg_motion - min_motion) / (max_motion - min_motion))
-    motion_score = 1 + 9 * (normalized ** 0.26)
-    return max(1, min(10, motion_score))  # Clamp to 1–10
+class CameraMovementSampler(FrameSampler):
+    """
+    CameraMovementConsumer's average flow magnitude, estimated from as few
+    frame pairs as the tolerance allows. Each draw computes the flow between
+    a grid frame and the one stride frames later, the same pairs the
+    FlowService would see.
+    """
+    motion_interval = CameraMovementConsumer.motion_interval
+
+    def __init__(self, resize_factor=0.4, sample_fps=10, backend=None, **kwargs):
+        super().__init__(**kwargs)
+        self.resize_factor = resize_factor
+        self.sample_fps = sample_fps
+        self.backend_name = backend or DEFAULT_FLOW_BACKEND
+        if self.backend_name not in FLOW_BACKENDS:
+            raise ValueError(f"Unknown flow backend: {self.backend_name}")
+
+    def start(self, fps, frame_count):
+        super().start(fps, frame_count)
+        self.offset = self.stride - 1
+        self.backend = FLOW_BACKENDS[self.backend_name]()
+
+    def grid(self):
+        return range(self.offset, self.frame_count - self.stride, self.stride)
+
+    def measure(self, reader, index):
+        prev = reader.read(index)
+        frame = reader.read(index + self.stride)
+        if prev is None or frame is None:
+            return None
+        prev_gray = cv2.cvtColor(resized(prev, self.resize_factor), cv2.COLOR_BGR2GRAY)
+        gray = cv2.cvtColor(resized(frame, self.resize_factor), cv2.COLOR_BGR2GRAY)
+        magnitude = self.backend.mean_magnitude(prev_gray, gray)
+        return (magnitude * self.motion_interval / (self.stride / self.fps),)
+
+    def score(self, means):
+        return camera_score_from(means[0], CameraMovementConsumer.min_motion, CameraMovementConsumer.max_motion)
+
+
+def camera_movement_score(video_path, resize_factor=0.4, sample_fps=10, flow_backend=None, sampling=None):
+    if (sampling or DEFAULT_SAMPLING) == 'adaptive':
+        return run_sampler(video_path, CameraMovementSampler(resize_factor, sample_fps, flow_backend))
+    flow = FlowService(resize_factor, sample_fps, flow_backend)
+    return run_consumer(video_path, CameraMovementConsumer(flow))
@@ -1,49 +1,92 @@
 import cv2
 import numpy as np
+from frame_source import FrameConsumer, run_consumer
+from adaptive_sampling import FrameSampler, run_sampler, resized, DEFAULT_SAMPLING
+from feature_store import stacked, run_means
+from logs import get_logger
 
-def color_score(video_path):
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print(f"Error opening video: {video_path}")
-        return 0
+log = get_logger(__name__)
 
-    total_saturation = 0
-    total_brightness = 0
-    frame_count = 0
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+def color_score_from(avg_saturation, avg_brightness, sat_min=50, sat_max=150, bright_min=70, bright_max=250):
+    # Compute saturation score
+    sat_score = 1 + ((avg_saturation - sat_min) * 9 / (sat_max - sat_min))
+    sat_score = np.clip(sat_score, 1, 10)
+
+    # Compute brightness score
+    bright_score = 1 + ((avg_brightness - bright_min) * 9 / (bright_max - bright_min))
+    bright_score = np.clip(bright_score, 1, 10)
+
+    # Combine
+    return 0.5 * sat_score + 0.5 * bright_score
+
+
+class ColorConsumer(FrameConsumer):
+    sat_min, sat_max = 50, 150  # Average saturation scoring 1 and 10
+    bright_min, bright_max = 70, 250  # Average brightness scoring 1 and 10
+    merged = ('saturations', 'brightnesses')
+    scoring = ('sat_min', 'sat_max', 'bright_min', 'bright_max')
+
+    def __init__(self, resize_factor=None, sample_fps=5):
+        self.resize_factor = resize_factor
+        self.sample_fps = sample_fps  # Average saturation/brightness converge with a few frames per second
+        self.features = [('hsv', resize_factor)]
 
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    def start(self, fps, frame_count):
+        super().start(fps, frame_count)
+        self.saturations = []  # Per frame, averaged when scoring so merged segments add up exactly
+        self.brightnesses = []
+
+    def process(self, index, frame):
+        hsv = frame.hsv(self.resize_factor)
         saturation = hsv[:, :, 1]
         brightness = hsv[:, :, 2]
 
-        total_saturation += np.mean(saturation)
-        total_brightness += np.mean(brightness)
-        frame_count += 1
+        self.saturations.append(np.mean(saturation))
+        self.brightnesses.append(np.mean(brightness))
 
-    cap.release()
+    def signals(self):
+        return {
+            'saturations': np.array(self.saturations, dtype=np.float32),
+            'brightnesses': np.array(self.brightnesses, dtype=np.float32),
+        }
 
-    if frame_count == 0:
-        print("No frames analyzed.")
-        return 0
+    @classmethod
+    def rescore(cls, runs, sat_min, sat_max, bright_min, bright_max):
+        saturations, lengths = stacked(runs, 'saturations')
+        brightnesses, _ = stacked(runs, 'brightnesses')
+        score = color_score_from(run_means(saturations, lengths), run_means(brightnesses, lengths),
+                                 sat_min, sat_max, bright_min, bright_max)
+        return np.where(lengths > 0, score, 0)
 
-    avg_saturation = total_saturation / frame_count
-    avg_brightness = total_brightness / frame_count
+    def finish(self):
+        if not self.saturations:
+            log.warning("No frames analyzed")
+        return self.score_signals()
 
-    # Compute saturation score
-    sat_min, sat_max = 50, 150
-    sat_score = 1 + ((avg_saturation - sat_min) * 9 / (sat_max - sat_min))
-    sat_score = np.clip(sat_score, 1, 10)
 
-    # Compute brightness score
-    bright_min, bright_max = 70, 250
-    bright_score = 1 + ((avg_brightness - bright_min) * 9 / (bright_max - bright_min))
-    bright_score = np.clip(bright_score, 1, 10)
+class ColorSampler(FrameSampler):
+    """ColorConsumer's averages, estimated from as few frames as the tolerance allows."""
+    statistics = 2
+
+    def __init__(self, resize_factor=None, sample_fps=5, **kwargs):
+        super().__init__(**kwargs)
+        self.resize_factor = resize_factor
+        self.sample_fps = sample_fps
+
+    def measure(self, reader, index):
+        frame = reader.read(index)
+        if frame is None:
+            return None
+        hsv = cv2.cvtColor(resized(frame, self.resize_factor), cv2.COLOR_BGR2HSV)
+        return np.mean(hsv[:, :, 1]), np.mean(hsv[:, :, 2])
+
+    def score(self, means):
+        return color_score_from(*means, ColorConsumer.sat_min, ColorConsumer.sat_max,
+                                ColorConsumer.bright_min, ColorConsumer.bright_max)
 
-    # Combine
-    final_score = 0.5 * sat_score + 0.5 * bright_score
 
-    return final_score
+def color_score(video_path, sampling=None):
+    if (sampling or DEFAULT_SAMPLING) == 'adaptive':
+        return run_sampler(video_path, ColorSampler())
+    return run_consumer(video_path, ColorConsumer())
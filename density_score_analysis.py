@@ -1,42 +1,65 @@
 import cv2
 import numpy as np
+from frame_source import FrameConsumer, run_consumer
+from feature_store import stacked, run_means
 
-def density_score(video_path):
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print(f"Error opening video file: {video_path}")
-        return 0
 
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    fgbg = cv2.createBackgroundSubtractorMOG2()
-    motion_pixel_ratios = []
+class DensityConsumer(FrameConsumer):
+    """
+    Average share of foreground pixels under a MOG2 background subtractor.
+    The subtractor's model depends on every earlier frame, so a segment is
+    preceded by warmup_seconds of frames that only train it; their effect on
+    the model has decayed to noise by the segment's first frame.
+    """
+    warmup_seconds = 120
+    min_density = 0.01  # Average foreground share scoring 1...
+    max_density = 0.2   # ...and 10
+    merged = ('motion_pixel_ratios',)
+    scoring = ('min_density', 'max_density')
+
+    def __init__(self, resize_factor=None, sample_fps=None):
+        self.resize_factor = resize_factor
+        # MOG2's foreground mask depends on the spacing of the frames it learns
+        # from, so a reduced rate changes the statistic itself; opt-in only
+        self.sample_fps = sample_fps
+        self.features = [('gray', resize_factor)]
+
+    def start(self, fps, frame_count):
+        super().start(fps, frame_count)
+        self.warmup = int(round(self.warmup_seconds * fps / self.stride))
+        self.fgbg = cv2.createBackgroundSubtractorMOG2()
+        self.motion_pixel_ratios = []
 
-    for _ in range(frame_count):
-        ret, frame = cap.read()
-        if not ret:
-            break
+    def wants(self, index):
+        return index < self.frame_count and super().wants(index)
 
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        fgmask = fgbg.apply(gray)
+    def process(self, index, frame):
+        fgmask = self.fgbg.apply(frame.gray(self.resize_factor))
+        if index < self.segment[0]:
+            return  # Warming up the model for a segment
 
         motion_pixels = np.sum(fgmask > 127)
         total_pixels = fgmask.size
         motion_ratio = motion_pixels / total_pixels
-        motion_pixel_ratios.append(motion_ratio)
+        self.motion_pixel_ratios.append(motion_ratio)
 
-    cap.release()
+    def signals(self):
+        return {'ratios': np.array(self.motion_pixel_ratios, dtype=np.float32)}
 
-    if not motion_pixel_ratios:
-        return 0
+    @classmethod
+    def rescore(cls, runs, min_density, max_density):
+        ratios, lengths = stacked(runs, 'ratios')
+        avg_density = run_means(ratios, lengths)
 
-    avg_density = np.mean(motion_pixel_ratios)
+        normalized = (avg_density - min_density) / (max_density - min_density)
+        normalized = np.clip(normalized, 0, 1)  # Clamp between 0 and 1
 
-    # Scoring: 0.01 (low) = 1, 0.2 (high) = 10
-    min_density = 0.01
-    max_density = 0.2
-    normalized = (avg_density - min_density) / (max_density - min_density)
-    normalized = max(0, min(normalized, 1))  # Clamp between 0 and 1
+        density_score = 1 + 9 * (normalized ** 0.6)
+        return np.where(lengths > 0, density_score, 0)
 
-    density_score = 1 + 9 * (normalized ** 0.6)
+    def finish(self):
+        return self.score_signals()
 
-    return density_score
\ No newline at end of file
+
+def density_score(video_path):
+    return run_consumer(video_path, DensityConsumer())
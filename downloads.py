@@ -0,0 +1,196 @@
+import os
+import struct
+import hashlib
+import threading
+import time
+import requests
+import yt_dlp
+from requests.adapters import HTTPAdapter
+from logs import get_logger
+from metrics import REQUEST_INGEST_SECONDS
+
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_POOL_SIZE = int(os.environ.get('DOWNLOAD_POOL_SIZE', 16))
+
+log = get_logger(__name__)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+class DownloadError(Exception):
+    pass
+
+
+def http_session():
+    """Shared requests.Session, so repeated downloads reuse pooled connections."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=DOWNLOAD_POOL_SIZE, pool_maxsize=DOWNLOAD_POOL_SIZE)
+            _session.mount('http://', adapter)
+            _session.mount('https://', adapter)
+        return _session
+
+
+def is_youtube(video_url):
+    return 'youtube.com' in video_url or 'youtu.be' in video_url
+
+
+def resolve_youtube(video_url):
+    """Direct (url, headers) of a single-file MP4 for a YouTube link, or None if there is none."""
+    ydl_opts = {
+        'format': 'best[ext=mp4]',
+        'quiet': True,
+        'noplaylist': True
+    }
+    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+        info = ydl.extract_info(video_url, download=False)
+    if info.get('protocol') not in ('http', 'https') or not info.get('url'):
+        return None
+    return info['url'], info.get('http_headers', {})
+
+
+def streamable_header(head):
+    """
+    True if a file starting with head can be decoded while it downloads,
+    False if not, None if more bytes are needed to tell. MP4/MOV files only
+    qualify when their index (moov) comes before the media data (mdat);
+    other containers are assumed to be streamable.
+    """
+    if len(head) < 8:
+        return None
+    if head[4:8] != b'ftyp':
+        return True
+    offset = 0
+    while offset + 8 <= len(head):
+        size, kind = struct.unpack('>I4s', head[offset:offset + 8])
+        if kind == b'moov':
+            return True
+        if kind == b'mdat':
+            return False
+        if size == 1:
+            if offset + 16 > len(head):
+                return None
+            size = struct.unpack('>Q', head[offset + 8:offset + 16])[0]
+        if size < 8:
+            return False  # Box runs to the end of the file
+        offset += size
+    return None
+
+
+class Download:
+    """
+    Downloads a video URL to path in a background thread.
+
+    Data is written to path + '.part' as it arrives and renamed to path once
+    complete, which is what frame_source.GrowingFileSource follows to
+    analyze the video while it is still downloading. The SHA-256 and size
+    are computed inline. YouTube links are resolved to their direct media
+    URL with yt_dlp and fetched through the same pooled session; formats
+    without one fall back to a plain yt_dlp download.
+    """
+    head_size = 256 * 1024  # Bytes kept to decide whether the file is streamable
+
+    def __init__(self, video_url, path, progress=None):
+        self.video_url = video_url
+        self.path = path
+        self.part_path = path + '.part'
+        self.progress = progress
+        self.size = 0
+        self.total = None
+        self.content_hash = None
+        self.error = None
+        self.streamable = None
+        self.head = bytearray()
+        self._decided = threading.Event()
+        self._done = threading.Event()
+
+    def start(self):
+        log.info("🌐 Downloading video", url=self.video_url)
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def _run(self):
+        t0 = time.time()
+        try:
+            direct = (self.video_url, {})
+            if is_youtube(self.video_url):
+                log.info("📽️ Resolving YouTube video with yt_dlp", url=self.video_url)
+                direct = resolve_youtube(self.video_url)
+            if direct is None:
+                self._ydl_download()
+            else:
+                self._http_download(*direct)
+            REQUEST_INGEST_SECONDS.labels('download').observe(time.time() - t0)
+            log.info("✅ Video downloaded", path=self.path, bytes=self.size, seconds=round(time.time() - t0, 2))
+        except Exception as e:
+            log.error("❌ Error downloading video", url=self.video_url, error=str(e))
+            self.error = e
+            if os.path.exists(self.part_path):
+                os.remove(self.part_path)
+        finally:
+            self._report(done=True)
+            self._decided.set()
+            self._done.set()
+
+    def _http_download(self, url, headers):
+        digest = hashlib.sha256()
+        reported_at = 0
+        with http_session().get(url, headers=headers, stream=True, timeout=30) as r:
+            r.raise_for_status()
+            if r.headers.get('Content-Length', '').isdigit():
+                self.total = int(r.headers['Content-Length'])
+            with open(self.part_path, 'wb') as f:
+                for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                    f.write(chunk)
+                    f.flush()  # Make it visible to the readers following the file
+                    digest.update(chunk)
+                    self.size += len(chunk)
+                    self._decide(chunk)
+                    if time.time() - reported_at >= 0.5:
+                        self._report()
+                        reported_at = time.time()
+        self.content_hash = digest.hexdigest()
+        os.replace(self.part_path, self.path)
+
+    def _ydl_download(self):
+        self.streamable = False
+        self._decided.set()
+        ydl_opts = {
+            'format': 'best[ext=mp4]',
+            'outtmpl': self.path,
+            'quiet': True,
+            'noplaylist': True
+        }
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            ydl.download([self.video_url])
+        self.size = os.path.getsize(self.path)
+
+    def _decide(self, chunk):
+        if self._decided.is_set():
+            return
+        self.head += chunk[:self.head_size - len(self.head)]
+        self.streamable = streamable_header(bytes(self.head))
+        if self.streamable is None and len(self.head) >= self.head_size:
+            self.streamable = False
+        if self.streamable is not None:
+            self._decided.set()
+
+    def _report(self, done=False):
+        if self.progress is not None:
+            self.progress['download'] = {'bytes': self.size, 'total': self.total, 'done': done}
+
+    def wait_streamable(self):
+        """Block until it is known whether the video can be analyzed while it downloads."""
+        self._decided.wait()
+        return bool(self.streamable) and self.error is None
+
+    def wait(self):
+        """Block until the download is complete, raising DownloadError if it failed."""
+        self._done.wait()
+        if self.error is not None:
+            if is_youtube(self.video_url):
+                raise DownloadError('Failed to download YouTube video')
+            raise DownloadError('Failed to download video from URL')
@@ -1,61 +1,230 @@
+import os
+import sys
+import time
+import threading
 import cv2
 import numpy as np
+from frame_source import FrameConsumer, run_consumer, run_consumers
+from feature_store import stacked, run_sums
 
-# Load Haar Cascade classifiers for face, eyes, and mouth
-face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
-mouth_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_smile.xml')  # Best available for mouth/smile
+# 'full' runs the face cascade on every sampled frame at full resolution;
+# 'tracked' detects on a downscaled frame and follows faces in between
+DEFAULT_EXPRESSION_MODE = os.environ.get('EXPRESSION_MODE', 'full')
+EXPRESSION_MODES = ('full', 'tracked')
 
-def facial_expression_intensity_score(video_path):
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print(f"Error opening video file: {video_path}")
-        return 1
 
-    intense_count = 0
-    total_faces = 0
-    frame_interval = 5  # Analyze every 5th frame
-    frame_id = 0
+class Cascades:
+    """Haar Cascade classifiers for face, eyes, and mouth."""
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+    def __init__(self):
+        self.face = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        self.eye = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_eye.xml')
+        self.mouth = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_smile.xml')  # Best available for mouth/smile
 
-        if frame_id % frame_interval == 0:
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4, minSize=(60, 60))
 
+# CascadeClassifier is not thread-safe, so each consumer borrows a set of its
+# own from this per-process free-list for the length of a run. Sets are only
+# loaded from XML when every loaded one is in use.
+_cascade_pool = []
+_cascade_lock = threading.Lock()
+
+
+def acquire_cascades():
+    with _cascade_lock:
+        if _cascade_pool:
+            return _cascade_pool.pop()
+    return Cascades()
+
+
+def release_cascades(cascades):
+    with _cascade_lock:
+        _cascade_pool.append(cascades)
+
+
+def preload_cascades(count=1):
+    """Load cascade sets up front, so the first runs in this process don't pay for it."""
+    loaded = [Cascades() for _ in range(count)]
+    with _cascade_lock:
+        _cascade_pool.extend(loaded)
+
+
+def expression_intensity(cascades, roi_gray, eye_min=(15, 15), mouth_min=(20, 20)):
+    """Eye and mouth area relative to the face, a proxy for expression exaggeration."""
+    h, w = roi_gray.shape[:2]
+    eyes = cascades.eye.detectMultiScale(roi_gray, scaleFactor=1.1, minNeighbors=8, minSize=eye_min)
+    mouths = cascades.mouth.detectMultiScale(roi_gray, scaleFactor=1.5, minNeighbors=15, minSize=mouth_min)
+
+    eye_intensity = sum([(ew * eh) / (w * h) for (_, _, ew, eh) in eyes])
+    mouth_intensity = sum([(mw * mh) / (w * h) for (_, _, mw, mh) in mouths])
+    return eye_intensity + mouth_intensity
+
+
+class FacialExpressionConsumer(FrameConsumer):
+    """
+    Share of detected faces with an intense expression.
+
+    In tracked mode faces are detected on a detect_scale copy of the frame
+    and followed between detections by template matching around their last
+    position. Faces are re-detected every redetect_seconds, or as soon as a
+    face's match score drops below min_track_score (cuts, occlusion, faces
+    leaving). Eyes and mouths are then searched in face crops resized to
+    face_size pixels, so their cost no longer grows with the video resolution.
+    Segments of a segmented run start with a detection, so tracked counts
+    can differ slightly from those of a single pass; full mode's cannot.
+    Every face's intensity is kept, and compared with intense_threshold
+    only when scoring.
+    """
+    fallback_score = 1
+    min_face = 60            # Pixels at full resolution
+    intense_threshold = 0.08  # Tuned empirically
+    lower_bound = 0.10       # Share of intense faces scoring 1...
+    upper_bound = 0.19       # ...and 10
+
+    detect_scale = 0.5
+    redetect_seconds = 1.0
+    min_track_score = 0.6
+    search_margin = 0.5      # Search this fraction of the face size around its last position
+    face_size = 96
+    eye_min = 15             # Eye and mouth minimum sizes within the face_size crop
+    mouth_min = 20
+    merged = ('intensities', 'detections')
+    scoring = ('intense_threshold', 'lower_bound', 'upper_bound')
+
+    def __init__(self, mode=None, sample_fps=6):
+        self.sample_fps = sample_fps  # Every 5th frame at 30 fps
+        self.mode = mode or DEFAULT_EXPRESSION_MODE
+        if self.mode not in EXPRESSION_MODES:
+            raise ValueError(f"Unknown expression mode: {self.mode}")
+        self.features = [('gray', None)]
+        if self.mode == 'tracked':
+            self.features.append(('gray', self.detect_scale))
+
+    def start(self, fps, frame_count):
+        super().start(fps, frame_count)
+        self.intensities = []
+        self.detections = 0
+        self.samples = 0
+        self.next_detection = 0
+        self.redetect_samples = max(1, int(round(self.redetect_seconds * fps / self.stride)))
+        self.tracks = []  # (x, y, w, h, template) at detection scale
+        self._cascades = acquire_cascades()  # Returned to the pool once the run reports
+
+    def process(self, index, frame):
+        gray = frame.gray()
+        if self.mode == 'full':
+            faces = self._cascades.face.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4,
+                                                     minSize=(self.min_face, self.min_face))
             for (x, y, w, h) in faces:
-                total_faces += 1
-                roi_gray = gray[y:y+h, x:x+w]
-                roi_color = frame[y:y+h, x:x+w]
+                self.intensities.append(expression_intensity(self._cascades, gray[y:y+h, x:x+w]))
+            return
+
+        small = frame.gray(self.detect_scale)
+        scale = small.shape[1] / gray.shape[1]
+        tracked = self._track(small) if self.samples < self.next_detection else None
+        if tracked is None:
+            tracked = self._detect(small, scale)
+        self.tracks = tracked
+        self.samples += 1
+
+        size = (self.face_size, self.face_size)
+        for (x, y, w, h, _) in self.tracks:
+            x0, y0 = int(x / scale), int(y / scale)
+            x1, y1 = int((x + w) / scale), int((y + h) / scale)
+            roi = cv2.resize(gray[y0:y1, x0:x1], size, interpolation=cv2.INTER_AREA)
+            self.intensities.append(
+                expression_intensity(self._cascades, roi, (self.eye_min, self.eye_min), (self.mouth_min, self.mouth_min)))
+
+    def _detect(self, small, scale):
+        self.detections += 1
+        self.next_detection = self.samples + self.redetect_samples
+        min_face = max(24, int(round(self.min_face * scale)))
+        faces = self._cascades.face.detectMultiScale(small, scaleFactor=1.1, minNeighbors=4, minSize=(min_face, min_face))
+        return [(x, y, w, h, small[y:y+h, x:x+w].copy()) for (x, y, w, h) in faces]
+
+    def _track(self, small):
+        """Follow every face to this frame, or None if any of them was lost."""
+        tracks = []
+        for (x, y, w, h, template) in self.tracks:
+            margin_x, margin_y = int(w * self.search_margin), int(h * self.search_margin)
+            x0, y0 = max(0, x - margin_x), max(0, y - margin_y)
+            window = small[y0:y + h + margin_y, x0:x + w + margin_x]
+            if window.shape[0] < h or window.shape[1] < w:
+                return None
+            match = cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED)
+            _, best, _, (dx, dy) = cv2.minMaxLoc(match)
+            if best < self.min_track_score:
+                return None
+            x, y = x0 + dx, y0 + dy
+            tracks.append((x, y, w, h, small[y:y+h, x:x+w].copy()))
+        return tracks
+
+    def intense_count(self):
+        return int(np.sum(self.signals()['intensities'].astype(np.float64) > self.intense_threshold))
+
+    def intensity_ratio(self):
+        return self.intense_count() / len(self.intensities) if self.intensities else None
+
+    def signals(self):
+        return {'intensities': np.array(self.intensities, dtype=np.float32)}
+
+    @classmethod
+    def rescore(cls, runs, intense_threshold, lower_bound, upper_bound):
+        intensities, total_faces = stacked(runs, 'intensities')
+        with np.errstate(divide='ignore', invalid='ignore'):
+            intensity_ratio = run_sums(intensities > intense_threshold, total_faces) / total_faces
+
+        score = 1 + (intensity_ratio - lower_bound) * (9 / (upper_bound - lower_bound))
+        score = np.clip(score, 1, 10)
+        return np.where(total_faces > 0, score, 1)
+
+    def _release(self):
+        if getattr(self, '_cascades', None) is not None:
+            release_cascades(self._cascades)
+            self._cascades = None
 
-                # Detect eyes and mouth within face ROI
-                eyes = eye_cascade.detectMultiScale(roi_gray, scaleFactor=1.1, minNeighbors=8, minSize=(15, 15))
-                mouths = mouth_cascade.detectMultiScale(roi_gray, scaleFactor=1.5, minNeighbors=15, minSize=(20, 20))
+    def segment_state(self):
+        self._release()
+        return super().segment_state()
 
-                # Use bounding box size as proxy for expression exaggeration
-                eye_intensity = sum([(ew * eh) / (w * h) for (_, _, ew, eh) in eyes])
-                mouth_intensity = sum([(mw * mh) / (w * h) for (_, _, mw, mh) in mouths])
+    def finish(self):
+        self._release()
+        return self.score_signals()
 
-                expression_score = eye_intensity + mouth_intensity
-                if expression_score > 0.08:  # Tuned empirically
-                    intense_count += 1
 
-        frame_id += 1
+def facial_expression_intensity_score(video_path, mode=None):
+    return run_consumer(video_path, FacialExpressionConsumer(mode))
 
-    cap.release()
 
-    if total_faces == 0:
-        return 1
+def expression_mode_agreement(video_path):
+    """
+    Score video_path in every expression mode in one decode and report how
+    close each mode's share of intense faces is to full mode's.
+    """
+    consumers = {mode: FacialExpressionConsumer(mode) for mode in EXPRESSION_MODES}
+    results = run_consumers(video_path, consumers)
 
-    intensity_ratio = intense_count / total_faces
+    reference = consumers['full'].intensity_ratio()
+    report = {}
+    for mode, consumer in consumers.items():
+        ratio = consumer.intensity_ratio()
+        report[mode] = {
+            'seconds': round(consumer.elapsed, 2),
+            'faces': len(consumer.intensities),
+            'intense': consumer.intense_count(),
+            'ratio': ratio,
+            'ratio_drift': ratio - reference if ratio is not None and reference is not None else None,
+            'score': float(results[mode]),
+        }
+    return report
 
-    # Scoring: 0.1 = score 1, 0.6+ = score 10
-    lower_bound = 0.10
-    upper_bound = 0.19
-    score = 1 + (intensity_ratio - lower_bound) * (9 / (upper_bound - lower_bound))
-    score = max(1, min(score, 10))
-    return score
 
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        t0 = time.time()
+        report = expression_mode_agreement(path)
+        print(f"\n🎞️ {path} ({round(time.time() - t0, 2)}s)")
+        for mode, row in report.items():
+            ratio = 'n/a' if row['ratio'] is None else f"{row['ratio']:.3f}"
+            drift = '' if row['ratio_drift'] is None else f" ({row['ratio_drift']:+.3f})"
+            print(f"• {mode}: {row['seconds']}s | {row['faces']} faces, {row['intense']} intense | "
+                  f"ratio {ratio}{drift} | score {row['score']:.2f}")
@@ -1,80 +1,111 @@
 import cv2
 import numpy as np
+from frame_source import FrameConsumer, run_consumer
+from optical_flow import FarnebackFlow
+from feature_store import stacked, run_sums
 
-def fantastical_content_score(video_path, frame_stride=5):
-    cap = cv2.VideoCapture(video_path)
-    prev_gray = None
-    total_frames = 0
-    bright_magic_colors = 0
-    fantastical_motion = 0
-    low_edge_scenes = 0
-    frame_idx = 0
+# Predefine magic color ranges (in HSV)
+lower_pink, upper_pink = np.array([140, 100, 100]), np.array([170, 255, 255])
+lower_green, upper_green = np.array([40, 70, 70]), np.array([80, 255, 255])
+lower_blue, upper_blue = np.array([90, 60, 60]), np.array([130, 255, 255])
 
-    # Predefine magic color ranges (in HSV)
-    lower_pink, upper_pink = np.array([140, 100, 100]), np.array([170, 255, 255])
-    lower_green, upper_green = np.array([40, 70, 70]), np.array([80, 255, 255])
-    lower_blue, upper_blue = np.array([90, 60, 60]), np.array([130, 255, 255])
 
+class FantasticalContentConsumer(FrameConsumer):
+    """
+    Average of the shares of frames with lots of magic colors, of frames
+    with few edges and of frames with unrealistic motion since the previous
+    sampled one. The per-frame color and edge ratios and motion magnitudes
+    are kept, so the thresholds can be changed on stored signals.
+
+    Motion is measured with this analyzer's own coarse Farneback flow
+    (single level, 12 px window) at 320x180 rather than the shared
+    FlowService: its magnitudes don't scale linearly to other resolutions
+    and pyramids, and the threshold was tuned on these.
+    """
+    fallback_score = 1.0
+    exact_size = True  # Edge density and flow magnitudes depend on resolution
     frame_width, frame_height = 320, 180
-    frame_area = frame_width * frame_height
+    motion_interval = 5 / 30  # Motion threshold was tuned on 5-frame gaps at 30 fps
+    color_threshold = 0.15  # Share of magic-colored pixels making a frame magic
+    edge_threshold = 0.02   # Share of edge pixels below which a scene is low-edge
+    motion_threshold = 4    # Flow magnitude, in 320x180 px per motion_interval, that is unrealistic
+    lower_bound = 0.1  # Raw score scoring 1...
+    upper_bound = 0.19  # ...and 10
+    flow_levels = 1
+    flow_winsize = 12
+    flow_poly_sigma = 1.1
+    warmup = 1  # The frame before a segment, to pair with its first frame
+    merged = ('color_ratios', 'edge_ratios', 'motion_magnitudes')
+    scoring = ('color_threshold', 'edge_threshold', 'motion_threshold', 'lower_bound', 'upper_bound')
+
+    def __init__(self, sample_fps=6):
+        self.sample_fps = sample_fps
+        size = (self.frame_width, self.frame_height)
+        self.features = [('hsv', size), ('gray', size)]
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+    def start(self, fps, frame_count):
+        super().start(fps, frame_count)
+        self.offset = self.stride - 1  # Frames 5, 10, 15... counting from 1 at 30 fps
+        self.motion_flow = FarnebackFlow(self.flow_levels, self.flow_winsize, self.flow_poly_sigma)
+        self.prev_gray = None
+        self.color_ratios = []
+        self.edge_ratios = []
+        self.motion_magnitudes = []
 
-        frame_idx += 1
-        if frame_idx % frame_stride != 0:
-            continue
+    def process(self, index, frame):
+        size = (self.frame_width, self.frame_height)
+        frame_area = self.frame_width * self.frame_height
 
-        total_frames += 1
-        frame = cv2.resize(frame, (frame_width, frame_height))
+        # --- Unrealistic motion (optical flow) ---
+        gray = frame.gray(size)
+        prev_gray, self.prev_gray = self.prev_gray, gray
+        if index < self.segment[0]:
+            return  # Only pairs with the segment's first frame
+        if prev_gray is not None:
+            self.motion_magnitudes.append(self.motion_flow.mean_magnitude(prev_gray, gray))
 
         # --- Color mask analysis ---
-        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+        hsv = frame.hsv(size)
         color_mask = (
             cv2.inRange(hsv, lower_pink, upper_pink) |
             cv2.inRange(hsv, lower_green, upper_green) |
             cv2.inRange(hsv, lower_blue, upper_blue)
         )
-        color_ratio = np.count_nonzero(color_mask) / frame_area
-        if color_ratio > 0.15:
-            bright_magic_colors += 1
-
-        # --- Unrealistic motion (optical flow) ---
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        if prev_gray is not None:
-            flow = cv2.calcOpticalFlowFarneback(
-                prev_gray, gray, None, 0.5, 1, 12, 3, 5, 1.1, 0
-            )
-            mag, _ = cv2.cartToPolar(flow[..., 0], flow[..., 1])
-            if np.mean(mag) > 4:
-                fantastical_motion += 1
-        prev_gray = gray
+        self.color_ratios.append(np.count_nonzero(color_mask) / frame_area)
 
         # --- Edge density analysis ---
         edges = cv2.Canny(gray, 100, 200)
-        edge_ratio = np.count_nonzero(edges) / frame_area
-        if edge_ratio < 0.02:
-            low_edge_scenes += 1
-
-    cap.release()
-
-    if total_frames == 0:
-        return 1.0
-
-    # Normalize and average
-    magic_color_ratio = bright_magic_colors / total_frames
-    motion_ratio = fantastical_motion / total_frames
-    edge_ratio = low_edge_scenes / total_frames
-    raw_score = (magic_color_ratio + motion_ratio + edge_ratio) / 3
-
-    # Map score range
-    if raw_score <= 0.1:
-        final_score = 1
-    elif raw_score >= 0.19:
-        final_score = 10
-    else:
-        final_score = 1 + ((raw_score - 0.1) / 0.09) * 9
-
-    return final_score
+        self.edge_ratios.append(np.count_nonzero(edges) / frame_area)
+
+    def signals(self):
+        return {
+            'color_ratios': np.array(self.color_ratios, dtype=np.float32),
+            'edge_ratios': np.array(self.edge_ratios, dtype=np.float32),
+            # Per motion_interval; only profiles sampling below 6 fps rescale
+            'motion': (np.array(self.motion_magnitudes, dtype=np.float64)
+                       * self.motion_interval / (self.stride / self.fps)).astype(np.float32),
+        }
+
+    @classmethod
+    def rescore(cls, runs, color_threshold, edge_threshold, motion_threshold, lower_bound, upper_bound):
+        color_ratios, total_frames = stacked(runs, 'color_ratios')
+        edge_ratios, _ = stacked(runs, 'edge_ratios')
+        motion, pairs = stacked(runs, 'motion')
+
+        # Normalize and average
+        with np.errstate(divide='ignore', invalid='ignore'):
+            magic_color_ratio = run_sums(color_ratios > color_threshold, total_frames) / total_frames
+            motion_ratio = run_sums(motion > motion_threshold, pairs) / total_frames
+            edge_ratio = run_sums(edge_ratios < edge_threshold, total_frames) / total_frames
+        raw_score = (magic_color_ratio + motion_ratio + edge_ratio) / 3
+
+        # Map score range
+        final_score = np.clip(1 + ((raw_score - lower_bound) / (upper_bound - lower_bound)) * 9, 1, 10)
+        return np.where(total_frames > 0, final_score, 1.0)
+
+    def finish(self):
+        return self.score_signals()
+
+
+def fantastical_content_score(video_path, sample_fps=6):
+    return run_consumer(video_path, FantasticalContentConsumer(sample_fps))
@@ -0,0 +1,136 @@
+import os
+import uuid
+import threading
+import numpy as np
+
+FEATURE_STORE_PATH = os.environ.get('FEATURE_STORE_PATH', os.path.join('cache', 'features'))
+FEATURE_MEMO_MB = float(os.environ.get('FEATURE_MEMO_MB', 256))  # Loaded signals kept in memory per process
+
+
+def stacked(runs, name, dtype=np.float64):
+    """
+    One signal of many runs' signals() concatenated, with each run's length,
+    so a score can be computed for all of them with a few array operations.
+    """
+    arrays = [np.asarray(run[name], dtype=dtype) for run in runs]
+    lengths = np.array([len(a) for a in arrays], dtype=np.int64)
+    return (np.concatenate(arrays) if arrays else np.empty(0, dtype=dtype)), lengths
+
+
+def run_sums(values, lengths):
+    """Sum of values over each run of consecutive lengths (0 for empty runs)."""
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+    sums = np.add.reduceat(np.append(values, 0).astype(np.float64), starts) if len(lengths) else np.empty(0)
+    return np.where(lengths > 0, sums, 0.0)
+
+
+def run_means(values, lengths):
+    """Mean of values over each run, NaN for empty runs."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return run_sums(values, lengths) / lengths
+
+
+def scalars(runs, name, dtype=np.float64):
+    return np.array([run[name] for run in runs], dtype=dtype)
+
+
+def run_slices(values, lengths):
+    """Each run's part of values, for the steps that can't be vectorized across runs."""
+    return np.split(values, np.cumsum(lengths)[:-1]) if len(lengths) else []
+
+
+class FeatureStore:
+    """
+    Per-frame signals of analyzed videos (see FrameConsumer.signals), kept
+    so a change to scoring parameters can be applied without decoding the
+    videos again.
+
+    Each video gets one compressed .npz file named after its content hash,
+    holding every analyzer's signals as '<key>/<name>' arrays next to the
+    fingerprint they were extracted with ('<key>/fingerprint', see
+    analyzers.analyzer_fingerprints without scoring). Files are replaced
+    atomically, so readers never see a partial one. Loaded files are
+    memoized by modification time (up to memo_bytes of them, least recently
+    loaded first out), which makes repeated re-scoring of a catalog cheap.
+    """
+
+    def __init__(self, path=None, memo_bytes=None):
+        self.path = path or FEATURE_STORE_PATH
+        self.memo_bytes = memo_bytes if memo_bytes is not None else int(FEATURE_MEMO_MB * 1024 * 1024)
+        self._loaded = {}  # path -> (mtime, size, {key: arrays}), oldest first
+        self._loaded_bytes = 0
+        self._lock = threading.Lock()
+
+    def _file(self, content_hash):
+        return os.path.join(self.path, content_hash[:2], content_hash + '.npz')
+
+    def _read(self, content_hash):
+        """{key: arrays, fingerprint included} of a video's file, {} if there is none."""
+        path = self._file(content_hash)
+        try:
+            mtime = os.path.getmtime(path)
+        except OSError:
+            return {}
+        with self._lock:
+            cached = self._loaded.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached[2]
+
+        stored = {}
+        with np.load(path, allow_pickle=False) as npz:
+            for name in npz.files:
+                key, _, signal = name.partition('/')
+                stored.setdefault(key, {})[signal] = npz[name]
+        size = sum(array.nbytes for arrays in stored.values() for array in arrays.values())
+        with self._lock:
+            previous = self._loaded.pop(path, None)
+            if previous is not None:
+                self._loaded_bytes -= previous[1]
+            self._loaded[path] = (mtime, size, stored)
+            self._loaded_bytes += size
+            while self._loaded_bytes > self.memo_bytes and len(self._loaded) > 1:
+                self._loaded_bytes -= self._loaded.pop(next(iter(self._loaded)))[1]
+        return stored
+
+    def get(self, content_hash, fingerprints=None):
+        """
+        {key: signals} stored for a video; with fingerprints, only for the
+        keys in it whose signals were extracted with the same fingerprint.
+        """
+        return {key: {name: array for name, array in arrays.items() if name != 'fingerprint'}
+                for key, arrays in self._read(content_hash).items()
+                if fingerprints is None or (key in fingerprints and str(arrays['fingerprint']) == fingerprints[key])}
+
+    def put(self, content_hash, fingerprints, signals):
+        """Store {key: signals} for a video, replacing those keys and keeping the others."""
+        signals = {key: named for key, named in signals.items() if named is not None}
+        if not signals:
+            return
+        path = self._file(content_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arrays = {f'{key}/{name}': array for key, stored in self._read(content_hash).items() if key not in signals
+                  for name, array in stored.items()}
+        for key, named in signals.items():
+            arrays.update({f'{key}/{name}': np.asarray(array) for name, array in named.items()})
+            arrays[f'{key}/fingerprint'] = np.array(fingerprints[key])
+
+        tmp = f'{path}.{uuid.uuid4().hex}.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp, path)
+
+    def content_hashes(self):
+        """Every video with stored signals."""
+        hashes = []
+        if not os.path.isdir(self.path):
+            return hashes
+        for folder in sorted(os.listdir(self.path)):
+            folder_path = os.path.join(self.path, folder)
+            if os.path.isdir(folder_path):
+                hashes.extend(sorted(name[:-len('.npz')] for name in os.listdir(folder_path) if name.endswith('.npz')))
+        return hashes
+
+    def stats(self):
+        hashes = self.content_hashes()
+        size = sum(os.path.getsize(self._file(h)) for h in hashes)
+        return {'videos': len(hashes), 'size_bytes': size}
@@ -1,47 +1,70 @@
-import cv2
 import numpy as np
+from frame_source import FrameConsumer, run_consumer
+from feature_store import stacked, scalars, run_sums
+from logs import get_logger
+
+log = get_logger(__name__)
 
-def flash_score(video_path):
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print(f"Error opening video file: {video_path}")
-        return 0
 
-    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+class FlashConsumer(FrameConsumer):
+    """
+    Flashes per minute, a flash being a frame where more than change_threshold
+    of the pixels brighten or darken sharply since the previous frame. The
+    share of such pixels is kept for every frame, so the threshold can be
+    changed on stored signals.
+    """
+    change_threshold = 0.4  # More than 40% pixels change = flash
+    min_flash = 2  # Flashes per minute scoring 1...
+    max_flash = 20  # ...and 10
+    merged = ('frames_seen', 'changes')
+    scoring = ('change_threshold', 'min_flash', 'max_flash')
 
-    ret, prev_frame = cap.read()
-    if not ret:
-        print("Couldn't read the first frame.")
-        return 0
+    def __init__(self, resize_factor=None):
+        self.resize_factor = resize_factor
+        self.features = [('diff', resize_factor)]
 
-    prev_gray = cv2.cvtColor(prev_frame, cv2.COLOR_BGR2GRAY)
-    sudden_change_count = 0
+    def start(self, fps, frame_count):
+        super().start(fps, frame_count)
+        self.frames_seen = 0
+        self.changes = []
 
-    for _ in range(1, frame_count):
-        ret, frame = cap.read()
-        if not ret:
-            break
+    def wants(self, index):
+        return (index == 0 or index < self.frame_count) and super().wants(index)
 
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        diff = cv2.absdiff(gray, prev_gray)
-        change = np.sum(diff > 50) / diff.size  # % of pixels with significant brightness change
+    def process(self, index, frame):
+        diff = frame.diff(self.resize_factor)
+        self.frames_seen += 1
 
-        if change > 0.4:  # More than 40% pixels change = flash
-            sudden_change_count += 1
+        if diff is not None:
+            self.changes.append(np.sum(diff > 50) / diff.size)  # % of pixels with significant brightness change
 
-        prev_gray = gray
+    def signals(self):
+        return {
+            'changes': np.array(self.changes, dtype=np.float32),
+            'frames_seen': self.frames_seen,
+            'fps': self.fps,
+            'frame_count': self.frame_count,
+        }
 
-    cap.release()
+    @classmethod
+    def rescore(cls, runs, change_threshold, min_flash, max_flash):
+        changes, lengths = stacked(runs, 'changes')
+        sudden_change_count = run_sums(changes > change_threshold, lengths)
+        duration_minutes = scalars(runs, 'frame_count') / scalars(runs, 'fps') / 60
+        with np.errstate(divide='ignore', invalid='ignore'):
+            flashes_per_min = np.where(duration_minutes > 0, sudden_change_count / duration_minutes, 0)
 
-    duration_minutes = frame_count / fps / 60
-    flashes_per_min = sudden_change_count / duration_minutes if duration_minutes > 0 else 0
+        # Scoring: min_flash flashes/min = score 1, max_flash flashes/min = score 10
+        normalized = (flashes_per_min - min_flash) / (max_flash - min_flash)
+        normalized = np.clip(normalized, 0, 1)
+        flash_score = 1 + 9 * (normalized ** 0.5)
+        return np.where(scalars(runs, 'frames_seen') > 0, flash_score, 0)
 
-    # Scoring: 2 flashes/min = score 1, 20 flashes/min = score 10
-    min_flash = 2
-    max_flash = 20
-    normalized = (flashes_per_min - min_flash) / (max_flash - min_flash)
-    normalized = max(0, min(normalized, 1))  # Clamp between 0 and 1
-    flash_score = 1 + 9 * (normalized ** 0.5)
+    def finish(self):
+        if self.frames_seen == 0:
+            log.warning("Couldn't read the first frame")
+        return self.score_signals()
 
-    return flash_score
\ No newline at end of file
+
+def flash_score(video_path):
+    return run_consumer(video_path, FlashConsumer())
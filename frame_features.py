@@ -0,0 +1,124 @@
+import cv2
+
+
+def pixel_size(frame_size, size):
+    """Turn a size request (None, scale factor or (w, h)) into (width, height)."""
+    width, height = frame_size
+    if size is None:
+        return frame_size
+    if isinstance(size, tuple):
+        return size
+    return (int(round(width * size)), int(round(height * size)))
+
+
+class FeatureGraph:
+    """
+    Declarative per-frame feature graph shared by all frame consumers.
+
+    Consumers declare what they need as (kind, size) pairs:
+    - kind is 'bgr', 'gray', 'hsv' or 'diff' (absolute gray difference
+      to the previous decoded frame)
+    - size is None for full resolution, a scale factor (e.g. 0.4) or a
+      (width, height) tuple
+
+    Every node is computed at most once per frame. Requested sizes that only
+    differ slightly (same aspect ratio, within merge_ratio of each other) are
+    merged onto one canonical size, so e.g. a 0.4x and a 0.5x request end up
+    sharing one resize and one gray conversion. Sizes listed in `exact` (used
+    by resolution-sensitive measures such as optical flow) and full resolution
+    are always kept as they are; other sizes merge onto the closest of them.
+
+    frame_size is the video's own resolution, which scale factors refer to.
+    root_size is the resolution frames actually arrive in, when the decoder
+    already scaled them down (see frame_source.FFmpegPipeSource).
+    """
+    merge_ratio = 1.3
+    aspect_tolerance = 0.05
+
+    def __init__(self, frame_width, frame_height, requests, exact=(), root_size=None):
+        self.frame_size = (frame_width, frame_height)
+        self.root_size = root_size or self.frame_size
+
+        canonical = {self.frame_size, self.root_size} | {self._pixels(size) for size in exact}
+        self._canonical = {dims: dims for dims in canonical}
+
+        loose = {self._pixels(size) for _, size in requests} - canonical
+        for dims in sorted(loose, key=lambda d: d[0] * d[1]):
+            close = [c for c in canonical if self._close(c, dims)]
+            match = min(close, key=lambda c: abs(c[0] - dims[0])) if close else dims
+            canonical.add(match)
+            self._canonical[dims] = match
+
+        # Gray frames behind every diff node are computed on every frame so
+        # the next frame always has something to diff against
+        self.carried = {('gray', dims) for kind, dims in self.nodes(requests) if kind == 'diff'}
+
+    def _pixels(self, size):
+        return pixel_size(self.frame_size, size)
+
+    def _close(self, a, b):
+        ratio = max(a[0], b[0]) / min(a[0], b[0])
+        aspect_a = a[0] / a[1]
+        aspect_b = b[0] / b[1]
+        return ratio <= self.merge_ratio and abs(aspect_a - aspect_b) / aspect_a <= self.aspect_tolerance
+
+    def resolve(self, size):
+        """Map a requested size to the canonical (width, height) it shares."""
+        dims = self._pixels(size)
+        return self._canonical.get(dims, dims)
+
+    def nodes(self, requests):
+        return {(kind, self.resolve(size)) for kind, size in requests}
+
+    def compute(self, frame, prev, nodes):
+        """Evaluate the given nodes for one decoded frame."""
+        features = FrameFeatures(self, {('bgr', self.root_size): frame})
+        for kind, dims in nodes:
+            self._evaluate(features.values, prev, kind, dims)
+        return features
+
+    def _evaluate(self, values, prev, kind, dims):
+        key = (kind, dims)
+        if key in values:
+            return values[key]
+
+        if kind == 'bgr':
+            value = cv2.resize(values['bgr', self.root_size], dims)
+        elif kind == 'gray':
+            value = cv2.cvtColor(self._evaluate(values, prev, 'bgr', dims), cv2.COLOR_BGR2GRAY)
+        elif kind == 'hsv':
+            value = cv2.cvtColor(self._evaluate(values, prev, 'bgr', dims), cv2.COLOR_BGR2HSV)
+        elif kind == 'diff':
+            gray = self._evaluate(values, prev, 'gray', dims)
+            prev_gray = prev.values.get(('gray', dims)) if prev is not None else None
+            value = cv2.absdiff(gray, prev_gray) if prev_gray is not None else None
+        else:
+            raise ValueError(f"Unknown frame feature: {kind}")
+
+        values[key] = value
+        return value
+
+
+class FrameFeatures:
+    """Read-only view of the features computed for one decoded frame."""
+
+    def __init__(self, graph, values):
+        self.graph = graph
+        self.values = values
+
+    def get(self, kind, size=None):
+        return self.values[kind, self.graph.resolve(size)]
+
+    @property
+    def bgr(self):
+        return self.get('bgr')
+
+    def gray(self, size=None):
+        return self.get('gray', size)
+
+    def hsv(self, size=None):
+        return self.get('hsv', size)
+
+    def diff(self, size=None):
+        """Gray difference to the previous decoded frame, None on the first frame."""
+        return self.get('diff', size)
@@ -0,0 +1,608 @@
+import os
+import math
+import threading
+import queue
+import time
+import cv2
+import ffmpeg
+import numpy as np
+from frame_features import FeatureGraph, pixel_size
+from logs import get_logger
+
+# 'opencv' decodes with cv2.VideoCapture, 'ffmpeg' with FFmpegPipeSource
+FRAME_SOURCE = os.environ.get('FRAME_SOURCE', 'opencv')
+
+log = get_logger(__name__)
+
+_END = object()
+
+
+class FrameConsumer:
+    """
+    Base class for analyzers that are fed frames by a shared decode loop.
+
+    Each consumer keeps its own state between frames and turns it into a
+    score in finish(). process() receives a FrameFeatures object holding the
+    (kind, size) features listed in `features`; they are computed once per
+    frame and shared between consumers, so they must be treated as read-only.
+
+    A video can also be analyzed as segments run in parallel (see
+    run_consumers' segment). Each segment's consumer is then fed `warmup`
+    of its frames from before the segment to rebuild its state, and reports
+    segment_state() instead of a score; merge_segments() combines the states
+    of all segments into a fresh consumer, whose finish() then scores the
+    whole video.
+
+    Consumers that can be re-scored without decoding report the per-frame
+    series their score is computed from in signals(), and compute it in
+    the classmethod rescore(), which scores the signals of many videos at
+    once. Attributes listed in `scoring` only steer that last step, so new
+    values for them apply to stored signals (see feature_store).
+    """
+    stride = 1          # Only every stride-th frame is delivered
+    offset = 0          # ...starting at this 0-based frame index
+    sample_fps = None   # If set, stride is derived from the video fps at start()
+    fallback_score = 0  # Returned when the video cannot be opened
+    features = []       # (kind, size) pairs, see frame_features.FeatureGraph
+    exact_size = False  # Never merge these sizes with other consumers' sizes
+    depends_on = []     # Consumers that must finish before this one does
+    takes_frames = True  # False for consumers that only read from depends_on
+    elapsed = 0.0       # Busy seconds, filled in by run_consumers
+    frames_processed = 0  # Frames passed to process(), filled in by run_consumers
+    decode_time = 0.0   # Seconds the shared decode spent reading frames, filled in by run_consumers
+    warmup = 0          # Frames before a segment to feed to rebuild state, in units of stride
+    merged = ()         # Attributes finish() reads, combined across segments by merge_segments()
+    segment = (0, math.inf)  # Frames [start, end) being scored, set by run_consumers
+    window = (0, math.inf)   # Frames fed: the segment and its warmup
+    scoring = ()        # Attributes rescore() takes, which only turn signals into a score
+
+    def wants(self, index):
+        return self.takes_frames and index % self.stride == self.offset and self.window[0] <= index < self.window[1]
+
+    def start(self, fps, frame_count):
+        self.fps = fps
+        self.frame_count = frame_count
+        if self.sample_fps:
+            # Sample in video time so 24, 30 and 60 fps sources are treated alike
+            self.stride = max(1, int(fps / self.sample_fps + 0.5))
+
+    def process(self, index, frame):
+        raise NotImplementedError
+
+    def finish(self):
+        raise NotImplementedError
+
+    def segment_state(self):
+        """The merged attributes after a segment, to be passed to merge_segments()."""
+        return {name: getattr(self, name) for name in self.merged}
+
+    def merge_segments(self, states):
+        """
+        Combine the segment_state() of consecutive segments, in order, after
+        start(): lists are concatenated and numbers added up.
+        """
+        for name in self.merged:
+            values = [state[name] for state in states]
+            setattr(self, name, sum(values, []) if isinstance(values[0], list) else sum(values))
+
+    def signals(self):
+        """Per-frame series (and scalars) the score is computed from, as numpy arrays; None if not kept."""
+        return None
+
+    @classmethod
+    def rescore(cls, runs, **params):
+        """Scores of many videos' signals() at once, as an array, with the `scoring` attributes in params."""
+        raise NotImplementedError
+
+    def scoring_params(self):
+        return {name: getattr(self, name) for name in self.scoring}
+
+    def score_signals(self):
+        """This consumer's score, computed from its signals() exactly as rescore() would from stored ones."""
+        return float(self.rescore([self.signals()], **self.scoring_params())[0])
+
+
+def debounced_counts(times, lengths, min_interval):
+    """debounced_count of each run of consecutive lengths in times."""
+    times = np.asarray(times).tolist()  # Python floats loop several times faster than numpy scalars
+    ends = np.cumsum(lengths).tolist()
+    return np.array([debounced_count(times[end - length:end], min_interval)
+                     for end, length in zip(ends, np.asarray(lengths).tolist())], dtype=np.float64)
+
+
+def debounced_count(times, min_interval):
+    """Number of events at times, skipping those within min_interval seconds of the last one counted."""
+    count = 0
+    last_time = 0
+    for current_time in times:
+        if current_time - last_time >= min_interval or last_time == 0:
+            count += 1
+            last_time = current_time
+    return count
+
+
+class VideoCaptureSource:
+    """Decodes every frame at full resolution through cv2.VideoCapture."""
+
+    def __init__(self, video_path, ring_size=None):
+        self.cap = cv2.VideoCapture(video_path)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or 30
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.frame_size = None  # Taken from the first decoded frame
+        self.step = 1
+        self.first_index = 0
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def seek(self, index):
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+        self.first_index = index
+
+    def start(self, width, step, phase):
+        pass  # Unwanted frames are skipped with grab() instead
+
+    def read(self):
+        return self.cap.read()
+
+    def grab(self):
+        return self.cap.grab()
+
+    def release(self):
+        self.cap.release()
+
+
+class FFmpegPipeSource:
+    """
+    Decodes through an ffmpeg subprocess that does the scaling, BGR conversion
+    and frame selection itself, so only frames at analysis resolution ever
+    reach Python. Raw frames are read from the pipe into a ring of reused
+    buffers and exposed with np.frombuffer, without copying; a frame stays
+    valid until ring_size more frames have been read.
+    """
+
+    scale_flags = 'fast_bilinear'  # Closest to cv2.resize's INTER_LINEAR
+    feeds_stdin = False
+
+    def __init__(self, video_path, ring_size=16):
+        self.video_path = video_path
+        self.ring_size = ring_size
+        self.proc = None
+        self.step = 1
+        self.first = 0
+        self.first_index = 0
+        self.probe(video_path)
+
+    def probe(self, path):
+        cap = cv2.VideoCapture(path)  # Container metadata only, nothing is decoded
+        self.opened = cap.isOpened()
+        self.fps = cap.get(cv2.CAP_PROP_FPS) or 30
+        self.frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.frame_size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+        cap.release()
+        return self.opened and self.frame_count > 0
+
+    def input(self):
+        if self.first:
+            # Half a frame early, so rounding can't skip the first frame
+            return ffmpeg.input(self.video_path, ss=(self.first - 0.5) / self.fps)
+        return ffmpeg.input(self.video_path)
+
+    def isOpened(self):
+        return self.opened
+
+    def seek(self, index):
+        """Start decoding at frame index; must be called before start()."""
+        self.first = index
+
+    def start(self, width, step, phase):
+        """Start ffmpeg, emitting every step-th frame from phase on, width pixels wide."""
+        src_width, src_height = self.frame_size
+        width = min(width, src_width)
+        height = int(round(src_height * width / src_width))
+        self.step = step
+        phase = (phase - self.first) % step  # Counted from the first decoded frame
+        self.first_index = self.first + phase
+
+        stream = self.input().video
+        if step > 1:
+            stream = stream.filter('select', f'not(mod(n-{phase},{step}))')
+        if width != src_width:
+            stream = stream.filter('scale', width, height, flags=self.scale_flags)
+        self.proc = (
+            stream
+            .output('pipe:', format='rawvideo', pix_fmt='bgr24', fps_mode='passthrough')
+            .global_args('-loglevel', 'error', '-nostdin')
+            .run_async(pipe_stdin=self.feeds_stdin, pipe_stdout=True)
+        )
+
+        self.shape = (height, width, 3)
+        self.ring = [bytearray(height * width * 3) for _ in range(self.ring_size)]
+        self.slot = 0
+
+    def read(self):
+        buf = self.ring[self.slot]
+        view = memoryview(buf)
+        got = 0
+        while got < len(buf):
+            n = self.proc.stdout.readinto(view[got:])
+            if not n:
+                return False, None
+            got += n
+        self.slot = (self.slot + 1) % self.ring_size
+        return True, np.frombuffer(buf, dtype=np.uint8).reshape(self.shape)
+
+    def grab(self):
+        return self.read()[0]
+
+    def release(self):
+        if self.proc is not None:
+            self.proc.kill()
+            self.proc.stdout.close()
+            self.proc.wait()
+
+
+class GrowingFileReader:
+    """
+    Reads a video that is still being downloaded to video_path + '.part'.
+    read() waits for more data until the download renames the part file to
+    video_path (complete) or removes it (failed). Works across processes,
+    since only the file system is shared.
+    """
+    poll_interval = 0.05
+
+    def __init__(self, video_path, stall_timeout=60):
+        self.path = video_path
+        self.part_path = video_path + '.part'
+        self.stall_timeout = stall_timeout
+        try:
+            self.file = open(self.part_path, 'rb')
+        except FileNotFoundError:
+            self.file = open(self.path, 'rb')  # Already complete
+
+    def read(self, size):
+        waited = 0.0
+        while True:
+            data = self.file.read(size)
+            if data:
+                return data
+            if os.path.exists(self.path):
+                return self.file.read(size)  # Complete: whatever is left, then EOF
+            if not os.path.exists(self.part_path):
+                raise IOError(f"Download of {self.path} failed")
+            if waited > self.stall_timeout:
+                raise TimeoutError(f"Download of {self.path} stalled")
+            time.sleep(self.poll_interval)
+            waited += self.poll_interval
+
+    def close(self):
+        self.file.close()
+
+
+class GrowingFileSource(FFmpegPipeSource):
+    """
+    FFmpegPipeSource fed from a download in progress (see GrowingFileReader),
+    so analysis can run while the rest of the file is still arriving. Only
+    works for containers with their index up front (faststart MP4, MKV,
+    WebM, TS). Frames are decoded at full resolution unless FRAME_SOURCE is
+    'ffmpeg', so scores match the configured source exactly.
+    """
+    feeds_stdin = True
+    header_timeout = 60
+
+    def __init__(self, video_path, ring_size=16):
+        self.reader = GrowingFileReader(video_path)
+        self.feed_error = None
+        super().__init__(video_path, ring_size)
+
+    def probe(self, path):
+        # Wait until enough of the file is there to read the header
+        waited = 0.0
+        while not super().probe(path if os.path.exists(path) else path + '.part'):
+            if os.path.exists(path) or not os.path.exists(path + '.part') or waited > self.header_timeout:
+                break
+            time.sleep(0.2)
+            waited += 0.2
+        return self.opened
+
+    def input(self):
+        return ffmpeg.input('pipe:')
+
+    def start(self, width, step, phase):
+        if FRAME_SOURCE != 'ffmpeg':
+            width = self.frame_size[0]
+        super().start(width, step, phase)
+        threading.Thread(target=self._feed, daemon=True).start()
+
+    def _feed(self):
+        try:
+            while True:
+                data = self.reader.read(1024 * 1024)
+                if not data:
+                    break
+                self.proc.stdin.write(data)
+        except BrokenPipeError:
+            pass  # ffmpeg was stopped early
+        except Exception as e:
+            self.feed_error = e
+        finally:
+            self.reader.close()
+            try:
+                self.proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def read(self):
+        ret, frame = super().read()
+        if not ret and self.feed_error is not None:
+            raise self.feed_error
+        return ret, frame
+
+
+FRAME_SOURCES = {
+    'opencv': VideoCaptureSource,
+    'ffmpeg': FFmpegPipeSource,
+    'growing': GrowingFileSource,
+}
+
+
+def _sampling_plan(consumers, requests):
+    """
+    Largest (step, phase) such that every frame any consumer wants is at
+    phase + k * step, so the decoder can drop all other frames up front.
+    """
+    takers = [c for c in consumers if c.takes_frames]
+    if not takers or any(kind == 'diff' for kind, _ in requests):
+        return 1, 0
+
+    step = 0
+    for consumer in takers:
+        step = math.gcd(step, consumer.stride)
+    phases = {consumer.offset % step for consumer in takers}
+    if len(phases) != 1:
+        return 1, 0
+    return step, phases.pop()
+
+
+class _ConsumerThread(threading.Thread):
+    def __init__(self, consumer, buffer_size, finish):
+        super().__init__(daemon=True)
+        self.consumer = consumer
+        self.finish = finish
+        self.frames = queue.Queue(maxsize=buffer_size)
+        self.result = None
+        self.error = None
+        self.elapsed = 0.0
+        self.processed = 0
+        self.position = 0  # Frames of the video this consumer has got through
+        self.dependencies = []
+        self.done = threading.Event()
+
+    def run(self):
+        while True:
+            item = self.frames.get()
+            if item is _END:
+                break
+            if self.error is not None:
+                continue  # Keep draining so the decoder never blocks on us
+            t0 = time.time()
+            try:
+                self.consumer.process(*item)
+            except Exception as e:
+                self.error = e
+            self.elapsed += time.time() - t0
+            self.processed += 1
+            self.position = item[0] + 1
+
+        for dependency in self.dependencies:
+            dependency.done.wait()
+
+        if self.error is None:
+            t0 = time.time()
+            try:
+                self.result = self.finish()
+            except Exception as e:
+                self.error = e
+            self.elapsed += time.time() - t0
+        self.done.set()
+
+
+def _report_progress(progress, workers, names, frame_count):
+    positions = {}
+    for name in names:
+        worker = workers[name]
+        if worker.consumer.takes_frames:
+            positions[name] = worker.position
+        else:
+            # Consumers fed by services are as far along as their slowest service
+            positions[name] = min([d.position for d in worker.dependencies] or [0])
+    progress(positions, frame_count)
+
+
+def _segment_window(consumer, start, end):
+    """Frames to feed consumer for the segment [start, end): its own frames in it, plus its warmup."""
+    first = start + (consumer.offset - start) % consumer.stride
+    return max(0, first - consumer.warmup * consumer.stride), end
+
+
+def run_consumers(video_path, consumers, buffer_size=8, source=None, progress=None, progress_interval=0.5,
+                  segment=None):
+    """
+    Decode video_path once and push every frame to the consumers that want it.
+
+    consumers is a dict of name -> FrameConsumer. Each consumer runs on its own
+    thread behind a bounded queue of buffer_size frames, so a slow analyzer
+    applies backpressure to the decoder instead of growing memory. Shared
+    services listed in a consumer's depends_on are run as well, even if they
+    are not in the dict, and finish before their dependents. Frames that no
+    consumer wants are only grabbed, never converted to BGR.
+    source picks the decoder from FRAME_SOURCES (default FRAME_SOURCE).
+    progress, if given, is called as progress({name: frames done}, frame_count)
+    at most every progress_interval seconds while decoding.
+    segment, if given, is a (start, end) frame range to analyze on its own:
+    decoding seeks to it (less any warmup) and stops at its end, and the
+    consumers' segment_state() is returned instead of their scores.
+    Returns a dict of name -> score and stores each consumer's busy time in
+    consumer.elapsed, its frame count in consumer.frames_processed and the
+    decoder's reading time in consumer.decode_time. The first consumer error is re-raised once decoding ends.
+    """
+    # The ring must outlive every frame still queued or being processed
+    cap = FRAME_SOURCES[source or FRAME_SOURCE](video_path, ring_size=buffer_size + 4)
+    if not cap.isOpened():
+        log.error("Error opening video file", video=video_path)
+        return {name: c.fallback_score for name, c in consumers.items()}
+
+    requested = list(consumers)
+    consumers = dict(consumers)
+    for consumer in list(consumers.values()):
+        for dependency in consumer.depends_on:
+            if all(dependency is not c for c in consumers.values()):
+                consumers[f'_{type(dependency).__name__}_{id(dependency)}'] = dependency
+
+    workers = {}
+    for name, consumer in consumers.items():
+        consumer.start(cap.fps, cap.frame_count)
+        if segment is not None:
+            consumer.segment = segment
+            consumer.window = _segment_window(consumer, *segment)
+        workers[name] = _ConsumerThread(consumer, buffer_size,
+                                        consumer.finish if segment is None else consumer.segment_state)
+
+    for worker in workers.values():
+        worker.dependencies = [w for w in workers.values()
+                               if any(w.consumer is d for d in worker.consumer.depends_on)]
+        worker.start()
+
+    requests = [f for consumer in consumers.values() for f in consumer.features]
+    exact = [size for consumer in consumers.values() if consumer.exact_size for _, size in consumer.features]
+    graph = None
+    prev = None
+    decode_time = 0.0
+    reported_at = time.time()
+    end = math.inf
+    try:
+        if segment is not None:
+            takers = [c for c in consumers.values() if c.takes_frames] or list(consumers.values())
+            end = max(c.window[1] for c in takers)
+            first = min(c.window[0] for c in takers)
+            if any(kind == 'diff' for kind, _ in requests):
+                first -= 1  # Diffs at the first frame need the one before
+            if first > 0:
+                cap.seek(first)
+        if cap.frame_size:
+            # Decode no larger than the biggest feature any consumer asked for
+            width = max([pixel_size(cap.frame_size, size)[0] for _, size in requests] or [cap.frame_size[0]])
+            cap.start(width, *_sampling_plan(consumers.values(), requests))
+        index = cap.first_index
+
+        while index < end:
+            targets = [name for name, w in workers.items() if w.consumer.wants(index)]
+
+            if graph is not None and not targets and not graph.carried:
+                # Nobody needs this frame: advance the decoder without retrieving it
+                t0 = time.time()
+                grabbed = cap.grab()
+                decode_time += time.time() - t0
+                if not grabbed:
+                    break
+                index += cap.step
+                continue
+
+            t0 = time.time()
+            ret, frame = cap.read()
+            decode_time += time.time() - t0
+            if not ret:
+                break
+
+            if graph is None:
+                root_size = (frame.shape[1], frame.shape[0])
+                graph = FeatureGraph(*(cap.frame_size or root_size), requests, exact, root_size)
+                nodes = {name: graph.nodes(w.consumer.features) for name, w in workers.items()}
+
+            needed = set(graph.carried)
+            for name in targets:
+                needed |= nodes[name]
+
+            features = graph.compute(frame, prev, needed)
+            for name in targets:
+                workers[name].frames.put((index, features))
+            prev = features
+            index += cap.step
+
+            if progress is not None and time.time() - reported_at >= progress_interval:
+                _report_progress(progress, workers, requested, cap.frame_count)
+                reported_at = time.time()
+    finally:
+        cap.release()
+        for worker in workers.values():
+            worker.frames.put(_END)
+        for worker in workers.values():
+            worker.join()
+
+    for worker in workers.values():
+        worker.consumer.elapsed = worker.elapsed
+        worker.consumer.frames_processed = worker.processed
+        worker.consumer.decode_time = decode_time
+        if worker.error is not None:
+            raise worker.error
+    return {name: workers[name].result for name in requested}
+
+
+def keyframe_indices(video_path):
+    """
+    Indices of the video's keyframes in display order, read from the
+    container's packets without decoding anything. Empty if unavailable.
+    """
+    try:
+        out, _ = (
+            ffmpeg.input(video_path)
+            .output('pipe:', map='0:v:0', c='copy', format='framecrc')
+            .global_args('-loglevel', 'error', '-nostdin')
+            .run(capture_stdout=True, capture_stderr=True)
+        )
+    except ffmpeg.Error:
+        return []
+
+    pts = []
+    keys = []
+    for line in out.decode().splitlines():
+        if line.startswith('#'):
+            continue
+        fields = [f.strip() for f in line.split(',')]
+        flags = next((int(f[2:], 16) for f in fields[6:] if f.startswith('F=')), 1)  # Omitted for keyframes
+        pts.append(int(fields[2]))
+        if flags & 1:
+            keys.append(int(fields[2]))
+    order = {value: index for index, value in enumerate(sorted(pts))}
+    return sorted(order[value] for value in keys)
+
+
+def plan_segments(video_path, count, min_seconds=0):
+    """
+    Split the video into at most count (start, end) frame ranges of at least
+    min_seconds each, starting on the keyframes closest to even splits so
+    every segment decodes from its own keyframe. A single range covers
+    videos too short to split. Returns (fps, frame_count, segments).
+    """
+    cap = cv2.VideoCapture(video_path)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30
+    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    min_frames = max(1, int(min_seconds * fps))
+    count = max(1, min(count, frame_count // min_frames))
+    if count == 1:
+        return fps, frame_count, [(0, frame_count)]
+
+    keyframes = keyframe_indices(video_path) or list(range(frame_count))
+    starts = [0]
+    for i in range(1, count):
+        target = frame_count * i // count
+        start = min(keyframes, key=lambda k: abs(k - target))
+        if start - starts[-1] >= min_frames and frame_count - start >= min_frames:
+            starts.append(start)
+    return fps, frame_count, list(zip(starts, starts[1:] + [frame_count]))
+
+
+def run_consumer(video_path, consumer):
+    """Run a single consumer over its own decode of video_path."""
+    return run_consumers(video_path, {'score': consumer})['score']
@@ -0,0 +1,14 @@
+import os
+import tempfile
+
+# Every worker writes its metrics to files in this directory so /metrics,
+# whichever worker serves it, reports the totals of all of them. It must be
+# set here, before the workers import prometheus_client.
+os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', tempfile.mkdtemp(prefix='metrics-'))
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,108 @@
+import os
+import time
+import uuid
+import queue
+import threading
+from logs import get_logger
+from metrics import JOBS_WAITING, REQUEST_QUEUE_SECONDS, REQUEST_SECONDS
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 16))
+JOB_TTL = float(os.environ.get('JOB_TTL', 3600))  # Seconds a finished job stays queryable
+
+log = get_logger(__name__)
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when no more jobs can be accepted."""
+
+
+class Job:
+    def __init__(self, func, args):
+        self.id = uuid.uuid4().hex
+        self.func = func
+        self.args = args
+        self.status = 'queued'
+        self.progress = {}
+        self.details = {}  # Facts about the input worth reporting, e.g. video metadata
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        now = time.time()
+        return {
+            'id': self.id,
+            'status': self.status,
+            'details': self.details,
+            'progress': {key: dict(value) for key, value in dict(self.progress).items()},
+            'result': self.result,
+            'error': self.error,
+            'queued_seconds': round((self.started_at or now) - self.created_at, 2),
+            'running_seconds': round((self.finished_at or now) - self.started_at, 2) if self.started_at else None,
+        }
+
+
+class JobQueue:
+    """
+    Runs submitted jobs on a fixed number of worker threads.
+
+    At most max_pending jobs may wait for a worker; submit() raises QueueFull
+    beyond that so callers can push back (e.g. with HTTP 429) instead of
+    piling up work. func is called as func(job, *args) and may update
+    job.status and job.progress while it runs; its return value becomes
+    job.result.
+    """
+
+    def __init__(self, workers=JOB_WORKERS, max_pending=JOB_QUEUE_SIZE, ttl=JOB_TTL):
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.ttl = ttl
+        self.jobs = {}
+        self._lock = threading.Lock()
+        for _ in range(workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def full(self):
+        return self.pending.full()
+
+    def submit(self, func, *args):
+        job = Job(func, args)
+        JOBS_WAITING.inc()
+        try:
+            self.pending.put_nowait(job)
+        except queue.Full:
+            JOBS_WAITING.dec()
+            raise QueueFull(f"{self.pending.maxsize} jobs are already waiting")
+        with self._lock:
+            self._expire()
+            self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [j.id for j in self.jobs.values() if j.finished_at and j.finished_at < cutoff]:
+            del self.jobs[job_id]
+
+    def _work(self):
+        while True:
+            job = self.pending.get()
+            job.status = 'running'
+            job.started_at = time.time()
+            JOBS_WAITING.dec()
+            REQUEST_QUEUE_SECONDS.observe(job.started_at - job.created_at)
+            try:
+                job.result = job.func(job, *job.args)
+                job.status = 'done'
+            except Exception as e:
+                log.exception("❌ Job failed", job=job.id)
+                job.error = str(e)
+                job.status = 'failed'
+            job.finished_at = time.time()
+            REQUEST_SECONDS.labels('jobs', job.status).observe(job.finished_at - job.created_at)
+            job.func = job.args = None  # Drop references to uploaded files and buffers
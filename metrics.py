@@ -0,0 +1,81 @@
+import os
+import tempfile
+
+# Several processes (gunicorn workers, analysis pool workers) each hold
+# their own metrics. prometheus_client merges them through files in
+# PROMETHEUS_MULTIPROC_DIR, which has to be set before it is imported; the
+# gunicorn config sets it for the web workers, and the analysis pool gets
+# one here so its workers (which inherit the environment) report too.
+if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ and os.environ.get('ANALYSIS_EXECUTOR') == 'process':
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = tempfile.mkdtemp(prefix='metrics-')
+
+from prometheus_client import (  # noqa: E402
+    CollectorRegistry, Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, REGISTRY, generate_latest, multiprocess,
+    start_http_server
+)
+
+METRICS_MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+SECONDS_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600, 1800)
+FRAME_BUCKETS = (10, 30, 100, 300, 1000, 3000, 10000, 30000, 100000, 300000)
+FPS_BUCKETS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+ANALYZER_DECODE_SECONDS = Histogram(
+    'analyzer_decode_seconds', 'Seconds the decode an analyzer was fed by spent reading frames or audio',
+    ['analyzer'], buckets=SECONDS_BUCKETS)
+ANALYZER_COMPUTE_SECONDS = Histogram(
+    'analyzer_compute_seconds', 'Seconds an analyzer spent processing and scoring',
+    ['analyzer'], buckets=SECONDS_BUCKETS)
+ANALYZER_FRAMES = Histogram(
+    'analyzer_frames', 'Frames an analyzer processed per video',
+    ['analyzer'], buckets=FRAME_BUCKETS)
+ANALYZER_FPS = Histogram(
+    'analyzer_fps', 'Frames an analyzer processed per wall-clock second of its run',
+    ['analyzer'], buckets=FPS_BUCKETS)
+ANALYSIS_FAILURES = Counter(
+    'analysis_failures', 'Video or audio analysis runs that raised',
+    ['stage'])
+
+REQUEST_INGEST_SECONDS = Histogram(
+    'request_ingest_seconds', 'Seconds spent receiving an upload or downloading a video URL',
+    ['source'], buckets=SECONDS_BUCKETS)
+REQUEST_QUEUE_SECONDS = Histogram(
+    'request_queue_wait_seconds', 'Seconds a job waited in the queue before analysis started',
+    buckets=SECONDS_BUCKETS)
+REQUEST_SECONDS = Histogram(
+    'request_seconds', 'Seconds from receiving a request to its result',
+    ['endpoint', 'status'], buckets=SECONDS_BUCKETS)
+JOBS_WAITING = Gauge(
+    'jobs_waiting', 'Jobs queued and not started yet', multiprocess_mode='livesum')
+
+
+def metrics_registry():
+    """Registry collecting every process's metrics: those in METRICS_MULTIPROC_DIR, or this process's."""
+    if METRICS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render_metrics():
+    """(body, content type) of the Prometheus exposition of every process's metrics."""
+    return generate_latest(metrics_registry()), CONTENT_TYPE_LATEST
+
+
+def serve_metrics(port, addr='0.0.0.0'):
+    """
+    Expose metrics_registry() on its own HTTP port, from a daemon thread, for
+    processes without a web app (broker workers and their analysis pools).
+    """
+    start_http_server(port, addr, registry=metrics_registry())
+
+
+def observe_analyzer(key, decode_seconds, compute_seconds, wall_seconds, frames=None):
+    """Record one analyzer run; frames is None for analyzers that are not fed frames."""
+    ANALYZER_DECODE_SECONDS.labels(key).observe(decode_seconds)
+    ANALYZER_COMPUTE_SECONDS.labels(key).observe(compute_seconds)
+    if frames is not None:
+        ANALYZER_FRAMES.labels(key).observe(frames)
+        if wall_seconds > 0:
+            ANALYZER_FPS.labels(key).observe(frames / wall_seconds)
@@ -1,55 +1,72 @@
-import cv2
 import numpy as np
+from frame_source import FrameConsumer, run_consumer
+from feature_store import stacked, scalars, run_sums, run_means
+from logs import get_logger
+
+log = get_logger(__name__)
 
-def narrative_coherence_score(video_path, threshold=30.0, resize_factor=0.5):
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print(f"Error opening video file: {video_path}")
-        return 1  # Safe fallback
 
-    prev_frame = None
-    frame_idx = 0
-    fps = cap.get(cv2.CAP_PROP_FPS) or 30  # Default to 30 if unknown
-    scene_times = []
+class NarrativeCoherenceConsumer(FrameConsumer):
+    fallback_score = 1  # Safe fallback
+    merged = ('indices', 'mean_diffs')
+    scoring = ('threshold',)
 
-    last_scene_time = 0
+    def __init__(self, threshold=30.0, resize_factor=0.5):
+        self.threshold = threshold
+        self.resize_factor = resize_factor
+        self.features = [('diff', resize_factor)]
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+    def start(self, fps, frame_count):
+        super().start(fps, frame_count)
+        self.indices = []  # Every frame's mean diff; scene durations are taken when scoring
+        self.mean_diffs = []
 
-        frame_idx += 1
-        frame_small = cv2.resize(frame, (0, 0), fx=resize_factor, fy=resize_factor)
-        gray = cv2.cvtColor(frame_small, cv2.COLOR_BGR2GRAY)
+    def process(self, index, frame):
+        diff = frame.diff(self.resize_factor)
+        if diff is not None:
+            self.indices.append(index)
+            self.mean_diffs.append(np.mean(diff))
 
-        if prev_frame is not None:
-            diff = cv2.absdiff(gray, prev_frame)
-            score = np.mean(diff)
-            if score > threshold:
-                # Scene change detected
-                time_sec = frame_idx / fps
-                duration = time_sec - last_scene_time
-                scene_times.append(duration)
-                last_scene_time = time_sec
+    def signals(self):
+        return {
+            'indices': np.array(self.indices, dtype=np.int32),
+            'mean_diffs': np.array(self.mean_diffs, dtype=np.float32),
+            'fps': self.fps,
+        }
 
-        prev_frame = gray
+    @classmethod
+    def rescore(cls, runs, threshold):
+        indices, lengths = stacked(runs, 'indices', np.int64)
+        mean_diffs, _ = stacked(runs, 'mean_diffs')
+        changes = mean_diffs > threshold  # Scene change detected
+        change_times = ((indices + 1) / np.repeat(scalars(runs, 'fps'), lengths))[changes]
+        scenes = run_sums(changes, lengths).astype(np.int64)
 
-    cap.release()
+        # Duration of every scene, the first one starting at 0
+        starts = np.cumsum(scenes) - scenes
+        previous = np.concatenate([[0.0], change_times[:-1]])
+        previous[starts[scenes > 0]] = 0.0
+        scene_times = change_times - previous
+        avg_duration = run_means(scene_times, scenes)
+        std_duration = np.sqrt(run_means((scene_times - np.repeat(avg_duration, scenes)) ** 2, scenes))
 
-    if len(scene_times) < 2:
-        print("Not enough scenes detected for narrative coherence analysis.")
-        return 1
+        # High std deviation + short average scene duration = incoherent
+        with np.errstate(divide='ignore', invalid='ignore'):
+            variability_penalty = np.minimum(1.0, std_duration / avg_duration)  # normalize
+        short_scene_penalty = np.where(avg_duration < 2.0, np.minimum(1.0, (2.0 - avg_duration) / 2.0), 0)
 
-    avg_duration = np.mean(scene_times)
-    std_duration = np.std(scene_times)
+        incoherence_level = (variability_penalty + short_scene_penalty) / 2
 
-    # High std deviation + short average scene duration = incoherent
-    variability_penalty = min(1.0, std_duration / avg_duration)  # normalize
-    short_scene_penalty = min(1.0, (2.0 - avg_duration) / 2.0) if avg_duration < 2.0 else 0
+        # Map to score: higher incoherence → higher score
+        final_score = 1 + 9 * incoherence_level
+        return np.where(scenes >= 2, final_score, 1)
 
-    incoherence_level = (variability_penalty + short_scene_penalty) / 2
+    def finish(self):
+        scenes = int(np.sum(np.array(self.mean_diffs) > self.threshold))
+        if scenes < 2:
+            log.warning("Not enough scenes detected for narrative coherence analysis", scenes=scenes)
+        return self.score_signals()
 
-    # Map to score: higher incoherence → higher score
-    final_score = 1 + 9 * incoherence_level
-    return final_score
\ No newline at end of file
+
+def narrative_coherence_score(video_path, threshold=30.0, resize_factor=0.5):
+    return run_consumer(video_path, NarrativeCoherenceConsumer(threshold, resize_factor))
@@ -0,0 +1,161 @@
+import os
+import sys
+import time
+import cv2
+import numpy as np
+from frame_source import FrameConsumer, run_consumers
+
+DEFAULT_FLOW_BACKEND = os.environ.get('FLOW_BACKEND', 'farneback')
+
+
+class FarnebackFlow:
+    """Dense Farneback flow, the reference backend."""
+
+    def __init__(self, levels=3, winsize=15, poly_sigma=1.2):
+        self.levels = levels
+        self.winsize = winsize
+        self.poly_sigma = poly_sigma
+
+    def mean_magnitude(self, prev_gray, gray):
+        flow = cv2.calcOpticalFlowFarneback(
+            prev_gray, gray,
+            None, 0.5, self.levels, self.winsize, 3, 5, self.poly_sigma, 0
+        )
+        magnitude, _ = cv2.cartToPolar(flow[..., 0], flow[..., 1])
+        return np.mean(magnitude)
+
+
+class DISFlow:
+    """Dense inverse search flow, several times cheaper than Farneback."""
+
+    def __init__(self, preset=cv2.DISOPTICAL_FLOW_PRESET_ULTRAFAST):
+        self.dis = cv2.DISOpticalFlow_create(preset)
+
+    def mean_magnitude(self, prev_gray, gray):
+        flow = self.dis.calc(prev_gray, gray, None)
+        magnitude, _ = cv2.cartToPolar(flow[..., 0], flow[..., 1])
+        return np.mean(magnitude)
+
+
+class GridLKFlow:
+    """Sparse pyramidal Lucas-Kanade over a regular grid of points."""
+
+    def __init__(self, grid_step=16, levels=3):
+        self.grid_step = grid_step
+        self.levels = levels
+        self.points = None
+
+    def mean_magnitude(self, prev_gray, gray):
+        if self.points is None:
+            h, w = prev_gray.shape
+            step = self.grid_step
+            ys, xs = np.mgrid[step // 2:h:step, step // 2:w:step]
+            self.points = np.stack([xs.ravel(), ys.ravel()], axis=1).astype(np.float32).reshape(-1, 1, 2)
+
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(
+            prev_gray, gray, self.points, None, winSize=(15, 15), maxLevel=self.levels
+        )
+        tracked = status.ravel() == 1
+        if not np.any(tracked):
+            return 0.0
+        displacement = (moved - self.points).reshape(-1, 2)[tracked]
+        return np.mean(np.linalg.norm(displacement, axis=1))
+
+
+FLOW_BACKENDS = {
+    'farneback': FarnebackFlow,
+    'dis': DISFlow,
+    'lk': GridLKFlow,
+}
+
+
+class FlowService(FrameConsumer):
+    """
+    Computes optical flow once per sampled frame pair and serves the mean
+    magnitudes to every analyzer that needs motion.
+
+    Magnitudes are stored in pixels at the service resolution over a gap of
+    `stride` frames; magnitudes() converts them to the resolution and time
+    gap an analyzer's thresholds were tuned for.
+    """
+    exact_size = True  # Flow magnitudes are in pixels
+    warmup = 1  # The frame before a segment, to pair with its first frame
+    merged = ('mean_magnitudes',)
+
+    def __init__(self, resize_factor=0.4, sample_fps=10, backend=None):
+        self.resize_factor = resize_factor
+        self.sample_fps = sample_fps
+        self.features = [('gray', resize_factor)]
+        self.backend_name = backend or DEFAULT_FLOW_BACKEND
+        if self.backend_name not in FLOW_BACKENDS:
+            raise ValueError(f"Unknown flow backend: {self.backend_name}")
+
+    def start(self, fps, frame_count):
+        super().start(fps, frame_count)
+        self.offset = self.stride - 1  # Frames 3, 6, 9... counting from 1 at 30 fps
+        self.backend = FLOW_BACKENDS[self.backend_name]()
+        self.prev_gray = None
+        self.width = None
+        self.mean_magnitudes = []
+
+    def process(self, index, frame):
+        gray = frame.gray(self.resize_factor)
+        if self.prev_gray is not None:
+            self.mean_magnitudes.append(self.backend.mean_magnitude(self.prev_gray, gray))
+        self.prev_gray = gray
+        self.width = gray.shape[1]
+
+    def finish(self):
+        return len(self.mean_magnitudes)
+
+    def segment_state(self):
+        return dict(super().segment_state(), width=self.width)
+
+    def merge_segments(self, states):
+        super().merge_segments(states)
+        self.width = next((state['width'] for state in states if state['width']), None)
+
+    def magnitudes(self, width=None, seconds=None):
+        """Mean magnitude per frame pair, rescaled to width pixels and a gap of seconds."""
+        magnitudes = np.array(self.mean_magnitudes, dtype=np.float64)
+        if width is not None and self.width:
+            magnitudes *= width / self.width
+        if seconds is not None:
+            magnitudes *= seconds / (self.stride / self.fps)
+        return magnitudes
+
+
+def flow_backend_drift(video_path):
+    """
+    Score video_path with every flow backend in one decode and report how far
+    camera movement drifts from Farneback.
+    """
+    from camera_movement_analysis import CameraMovementConsumer
+
+    consumers = {}
+    services = {}
+    for name in FLOW_BACKENDS:
+        services[name] = FlowService(backend=name)
+        consumers[f'{name}_flow'] = services[name]
+        consumers[f'{name}_camera'] = CameraMovementConsumer(flow=services[name])
+
+    results = run_consumers(video_path, consumers)
+
+    report = {}
+    for name in FLOW_BACKENDS:
+        report[name] = {
+            'flow_seconds': round(services[name].elapsed, 2),
+            'camera_movement': float(results[f'{name}_camera']),
+            'camera_movement_drift': float(results[f'{name}_camera'] - results['farneback_camera']),
+        }
+    return report
+
+
+if __name__ == '__main__':
+    for path in sys.argv[1:]:
+        t0 = time.time()
+        report = flow_backend_drift(path)
+        print(f"\n🎞️ {path} ({round(time.time() - t0, 2)}s)")
+        for name, row in report.items():
+            print(f"• {name}: flow {row['flow_seconds']}s | "
+                  f"camera {row['camera_movement']:.2f} ({row['camera_movement_drift']:+.2f})")
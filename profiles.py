@@ -0,0 +1,119 @@
+import os
+import time
+import argparse
+import numpy as np
+
+DEFAULT_PROFILE = os.environ.get('ANALYSIS_PROFILE', 'balanced')
+
+# Speed/accuracy trade-offs, as constructor settings per analyzer key
+# ('flow' is the optical flow service camera movement reads).
+# 'accurate' analyzes every frame at full resolution and is the reference
+# the others are calibrated against; 'balanced' is the default settings.
+# The flow backend and the expression mode are left to FLOW_BACKEND and
+# EXPRESSION_MODE except where a profile needs a specific one.
+PROFILES = {
+    'accurate': {
+        'scene': {'resize_factor': None},
+        'flash': {'resize_factor': None},
+        'color': {'resize_factor': None, 'sample_fps': None},
+        'density': {'resize_factor': None, 'sample_fps': None},
+        'animation': {'resize_factor': None},
+        'expression': {'sample_fps': 6},
+        'fancy': {'sample_fps': 6},
+        'narrative': {'resize_factor': None},
+        'flow': {'resize_factor': 0.4, 'sample_fps': 10},
+        'speech_rate': {},
+    },
+    'balanced': {
+        'scene': {'resize_factor': 0.25},
+        'flash': {'resize_factor': None},
+        'color': {'resize_factor': None, 'sample_fps': 5},
+        'density': {'resize_factor': None, 'sample_fps': None},
+        'animation': {'resize_factor': None},
+        'expression': {'sample_fps': 6},
+        'fancy': {'sample_fps': 6},
+        'narrative': {'resize_factor': 0.5},
+        'flow': {'resize_factor': 0.4, 'sample_fps': 10},
+        'speech_rate': {},
+    },
+    'fast': {
+        'scene': {'resize_factor': 0.125},
+        'flash': {'resize_factor': 0.25},
+        'color': {'resize_factor': 0.25, 'sample_fps': 2},
+        'density': {'resize_factor': 0.5, 'sample_fps': 5},
+        'animation': {'resize_factor': 0.25},
+        'expression': {'mode': 'tracked', 'sample_fps': 3},
+        'fancy': {'sample_fps': 3},
+        'narrative': {'resize_factor': 0.25},
+        'flow': {'resize_factor': 0.25, 'sample_fps': 5},
+        'speech_rate': {'backend': 'syllables'},
+    },
+}
+
+
+def profile_settings(profile=None):
+    """Settings of a profile by name (the configured default for None); raises ValueError if unknown."""
+    name = profile or DEFAULT_PROFILE
+    if name not in PROFILES:
+        raise ValueError(f"Unknown analysis profile: {name}")
+    return PROFILES[name]
+
+
+def calibrate(video_paths, profiles=None, keys=None, reference='accurate'):
+    """
+    Score every video under each profile and report, per profile, the
+    throughput (seconds of video analyzed per second) and the absolute
+    score deltas against the reference profile per analyzer.
+    """
+    from analysis_pool import run_all_analyzers
+    from upload_store import probe_video
+
+    profiles = [reference] + [p for p in (profiles or PROFILES) if p != reference]
+    scores = {name: [] for name in profiles}
+    seconds = {name: 0.0 for name in profiles}
+    video_seconds = 0.0
+
+    for path in video_paths:
+        meta = probe_video(path)
+        video_seconds += meta['duration'] if meta else 0.0
+        for name in profiles:
+            t0 = time.time()
+            scores[name].append(run_all_analyzers(path, keys, profile=name)[0])
+            seconds[name] += time.time() - t0
+
+    report = {}
+    for name in profiles:
+        deltas = {}
+        for key in scores[reference][0] if scores[reference] else []:
+            diff = [abs(s[key] - r[key]) for s, r in zip(scores[name], scores[reference])]
+            deltas[key] = {'mean': float(np.mean(diff)), 'max': float(np.max(diff))}
+        final = [abs(np.mean(list(s.values())) - np.mean(list(r.values())))
+                 for s, r in zip(scores[name], scores[reference])]
+        report[name] = {
+            'seconds': round(seconds[name], 2),
+            'realtime': round(video_seconds / seconds[name], 2) if seconds[name] else None,
+            'speedup': round(seconds[reference] / seconds[name], 2) if seconds[name] else None,
+            'final_score_delta': float(np.max(final)) if final else 0.0,
+            'deltas': deltas,
+        }
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Calibrate analysis profiles against a video corpus.")
+    parser.add_argument('videos', nargs='+')
+    parser.add_argument('--profiles', help="Comma-separated profiles (default: all)")
+    parser.add_argument('--keys', help="Comma-separated analyzer keys (default: all)")
+    args = parser.parse_args()
+
+    report = calibrate(
+        args.videos,
+        args.profiles.split(',') if args.profiles else None,
+        args.keys.split(',') if args.keys else None
+    )
+    print(f"\n📐 Calibration over {len(args.videos)} video(s), deltas against 'accurate':")
+    for name, row in report.items():
+        print(f"\n• {name}: {row['seconds']}s, {row['realtime']}x realtime, {row['speedup']}x speedup, "
+              f"final score delta ≤ {row['final_score_delta']:.2f}")
+        for key, delta in row['deltas'].items():
+            print(f"    {key:<12} mean {delta['mean']:.2f}  max {delta['max']:.2f}")
@@ -0,0 +1,150 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from contextlib import contextmanager
+
+RESULT_CACHE_PATH = os.environ.get('RESULT_CACHE_PATH', os.path.join('cache', 'results.sqlite3'))
+RESULT_CACHE_MAX_MB = float(os.environ.get('RESULT_CACHE_MAX_MB', 512))
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """Hex SHA-256 of a file's contents, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """
+    Persistent per-analyzer score cache keyed by video content hash.
+
+    Each row stores one analyzer's score together with the fingerprint
+    (version and parameters, see analyzers.analyzer_fingerprints) it was
+    computed with. A lookup only hits when the fingerprint still matches, so
+    bumping one analyzer's version only recomputes that analyzer.
+    Rows are evicted least recently used first once the cache grows past
+    max_bytes. Safe to share between threads and processes.
+    """
+
+    def __init__(self, path=None, max_bytes=None):
+        self.path = path or RESULT_CACHE_PATH
+        self.max_bytes = max_bytes if max_bytes is not None else int(RESULT_CACHE_MAX_MB * 1024 * 1024)
+        self._lock = threading.Lock()
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as db:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    content_hash TEXT NOT NULL,
+                    analyzer TEXT NOT NULL,
+                    fingerprint TEXT NOT NULL,
+                    score REAL NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (content_hash, analyzer)
+                )
+            """)
+            db.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed_at)')
+            db.execute('CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            db.execute('CREATE TABLE IF NOT EXISTS urls (url TEXT PRIMARY KEY, content_hash TEXT NOT NULL)')
+
+    @contextmanager
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        try:
+            with db:  # Commits, or rolls back on error
+                yield db
+        finally:
+            db.close()
+
+    def get(self, content_hash, fingerprints):
+        """
+        Return {analyzer: score} for every analyzer in fingerprints whose
+        cached score was computed with the same fingerprint.
+        """
+        now = time.time()
+        with self._lock, self._connect() as db:
+            rows = db.execute(
+                'SELECT analyzer, fingerprint, score FROM results WHERE content_hash = ?', (content_hash,)
+            ).fetchall()
+            hits = {analyzer: score for analyzer, fingerprint, score in rows
+                    if fingerprints.get(analyzer) == fingerprint}
+            db.executemany(
+                'UPDATE results SET accessed_at = ? WHERE content_hash = ? AND analyzer = ?',
+                [(now, content_hash, analyzer) for analyzer in hits]
+            )
+            self._count(db, 'hits', len(hits))
+            self._count(db, 'misses', len(fingerprints) - len(hits))
+        return hits
+
+    def has(self, content_hash, fingerprints):
+        """Whether every analyzer in fingerprints has a matching cached score; not counted as a lookup."""
+        with self._lock, self._connect() as db:
+            rows = db.execute(
+                'SELECT analyzer, fingerprint FROM results WHERE content_hash = ?', (content_hash,)
+            ).fetchall()
+        return set(fingerprints.items()) <= set(rows)
+
+    def url_hash(self, url):
+        """Content hash of what url last downloaded to, or None. The content may have changed since."""
+        with self._connect() as db:
+            row = db.execute('SELECT content_hash FROM urls WHERE url = ?', (url,)).fetchone()
+        return row[0] if row else None
+
+    def put_url(self, url, content_hash):
+        with self._lock, self._connect() as db:
+            db.execute('INSERT OR REPLACE INTO urls VALUES (?, ?)', (url, content_hash))
+
+    def put(self, content_hash, fingerprints, scores):
+        """Store freshly computed scores, then evict down to max_bytes."""
+        now = time.time()
+        rows = []
+        for analyzer, score in scores.items():
+            fingerprint = fingerprints[analyzer]
+            size = len(content_hash) + len(analyzer) + len(fingerprint) + 16
+            rows.append((content_hash, analyzer, fingerprint, float(score), size, now))
+
+        with self._lock, self._connect() as db:
+            db.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?)', rows)
+            self._evict(db)
+
+    def _evict(self, db):
+        total = db.execute('SELECT COALESCE(SUM(size), 0) FROM results').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for rowid, size in db.execute('SELECT rowid, size FROM results ORDER BY accessed_at').fetchall():
+            if total <= self.max_bytes:
+                break
+            db.execute('DELETE FROM results WHERE rowid = ?', (rowid,))
+            total -= size
+            evicted += 1
+        self._count(db, 'evictions', evicted)
+
+    def _count(self, db, name, amount):
+        if amount:
+            db.execute(
+                'INSERT INTO counters VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value',
+                (name, amount)
+            )
+
+    def stats(self):
+        with self._connect() as db:
+            counters = dict(db.execute('SELECT name, value FROM counters').fetchall())
+            entries, size = db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+            videos = db.execute('SELECT COUNT(DISTINCT content_hash) FROM results').fetchone()[0]
+        return {
+            'hits': counters.get('hits', 0),
+            'misses': counters.get('misses', 0),
+            'evictions': counters.get('evictions', 0),
+            'entries': entries,
+            'videos': videos,
+            'size_bytes': size,
+            'max_bytes': self.max_bytes,
+        }
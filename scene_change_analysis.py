@@ -1,61 +1,133 @@
-import cv2
 import numpy as np
+from frame_source import FrameConsumer, run_consumer, debounced_counts
+from feature_store import stacked, scalars, run_sums
+from logs import get_logger
+
+log = get_logger(__name__)
+
+
+def correlations(hists):
+    """
+    Pearson correlation of every histogram row with the next one, as
+    cv2.compareHist(..., cv2.HISTCMP_CORREL) computes it.
+    """
+    centered = hists - hists.mean(axis=1, keepdims=True)
+    a, b = centered[:-1], centered[1:]
+    num = np.sum(a * b, axis=1)
+    den = np.sqrt(np.sum(a * a, axis=1) * np.sum(b * b, axis=1))
+    return np.where(den > np.finfo(np.float64).eps, num / np.where(den > 0, den, 1), 1.0)
 
-def scene_change_score(video_path):
-    cap = cv2.VideoCapture(video_path)
-    if not cap.isOpened():
-        print(f"Error opening video file: {video_path}")
-        return 0
 
-    scene_change_count = 0
+class SceneChangeConsumer(FrameConsumer):
+    """
+    Counts cuts as drops in the correlation of consecutive frames' 8x8x8 BGR
+    histograms. Frames are downscaled to resize_factor and buffered in
+    batches of batch_size: each batch is quantized to 3 bits per channel
+    with bit shifts, histogrammed with one bincount, and the correlations of
+    all its consecutive pairs are computed at once. Every correlation is
+    kept with the index of the pair's second frame, and cuts are only
+    counted and debounced when scoring, so segments merge exactly and the
+    thresholds can be changed on stored signals.
+    """
     threshold = 0.98  # Histogram correlation threshold
     min_interval = 1.0  # Minimum seconds between scene changes
+    lower_bound = 4  # Changes per minute scoring 1...
+    upper_bound = 21.96  # ...and 10
+    batch_size = 32
+    warmup = 1  # The frame before a segment, to correlate its first frame with
+    merged = ('indices', 'correlations', 'frames_seen')
+    scoring = ('threshold', 'min_interval', 'lower_bound', 'upper_bound')
 
-    ret, frame = cap.read()
-    if not ret:
-        print("Error reading the first frame.")
-        return 0
+    def __init__(self, resize_factor=0.25):
+        self.resize_factor = resize_factor
+        self.features = [('bgr', self.resize_factor)]
 
-    prev_hist = cv2.calcHist([frame], [0, 1, 2], None, [8, 8, 8],
-                             [0, 256, 0, 256, 0, 256])
-    prev_hist = cv2.normalize(prev_hist, prev_hist).flatten()
+    def start(self, fps, frame_count):
+        super().start(fps, frame_count)
+        self.indices = []
+        self.correlations = []
+        self.frames_seen = 0
+        self.prev_hist = None
+        self.batch = None
+        self.batch_indices = []
 
-    last_change_time = 0
-    fps = cap.get(cv2.CAP_PROP_FPS) or 30
-    frame_index = 1
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    def process(self, index, frame):
+        bgr = frame.get('bgr', self.resize_factor)
+        if self.batch is None:
+            self.batch = np.empty((self.batch_size,) + bgr.shape, dtype=np.uint8)
+        self.batch[len(self.batch_indices)] = bgr  # Copied, the decoder may reuse the frame's buffer
+        self.batch_indices.append(index)
+        self.frames_seen += 1
+        if len(self.batch_indices) == self.batch_size:
+            self._flush()
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+    def _flush(self):
+        n = len(self.batch_indices)
+        if n == 0:
+            return
+        # 3 bits per channel -> bin b*64 + g*8 + r, offset by 512 per frame
+        q = self.batch[:n] >> 5
+        bins = q[..., 0].astype(np.uint16) << 6
+        bins |= q[..., 1] << 3
+        bins |= q[..., 2]
+        bins += (np.arange(n, dtype=np.uint16) << 9)[:, None, None]
+        hists = np.bincount(bins.ravel(), minlength=n * 512).reshape(n, 512).astype(np.float64)
 
-        hist = cv2.calcHist([frame], [0, 1, 2], None, [8, 8, 8],
-                            [0, 256, 0, 256, 0, 256])
-        hist = cv2.normalize(hist, hist).flatten()
-        corr = cv2.compareHist(prev_hist, hist, cv2.HISTCMP_CORREL)
+        indices = self.batch_indices
+        if self.prev_hist is not None:
+            hists = np.vstack([self.prev_hist, hists])
+        else:
+            indices = indices[1:]
+        self.prev_hist = hists[-1]
+        self.batch_indices = []
+        if len(hists) < 2:
+            return
 
-        current_time = frame_index / fps
+        self.indices.extend(indices)
+        self.correlations.extend(correlations(hists).tolist())
 
-        if corr < threshold and (current_time - last_change_time >= min_interval or last_change_time == 0):
-            scene_change_count += 1
-            last_change_time = current_time
+    def segment_state(self):
+        self._flush()
+        return super().segment_state()
 
-        prev_hist = hist
-        frame_index += 1
+    def signals(self):
+        self._flush()
+        return {
+            'indices': np.array(self.indices, dtype=np.int32),
+            'correlations': np.array(self.correlations, dtype=np.float32),
+            'frames_seen': self.frames_seen,
+            'fps': self.fps,
+            'frame_count': self.frame_count,
+        }
 
-    cap.release()
+    @classmethod
+    def rescore(cls, runs, threshold, min_interval, lower_bound, upper_bound):
+        indices, lengths = stacked(runs, 'indices', np.int64)
+        values, _ = stacked(runs, 'correlations')
+        fps = scalars(runs, 'fps')
+        frames_seen = scalars(runs, 'frames_seen')
+        duration_sec = scalars(runs, 'frame_count') / fps
 
-    duration_sec = total_frames / fps
-    if duration_sec <= 0:
-        print("Zero duration video or live stream.")
-        return 1
+        cuts = values < threshold
+        times = (indices / np.repeat(fps, lengths))[cuts]
+        cut_lengths = run_sums(cuts, lengths).astype(np.int64)
+        scene_change_count = debounced_counts(times, cut_lengths, min_interval)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            changes_per_min = scene_change_count / (duration_sec / 60)
 
-    changes_per_min = scene_change_count / (duration_sec / 60)
+        score = 1 + (changes_per_min - lower_bound) * (9 / (upper_bound - lower_bound))
+        score = np.clip(score, 1, 10)
+        score = np.where(duration_sec > 0, score, 1)
+        return np.where(frames_seen > 0, score, 0)
 
-    # Scoring: 4 = 1, 21.96 = 10
-    lower_bound = 4
-    upper_bound = 21.96
-    score = 1 + (changes_per_min - lower_bound) * (9 / (upper_bound - lower_bound))
-    score = max(1, min(score, 10))  # Clamp score between 1 and 10
-    return score
\ No newline at end of file
+    def finish(self):
+        self._flush()
+        if self.frames_seen == 0:
+            log.warning("Error reading the first frame")
+        elif self.frame_count / self.fps <= 0:
+            log.warning("Zero duration video or live stream")
+        return self.score_signals()
+
+
+def scene_change_score(video_path):
+    return run_consumer(video_path, SceneChangeConsumer())
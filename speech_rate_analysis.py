@@ -1,9 +1,32 @@
+import io
 import os
-import asyncio
-from deepgram import Deepgram
+import queue
+import threading
+from concurrent.futures import Future, TimeoutError
 import numpy as np
+import scipy.signal
+import soundfile as sf
+from audio_source import AudioConsumer, run_audio_consumer
+from feature_store import scalars
+from async_io import run_async, post_json, limiter
+from logs import get_logger
 
-DEEPGRAM_API_KEY = "api key"  # Replace this
+DEEPGRAM_API_KEY = os.environ.get('DEEPGRAM_API_KEY', "api key")  # Replace this or set the env var
+DEEPGRAM_URL = os.environ.get('DEEPGRAM_URL', 'https://api.deepgram.com/v1/listen')
+
+# Remote ASR calls: seconds per attempt, retries with backoff, and concurrent calls per process
+ASR_TIMEOUT = float(os.environ.get('ASR_TIMEOUT', 120))
+ASR_RETRIES = int(os.environ.get('ASR_RETRIES', 3))
+ASR_BACKOFF = float(os.environ.get('ASR_BACKOFF', 1.0))
+ASR_MAX_IN_FLIGHT = int(os.environ.get('ASR_MAX_IN_FLIGHT', 4))
+
+# 'deepgram' (hosted), 'whisper' (local model) or 'syllables' (fast estimate)
+DEFAULT_SPEECH_BACKEND = os.environ.get('SPEECH_BACKEND', 'deepgram')
+WHISPER_MODEL = os.environ.get('WHISPER_MODEL', 'base')
+WHISPER_BATCH_SIZE = int(os.environ.get('WHISPER_BATCH_SIZE', 8))
+WHISPER_TIMEOUT = float(os.environ.get('WHISPER_TIMEOUT', 1800))  # Seconds a transcription may queue and run
+
+log = get_logger(__name__)
 
 def map_speech_rate_to_score(wpm: float) -> float:
     """
@@ -19,17 +42,24 @@ def map_speech_rate_to_score(wpm: float) -> float:
         return round(1 + 9 * ((wpm - 100) / 80) ** 0.6, 2)
 
 
-async def transcribe_with_deepgram(video_path: str):
-    dg_client = Deepgram(DEEPGRAM_API_KEY)
-
-    with open(video_path, "rb") as audio:
-        source = {'buffer': audio, 'mimetype': 'video/mp4'}
-        options = {'punctuate': True, 'utterances': True}
-
-        response = await dg_client.transcription.prerecorded(source, options)
+async def transcribe_with_deepgram(audio: bytes, mimetype='audio/flac'):
+    """
+    Transcribe an audio-only payload (FLAC by default) with Deepgram's
+    pre-recorded API, over the shared connection pool of async_io.
+    """
+    response = await post_json(
+        DEEPGRAM_URL,
+        data=audio,
+        headers={'Authorization': f'Token {DEEPGRAM_API_KEY}', 'Content-Type': mimetype},
+        params={'punctuate': 'true', 'utterances': 'true'},
+        timeout=ASR_TIMEOUT,
+        retries=ASR_RETRIES,
+        backoff=ASR_BACKOFF,
+        limit=limiter('asr', ASR_MAX_IN_FLIGHT)
+    )
 
-        words = response['results']['channels'][0]['alternatives'][0]['words']
-        return words
+    words = response['results']['channels'][0]['alternatives'][0]['words']
+    return words
 
 
 def calculate_wpm(words, start_time, end_time):
@@ -40,33 +70,242 @@ def calculate_wpm(words, start_time, end_time):
     return total_words / duration_minutes
 
 
-def speech_rate_score(video_path: str) -> float:
-    """Computes the speech rate score from video using Deepgram transcript."""
-    words = asyncio.run(transcribe_with_deepgram(video_path))
-
-    if not words or len(words) < 2:
-        print("Not enough words to compute speech rate.")
-        return 1.0
-
+def word_span(words):
+    """(word count, first word start, last word end) of timestamped words."""
     timestamps = [w['start'] for w in words if 'start' in w]
     if not timestamps:
-        return 1.0
+        return len(words), 0.0, 0.0
+    return len(words), timestamps[0], max(w.get('end', 0) for w in words)
+
+
+class DeepgramSpeech:
+    """
+    Hosted transcription; the soundtrack is sent as lossless FLAC. request()
+    and transcribe() split finish() in two, so the call can be awaited in
+    another process than the one that streamed the audio.
+    """
+    remote = True
+
+    def start(self, sample_rate):
+        self.buffer = io.BytesIO()
+        self.encoder = sf.SoundFile(self.buffer, 'w', sample_rate, 1, format='FLAC', subtype='PCM_16')
+
+    def process(self, block):
+        self.encoder.write(block)
+
+    def request(self):
+        """The encoded soundtrack to transcribe."""
+        self.encoder.close()
+        return self.buffer.getvalue()
+
+    @staticmethod
+    async def transcribe(request):
+        return word_span(await transcribe_with_deepgram(request))
+
+    def finish(self):
+        return run_async(self.transcribe(self.request()))
+
+
+_whisper_queue = None
+_whisper_lock = threading.Lock()
+
+
+def _whisper_worker(model, jobs):
+    while True:
+        batch = [jobs.get()]
+        while len(batch) < WHISPER_BATCH_SIZE and not jobs.empty():
+            batch.append(jobs.get())
+        for samples, future in batch:
+            if not future.set_running_or_notify_cancel():
+                continue  # The caller timed out waiting for it
+            try:
+                result = model.transcribe(samples, word_timestamps=True, fp16=model.device.type == 'cuda')
+                future.set_result([w for segment in result['segments'] for w in segment.get('words', [])])
+            except Exception as e:
+                future.set_exception(e)
+
+
+def transcribe_with_whisper(samples, timeout=WHISPER_TIMEOUT):
+    """
+    Word-timestamped transcript from the process-wide Whisper model. The
+    model is loaded once per worker process, by the first caller, which gets
+    the error if it can't be (and the next caller tries again). A single
+    inference thread then drains every transcription queued meanwhile in one
+    pass. Raises concurrent.futures.TimeoutError after timeout seconds.
+    """
+    global _whisper_queue
+    with _whisper_lock:
+        if _whisper_queue is None:
+            import whisper  # Only loaded (with torch) in processes that use this backend
+            model = whisper.load_model(WHISPER_MODEL)
+            log.info("🗣️ Loaded Whisper model", model=WHISPER_MODEL)
+            _whisper_queue = queue.Queue()
+            threading.Thread(target=_whisper_worker, args=(model, _whisper_queue), daemon=True).start()
+    future = Future()
+    _whisper_queue.put((samples, future))
+    try:
+        return future.result(timeout)
+    except TimeoutError:
+        future.cancel()  # Skipped by the inference thread unless it already started
+        raise
+
+
+class WhisperSpeech:
+    """Local Whisper transcription with word timestamps, for offline deployments."""
+
+    def start(self, sample_rate):
+        if sample_rate != 16000:
+            raise ValueError("Whisper expects 16 kHz audio")
+        self.blocks = []
+
+    def process(self, block):
+        self.blocks.append(block.copy())
+
+    def finish(self):
+        samples = np.concatenate(self.blocks) if self.blocks else np.zeros(0, dtype=np.float32)
+        self.blocks = []
+        return word_span(transcribe_with_whisper(samples))
+
+
+class SyllableSpeech:
+    """
+    Fast transcript-free estimate: energy-based voice activity detection plus
+    syllable nuclei (intensity peaks of the speech band, after de Jong and
+    Wempe), converted to words with an average syllables-per-word ratio.
+    Only a 10 ms intensity contour is kept while streaming.
+    """
+    frame_duration = 0.01
+    band = (300, 3000)
+    silence_db = 25            # Frames this far below the loudest speech are silence...
+    floor_margin_db = 6        # ...and so are frames within this much of the noise floor
+    min_prominence_db = 2      # A nucleus must rise this far above the dips around it
+    min_syllable_gap = 0.1     # Seconds; people don't say more than ~10 syllables a second
+    syllables_per_word = 1.5   # English average; calibrate against a transcribing backend
+
+    def start(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.frame_samples = int(round(self.frame_duration * sample_rate))
+        self.sos = scipy.signal.butter(4, self.band, btype='bandpass', fs=sample_rate, output='sos')
+        self.zi = np.zeros((self.sos.shape[0], 2))
+        self.pending = np.empty(0)
+        self.contour = []
+
+    def process(self, block):
+        filtered, self.zi = scipy.signal.sosfilt(self.sos, block.astype(np.float64), zi=self.zi)
+        samples = np.concatenate([self.pending, filtered])
+        full = len(samples) // self.frame_samples * self.frame_samples
+        power = np.mean(np.square(samples[:full].reshape(-1, self.frame_samples)), axis=1)
+        self.contour.extend(10 * np.log10(power + 1e-12))
+        self.pending = samples[full:]
+
+    def finish(self):
+        if not self.contour:
+            return 0, 0.0, 0.0
+        intensity = np.array(self.contour)
+        smoothed = np.convolve(np.pad(intensity, 2, mode='edge'), np.ones(5) / 5, mode='valid')
+
+        floor = np.percentile(smoothed, 10)
+        voiced = smoothed > max(np.max(smoothed) - self.silence_db, floor + self.floor_margin_db)
+        if not np.any(voiced):
+            return 0, 0.0, 0.0
+
+        threshold = np.median(smoothed[voiced])
+        peaks, _ = scipy.signal.find_peaks(
+            smoothed,
+            height=threshold,
+            prominence=self.min_prominence_db,
+            distance=max(1, int(self.min_syllable_gap / self.frame_duration))
+        )
+        if len(peaks) == 0:
+            return 0, 0.0, 0.0
+
+        # Speech spans from the voiced stretch around the first nucleus to the one around the last
+        start, end = peaks[0], peaks[-1]
+        while start > 0 and voiced[start - 1]:
+            start -= 1
+        while end < len(voiced) - 1 and voiced[end + 1]:
+            end += 1
+        words = len(peaks) / self.syllables_per_word
+        return words, start * self.frame_duration, (end + 1) * self.frame_duration
+
+
+SPEECH_BACKENDS = {
+    'deepgram': DeepgramSpeech,
+    'whisper': WhisperSpeech,
+    'syllables': SyllableSpeech,
+}
+
+
+class SpeechRateConsumer(AudioConsumer):
+    """
+    Streams the soundtrack into a speech backend (see SPEECH_BACKENDS) and
+    scores the words per minute it reports. Every backend measures speech the
+    same way, words over the span from the first word to the last, so their
+    rates are directly comparable.
+    """
+    min_wpm = 5  # Words per minute scoring 1...
+    max_wpm = 90  # ...and 10
+    scoring = ('min_wpm', 'max_wpm')
+
+    def __init__(self, backend=None):
+        self.backend_name = backend or DEFAULT_SPEECH_BACKEND
+        if self.backend_name not in SPEECH_BACKENDS:
+            raise ValueError(f"Unknown speech backend: {self.backend_name}")
+
+    def start(self, sample_rate):
+        super().start(sample_rate)
+        self.backend = SPEECH_BACKENDS[self.backend_name]()
+        self.backend.start(sample_rate)
+
+    def process(self, block):
+        self.backend.process(block)
+
+    def signals(self):
+        return {'word_count': self.word_count, 'start': self.start_time, 'end': self.end_time}
+
+    @classmethod
+    def rescore(cls, runs, min_wpm, max_wpm):
+        return speech_rate_from_span(scalars(runs, 'word_count'), scalars(runs, 'start'), scalars(runs, 'end'),
+                                     min_wpm, max_wpm)
+
+    def remote_request(self):
+        """
+        For backends that wait on a remote service, what they still have to
+        send once the soundtrack is streamed, instead of finishing; None for
+        the others. See finish_remote().
+        """
+        return self.backend.request() if getattr(self.backend, 'remote', False) else None
+
+    async def finish_remote(self, request):
+        """finish() for a remote_request(), awaited on an event loop by any consumer with the same settings."""
+        self.word_count, self.start_time, self.end_time = await SPEECH_BACKENDS[self.backend_name].transcribe(request)
+        return self._score()
+
+    def finish(self):
+        self.word_count, self.start_time, self.end_time = self.backend.finish()
+        return self._score()
+
+    def _score(self):
+        if self.word_count < 2:
+            log.warning("Not enough words to compute speech rate", words=self.word_count)
+        elif self.end_time > self.start_time:
+            log.info("Words per minute", wpm=round(self.word_count / ((self.end_time - self.start_time) / 60.0), 2))
+        return self.score_signals()
 
-    start_time = timestamps[0]
-    end_time = max(w.get('end', 0) for w in words)
-    duration_minutes = (end_time - start_time) / 60.0
-    if duration_minutes <= 0:
-        return 1.0
 
-    wpm = len(words) / duration_minutes
-    print(f"Words per minute: {wpm:.2f}")
+def speech_rate_from_span(word_count, start_time, end_time, min_wpm=5, max_wpm=90):
+    """Computes the speech rate score from word counts over spans of seconds (numbers or arrays)."""
+    duration_minutes = (np.asarray(end_time) - start_time) / 60.0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        wpm = word_count / duration_minutes
 
-    # Map 5 WPM → 1 and 90 WPM → 10 (clamped)
-    min_wpm = 5
-    max_wpm = 90
+    # Map min_wpm → 1 and max_wpm → 10 (clamped)
     normalized = (wpm - min_wpm) / (max_wpm - min_wpm)
-    normalized = max(0, min(1, normalized))  # Clamp to [0, 1]
+    normalized = np.clip(normalized, 0, 1)  # Clamp to [0, 1]
     score = 1 + 9 * normalized
-    return score
+    return np.where((np.asarray(word_count) >= 2) & (duration_minutes > 0), score, 1.0)
 
 
+def speech_rate_score(video_path: str, backend=None) -> float:
+    """Computes the speech rate score from video with the configured speech backend."""
+    return run_audio_consumer(video_path, SpeechRateConsumer(backend))
@@ -0,0 +1,144 @@
+import os
+import uuid
+import hashlib
+import threading
+import cv2
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.sansio.multipart import MultipartDecoder, NeedData, Field, File, Data, Epilogue
+
+# Uploaded and downloaded videos. With analysis workers on other machines
+# (see worker.py) it must be a volume they all mount; jobs name videos by file name only.
+UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
+UPLOAD_CHUNK_SIZE = 64 * 1024  # Must stay below the decoder's max_form_memory_size
+# Try reading the container header once this much of the upload is on disk,
+# so fps and frame count are known before the body has fully arrived
+UPLOAD_PROBE_AFTER_MB = float(os.environ.get('UPLOAD_PROBE_AFTER_MB', 4))
+
+
+def probe_video(path):
+    """fps, frame count, duration and size of a (possibly partial) video, or None if unreadable."""
+    cap = cv2.VideoCapture(path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if not cap.isOpened() or not fps or frame_count <= 0:
+            return None
+        return {
+            'fps': fps,
+            'frame_count': frame_count,
+            'duration': round(frame_count / fps, 2),
+            'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+        }
+    finally:
+        cap.release()
+
+
+class StoredUpload:
+    """
+    A video written to the upload folder chunk by chunk as it arrives.
+    The size and SHA-256 content hash are computed in the same pass, and the
+    metadata is probed in the background as soon as enough of the file is
+    on disk (containers with the index at the end are probed once complete).
+    """
+
+    def __init__(self, folder, original_name, probe_after=None):
+        self.original_name = original_name
+        self.filename = str(uuid.uuid4()) + os.path.splitext(original_name)[1]
+        self.filepath = os.path.join(folder, self.filename)
+        self.size = 0
+        self.content_hash = None
+        self.metadata = None
+        self.probed_at = None
+        self.probe_after = probe_after if probe_after is not None else int(UPLOAD_PROBE_AFTER_MB * 1024 * 1024)
+        self._digest = hashlib.sha256()
+        self._file = open(self.filepath, 'wb')
+        self._probe = None
+
+    def write(self, data):
+        self._file.write(data)
+        self._digest.update(data)
+        self.size += len(data)
+        if self._probe is None and self.size >= self.probe_after:
+            self._file.flush()
+            self._probe = threading.Thread(target=self._probe_partial, args=(self.size,), daemon=True)
+            self._probe.start()
+
+    def _probe_partial(self, size):
+        self.metadata = probe_video(self.filepath)
+        if self.metadata is not None:
+            self.probed_at = size
+
+    def close(self):
+        self._file.close()
+        self.content_hash = self._digest.hexdigest()
+        if self._probe is not None:
+            self._probe.join()
+        if self.metadata is None:
+            self.metadata = probe_video(self.filepath)
+            self.probed_at = self.size
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self.filepath):
+            os.remove(self.filepath)
+
+
+def receive_upload(request, folder, file_field='video', max_form_memory_size=500 * 1024):
+    """
+    Read a form POST without buffering its file in memory.
+
+    Multipart bodies are parsed straight off request.stream, and the
+    file_field part is streamed into a StoredUpload in folder. Returns
+    (fields, upload), where fields holds the plain form fields and upload is
+    None when no file was sent. Other encodings fall back to request.form.
+    """
+    if request.mimetype != 'multipart/form-data':
+        return request.form.to_dict(), None
+
+    boundary = request.mimetype_params.get('boundary', '').encode()
+    decoder = MultipartDecoder(boundary, max_form_memory_size)
+    fields = {}
+    upload = None
+    part = None  # (name, upload or bytearray or None) of the part being read
+    ended = False
+    try:
+        while True:
+            event = decoder.next_event()
+            if isinstance(event, NeedData):
+                if ended:
+                    raise ValueError("Upload ended before the form was complete")
+                chunk = request.stream.read(UPLOAD_CHUNK_SIZE)
+                decoder.receive_data(chunk or None)
+                ended = not chunk
+            elif isinstance(event, File):
+                if event.name == file_field and upload is None:
+                    upload = StoredUpload(folder, event.filename or '')
+                    part = (event.name, upload)
+                else:
+                    part = (event.name, None)  # Unexpected files are skipped
+            elif isinstance(event, Field):
+                part = (event.name, bytearray())
+            elif isinstance(event, Data):
+                name, sink = part
+                if sink is not None:
+                    if isinstance(sink, bytearray):
+                        sink += event.data
+                        if len(sink) > max_form_memory_size:
+                            raise RequestEntityTooLarge()
+                    else:
+                        sink.write(event.data)
+                if not event.more_data:
+                    if isinstance(sink, bytearray):
+                        fields[name] = sink.decode('utf-8', 'replace')
+                    part = None
+            elif isinstance(event, Epilogue):
+                break
+    except Exception:
+        if upload is not None:
+            upload.discard()
+        raise
+
+    if upload is not None:
+        upload.close()
+    return fields, upload
@@ -0,0 +1,127 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from analysis_pool import run_all_analyzers, new_progress
+from analyzers import analyzer_fingerprints, rescore_signals, VIDEO_ANALYZERS
+from result_cache import ResultCache, file_sha256
+from feature_store import FeatureStore
+from downloads import Download
+from upload_store import UPLOAD_FOLDER
+from profiles import DEFAULT_PROFILE
+from logs import get_logger
+
+result_cache = ResultCache()
+feature_store = FeatureStore()
+log = get_logger(__name__)
+
+
+def analyze_video(filepath, filename, progress=None, content_hash=None, download=None, profile=None,
+                  timings=None):
+    """
+    Score a saved video with an analysis profile, reusing cached scores where possible.
+    Analyzers whose scoring parameters changed since the video was last
+    analyzed are re-scored from its stored signals instead of decoding it
+    again, and the signals of every new analysis are stored.
+    With a download in progress, the video analyzers start on the growing
+    file straight away when its container allows it, unless the video the
+    URL last downloaded to still has every video score cached; the cache is
+    consulted once the download is complete, and an analysis started during
+    it is ignored if the downloaded content turns out to be cached after all.
+    Returns the JSON-able result that /analyze responds with; the seconds
+    each stage took are added to timings, if given.
+    """
+    start_total = time.time()
+    timings = {} if timings is None else timings
+    fingerprints = analyzer_fingerprints(profile=profile)
+    early = None
+    if download is not None:
+        known_hash = result_cache.url_hash(download.video_url)
+        video_fingerprints = {key: fingerprints[key] for key in VIDEO_ANALYZERS}
+        if known_hash is not None and result_cache.has(known_hash, video_fingerprints):
+            log.info("♻️ Video URL seen before, checking the cache once it is downloaded", url=download.video_url)
+        elif download.wait_streamable():
+            log.info("⏩ Analyzing video while it downloads", path=filepath)
+            executor = ThreadPoolExecutor(max_workers=1)
+            early = executor.submit(run_all_analyzers, filepath, list(VIDEO_ANALYZERS), progress, 'growing', profile)
+            executor.shutdown(wait=False)
+        download.wait()
+        content_hash = download.content_hash
+
+    content_hash = content_hash or file_sha256(filepath)
+    if download is not None:
+        result_cache.put_url(download.video_url, content_hash)
+    scores = result_cache.get(content_hash, fingerprints)
+    if early is not None and all(key in scores for key in VIDEO_ANALYZERS):
+        log.info("♻️ Ignoring the analysis started during the download", content_hash=content_hash)
+        early = None  # Still runs to its end, but every score it would give is cached
+    pending = [key for key in fingerprints if early is None or key not in VIDEO_ANALYZERS]
+    scores = {key: score for key, score in scores.items() if key in pending}
+    if scores:
+        log.info("♻️ Reusing cached scores", analyzers=list(scores), content_hash=content_hash)
+        if progress is not None:
+            for key in scores:
+                progress[key] = {'done': True, 'cached': True}
+
+    missing = [key for key in pending if key not in scores]
+    signal_fingerprints = analyzer_fingerprints(profile=profile, scoring=False)
+    stored = feature_store.get(content_hash, {key: signal_fingerprints[key] for key in missing}) if missing else {}
+    if stored:
+        t0 = time.time()
+        rescored = {key: float(rescore_signals(key, [signals], profile)[0]) for key, signals in stored.items()}
+        result_cache.put(content_hash, fingerprints, rescored)
+        scores.update(rescored)
+        timings['Re-scoring Stored Signals'] = round(time.time() - t0, 3)
+        log.info("♻️ Re-scored stored signals", analyzers=list(rescored), content_hash=content_hash)
+        if progress is not None:
+            for key in rescored:
+                progress[key] = {'done': True, 'cached': True}
+        missing = [key for key in missing if key not in rescored]
+
+    if missing:
+        log.info("📋 Starting parallel analysis", analyzers=missing, profile=profile)
+        new_scores, new_timings, new_signals = run_all_analyzers(filepath, missing, progress, profile=profile)
+        result_cache.put(content_hash, fingerprints, new_scores)
+        feature_store.put(content_hash, signal_fingerprints, new_signals)
+        scores.update(new_scores)
+        timings.update(new_timings)
+
+    if early is not None:
+        video_scores, video_timings, video_signals = early.result()
+        result_cache.put(content_hash, fingerprints, video_scores)
+        feature_store.put(content_hash, signal_fingerprints, video_signals)
+        scores.update(video_scores)
+        timings.update(video_timings)
+
+    final_score = round(sum(scores.values()) / len(scores), 2)
+    total_time = round(time.time() - start_total, 2)
+
+    log.info("📊 Analysis summary", filename=filename, timings=timings, final_score=final_score,
+             total_seconds=total_time)
+
+    return {
+        'filename': filename,
+        'profile': profile or DEFAULT_PROFILE,
+        'scene_change': scores['scene'],
+        'camera_movement': scores['camera'],
+        'flashing_effects': scores['flash'],
+        'color': scores['color'],
+        'object_density': scores['density'],
+        'animation': scores['animation'],
+        'facial_expression_intensity': scores['expression'],
+        'fantastical_content': scores['fancy'],
+        'narrative_coherence': scores['narrative'],
+        'audio_overwhelm': scores['audio'],
+        'speech_rate': scores['speech_rate'],
+        'final_score': final_score
+    }
+
+
+def run_analysis_job(job, filename, filepath, video_url=None, content_hash=None, profile=None):
+    job.progress = new_progress()
+    download = Download(video_url, filepath, job.progress).start() if video_url else None
+    return analyze_video(filepath, filename, job.progress, content_hash, download, profile)
+
+
+def analyze_stored_video(job, filename, video_url=None, content_hash=None, profile=None):
+    """The 'analyze' task of broker jobs: run_analysis_job on a video in this worker's upload folder."""
+    return run_analysis_job(job, filename, os.path.join(UPLOAD_FOLDER, filename), video_url, content_hash, profile)
@@ -0,0 +1,107 @@
+import os
+import time
+import uuid
+import signal
+import socket
+import threading
+from analysis_pool import get_process_pool, ANALYSIS_EXECUTOR
+from broker import get_broker
+from jobs import JOB_WORKERS
+from video_analysis import analyze_stored_video
+from batch import run_batch_job
+from logs import get_logger
+from metrics import serve_metrics, REQUEST_QUEUE_SECONDS, REQUEST_SECONDS
+
+WORKER_POLL_SECONDS = float(os.environ.get('WORKER_POLL_SECONDS', 1))  # Wait between claims while the queue is empty
+
+# The web tier's /metrics only sees its own processes, so every worker serves
+# its metrics (and its analysis pool's) for Prometheus to scrape; 0 disables.
+# Give each worker on a host its own port.
+WORKER_METRICS_PORT = int(os.environ.get('WORKER_METRICS_PORT', 9100))
+
+# Task names the web tier queues jobs under
+TASKS = {
+    'analyze': analyze_stored_video,
+    'batch': run_batch_job,
+}
+
+log = get_logger('worker')
+
+
+class Worker:
+    """
+    Analysis worker: runs jobs from the broker on `slots` threads. A job's
+    lease is renewed (and its progress published) every third of the lease
+    while it runs, so the broker only hands it to another worker if this
+    one dies. stop() lets the running jobs finish and claims no more.
+    """
+
+    def __init__(self, broker, slots=JOB_WORKERS, poll=WORKER_POLL_SECONDS):
+        self.broker = broker
+        self.slots = slots
+        self.poll = poll
+        self.id = f'{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}'
+        self._stopping = threading.Event()
+
+    def run(self):
+        log.info("👷 Worker started", worker=self.id, slots=self.slots, executor=ANALYSIS_EXECUTOR)
+        threads = [threading.Thread(target=self._work, daemon=True) for _ in range(self.slots)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        log.info("👋 Worker stopped", worker=self.id)
+
+    def stop(self, *_):
+        self._stopping.set()
+
+    def _work(self):
+        while not self._stopping.is_set():
+            job = self.broker.claim(self.id)
+            if job is None:
+                self._stopping.wait(self.poll)
+                continue
+            self._run(job)
+
+    def _heartbeat(self, job, done):
+        while not done.wait(self.broker.lease_seconds / 3):
+            try:
+                if not self.broker.heartbeat(job, self.id):
+                    log.warning("⚠️ Lost the lease on a job", job=job.id, worker=self.id)
+                    return
+            except Exception:
+                log.exception("❌ Heartbeat failed", job=job.id)
+
+    def _run(self, job):
+        started_at = time.time()
+        REQUEST_QUEUE_SECONDS.observe(started_at - job.created_at)
+        log.info("🏗️ Running job", job=job.id, task=job.task, attempt=job.attempts, worker=self.id)
+        done = threading.Event()
+        threading.Thread(target=self._heartbeat, args=(job, done), daemon=True).start()
+        result = error = None
+        try:
+            result = TASKS[job.task](job, *job.args)
+        except Exception as e:
+            log.exception("❌ Job failed", job=job.id)
+            error = str(e) or type(e).__name__
+        finally:
+            done.set()
+
+        status = 'failed' if error is not None else 'done'
+        if self.broker.finish(job, self.id, result, error):
+            REQUEST_SECONDS.labels('jobs', status).observe(time.time() - job.created_at)
+            log.info("✅ Job finished", job=job.id, status=status, seconds=round(time.time() - started_at, 2))
+        else:
+            log.warning("⚠️ Job finished after its lease passed to another worker", job=job.id, worker=self.id)
+
+
+if __name__ == '__main__':
+    if WORKER_METRICS_PORT:
+        serve_metrics(WORKER_METRICS_PORT)
+        log.info("📈 Serving worker metrics", port=WORKER_METRICS_PORT)
+    if ANALYSIS_EXECUTOR == 'process':
+        get_process_pool()  # Warm the analysis workers before the first job
+    worker = Worker(get_broker())
+    signal.signal(signal.SIGTERM, worker.stop)
+    signal.signal(signal.SIGINT, worker.stop)
+    worker.run()